@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+from src.rag.embedding import iter_text_chunks
+from src.rag.embedding.embedding import PAGE_SEPARATOR, DIGITS_PATTERN, iter_pdf_pages, strip_references
+from src.utils import clean_texts
+
+# Separators of the RecursiveCharacterTextSplitter replaced by the chunker
+REFERENCE_SEPARATORS = [
+  r"\n*#{2,6}\s+(?:\*{2})?(?:[A-Z]|\d+).+(?:\*{2})?",
+  r"\n*(?<![ \t\r\f\v\w#,*])\s*(?:\*{2})?\d+(?!\s*[kK])(?:\.\d+)*(?:\*{2})?\s+(?:\*{2})?[A-Z].+(?:\*{2})?",
+  r"\n*-----",
+  r"\n*Table\s*\d+:\s*[A-Z].+",
+  r"\n{3,}",
+  "\n\n",
+  "\n",
+  " "
+]
+
+
+def parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description="Benchmark PDF chunking against the RecursiveCharacterTextSplitter pipeline")
+  parser.add_argument("--pdf", default=os.path.join(project_root, "data", "halueval.pdf"))
+  parser.add_argument("--chunk-size", type=int, default=1000)
+  parser.add_argument("--chunk-overlap", type=int, default=100)
+  parser.add_argument("--min-chunk-size", type=int, default=100)
+  parser.add_argument("--repeat", type=int, default=20, help="Number of timed runs of each pipeline")
+  parser.add_argument("--output", default=None, help="Write the report to a JSON file")
+  return parser.parse_args()
+
+
+def iter_reference_chunks(pages: list, chunk_size: int, chunk_overlap: int, min_chunk_size: int):
+  """
+    Chunk the pages like `iter_text_chunks` did with a RecursiveCharacterTextSplitter
+  """
+  splitter = RecursiveCharacterTextSplitter(
+    chunk_size=chunk_size,
+    chunk_overlap=chunk_overlap,
+    is_separator_regex=True,
+    add_start_index=True,
+    separators=REFERENCE_SEPARATORS
+  )
+  buffer = ""
+  buffer_offset = 0
+  buffer_page = 1
+  in_references = False
+
+  def to_documents(chunks: list) -> list:
+    chunks = [chunk for chunk in chunks if len(chunk.page_content) > min_chunk_size]
+    documents = []
+    for chunk, text in zip(chunks, clean_texts([chunk.page_content for chunk in chunks])):
+      start_index = max(chunk.metadata["start_index"], 0)
+      documents.append(Document(
+        page_content=text,
+        metadata={
+          "start_index": buffer_offset + start_index,
+          "page": buffer_page + buffer.count(PAGE_SEPARATOR, 0, start_index)
+        }
+      ))
+    return documents
+
+  for page_text in pages:
+    page_text, in_references = strip_references(page_text, in_references)
+    buffer += DIGITS_PATTERN.sub(r"\1\2\3", page_text)
+    chunks = splitter.create_documents([buffer])
+    last_start = chunks[-1].metadata["start_index"] if chunks else -1
+    if len(chunks) < 2 or last_start <= 0:
+      continue
+    yield from to_documents(chunks[:-1])
+    buffer_page += buffer.count(PAGE_SEPARATOR, 0, last_start)
+    buffer_offset += last_start
+    buffer = buffer[last_start:]
+
+  yield from to_documents(splitter.create_documents([buffer]))
+
+
+def measure(run, repeat: int) -> tuple:
+  """
+    Return the output of the first run & the timings of all runs
+  """
+  timings = []
+  output = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    chunks = run()
+    timings.append(time.perf_counter() - start)
+    output = output if output is not None else chunks
+  return output, timings
+
+
+def main():
+  args = parse_args()
+
+  # Extract the pages once, so that only chunking is measured
+  start = time.perf_counter()
+  pages = [page_text for _, page_text in iter_pdf_pages(args.pdf)]
+  print(f"Extracted {len(pages)} pages of {args.pdf} in {time.perf_counter() - start:.1f}s")
+
+  params = (args.chunk_size, args.chunk_overlap, args.min_chunk_size)
+  reference, reference_timings = measure(lambda: list(iter_reference_chunks(pages, *params)), args.repeat)
+  chunks, timings = measure(lambda: list(iter_text_chunks(pages, *params)), args.repeat)
+
+  # Compare the chunks with the reference ones
+  pairs = list(zip(reference, chunks))
+  report = {
+    "chunk_size": args.chunk_size,
+    "chunk_overlap": args.chunk_overlap,
+    "num_pages": len(pages),
+    "num_chunks": {"reference": len(reference), "chunker": len(chunks)},
+    "mismatches": {
+      "text": sum(expected.page_content != chunk.page_content for expected, chunk in pairs),
+      "start_index": sum(expected.metadata["start_index"] != chunk.metadata["start_index"] for expected, chunk in pairs),
+      "page": sum(expected.metadata["page"] != chunk.metadata["page"] for expected, chunk in pairs)
+    },
+    "latency_ms": {
+      "reference": float(np.median(reference_timings) * 1000),
+      "chunker": float(np.median(timings) * 1000)
+    }
+  }
+  report["speedup"] = report["latency_ms"]["reference"] / report["latency_ms"]["chunker"]
+
+  # Print the report
+  print(f"\nchunks: {len(reference)} (reference) / {len(chunks)} (chunker)")
+  print("mismatches: " + ", ".join(f"{name} {count}" for name, count in report["mismatches"].items()))
+  print(f"median latency: {report['latency_ms']['reference']:.2f} ms (reference) / {report['latency_ms']['chunker']:.2f} ms (chunker)")
+  print(f"speedup: {report['speedup']:.2f}x")
+
+  if args.output:
+    with open(args.output, "w", encoding="utf-8") as file:
+      json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+from src.db import get_vector_store, reciprocal_rank_fusion
+from src.db.local import LocalVectorStore
+from src.rag import CustomMultiQueryRetriever, embed_pdf, get_embedding_function, get_rerank_function
+from src.rag.embedding import embed_texts
+from src.utils import clean_text, clean_texts
+
+# Replays the eval queries against the paper with the LLM stages stubbed out:
+# each user input is used as the only rewritten query, so only retrieval is measured
+STAGES = ["embed", "dense_search", "sparse_search", "fusion", "rerank", "total"]
+
+
+def parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description="Benchmark retrieval latency, throughput & recall on the eval dataset")
+  parser.add_argument("--pdf", default=os.path.join(project_root, "data", "halueval.pdf"))
+  parser.add_argument("--dataset", default=os.path.join(project_root, "data", "eval", "eval_dataset.json"))
+  parser.add_argument("--backend", choices=["local", "milvus"], default="local", help="local indexes into a temporary directory")
+  parser.add_argument("--limit", type=int, default=10, help="Number of hybrid search results per query")
+  parser.add_argument("--top-k", type=int, default=5, help="Number of reranked documents kept per query")
+  parser.add_argument("--rerank-mode", choices=["full", "cascade"], default="full")
+  parser.add_argument("--concurrency", default="1,2,4,8", help="Comma separated numbers of concurrent clients")
+  parser.add_argument("--output", default=None, help="Write the report to a JSON file")
+  return parser.parse_args()
+
+
+def tokenize(text: str) -> set:
+  return set(clean_text(text).split())
+
+
+def is_match(retrieved: str, reference: str, threshold: float = 0.8) -> bool:
+  """
+    Chunk boundaries may differ from the ones the references were built with, so compare token overlap
+  """
+  retrieved_tokens, reference_tokens = tokenize(retrieved), tokenize(reference)
+  if not retrieved_tokens or not reference_tokens:
+    return False
+  overlap = len(retrieved_tokens & reference_tokens) / min(len(retrieved_tokens), len(reference_tokens))
+  return overlap >= threshold
+
+
+def recall_at_k(retrieved: list, references: list, k: int) -> float:
+  if not references:
+    return 0.0
+  found = sum(any(is_match(doc, reference) for doc in retrieved[:k]) for reference in references)
+  return found / len(references)
+
+
+def reciprocal_rank(retrieved: list, references: list) -> float:
+  for rank, doc in enumerate(retrieved, start=1):
+    if any(is_match(doc, reference) for reference in references):
+      return 1.0 / rank
+  return 0.0
+
+
+def percentiles(values: list) -> dict:
+  values = np.asarray(values) * 1000 # Milliseconds
+  return {
+    "p50": float(np.percentile(values, 50)),
+    "p95": float(np.percentile(values, 95)),
+    "p99": float(np.percentile(values, 99)),
+    "mean": float(values.mean())
+  }
+
+
+def run_stages(query: str, config: dict, retriever: CustomMultiQueryRetriever, limit: int) -> tuple:
+  """
+    Retrieve documents for one query, timing each stage
+  """
+  vector_store = get_vector_store(config)
+  doc_ids = config["configurable"]["doc_ids"]
+  timings = {}
+
+  start = time.perf_counter()
+  embeddings = embed_texts([query], config)
+  timings["embed"] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  dense_hits = vector_store.dense_search(embeddings["dense"], limit, doc_ids)[0]
+  timings["dense_search"] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  sparse_hits = vector_store.sparse_search(embeddings["sparse"], limit, doc_ids)[0]
+  timings["sparse_search"] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  fused_hits = reciprocal_rank_fusion([dense_hits, sparse_hits], limit)
+  timings["fusion"] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  fused_docs = [hit["text"] for hit in fused_hits]
+  reranked_docs = [hit["text"] for hit in retriever.rerank_hits_batch([query], [fused_hits])[0]]
+  timings["rerank"] = time.perf_counter() - start
+
+  timings["total"] = sum(timings.values())
+  return timings, fused_docs, reranked_docs
+
+
+def measure_throughput(queries: list, config: dict, args: argparse.Namespace, concurrency: int) -> float:
+  """
+    Return the number of queries per second served by `concurrency` clients
+  """
+  def retrieve(query: str):
+    return CustomMultiQueryRetriever(queries=[query], config=config, limit=args.limit, top_k=args.top_k).get_relevant_documents()
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    list(executor.map(retrieve, queries))
+  return len(queries) / (time.perf_counter() - start)
+
+
+def main():
+  args = parse_args()
+  with open(args.dataset, "r", encoding="utf-8") as file:
+    dataset = json.load(file)
+
+  # No embedding cache, so the embedding cost is measured on every query
+  config = {
+    "configurable": {
+      "embedding_function": get_embedding_function(),
+      "rerank_function": get_rerank_function(),
+      "rerank_mode": args.rerank_mode,
+      "doc_ids": []
+    }
+  }
+  if args.backend == "local":
+    config["configurable"]["vector_store"] = LocalVectorStore(tempfile.mkdtemp(prefix="retrieval_benchmark_"))
+
+  start = time.perf_counter()
+  config["configurable"]["doc_ids"].append(embed_pdf(args.pdf, config))
+  print(f"Indexed {args.pdf} in {time.perf_counter() - start:.1f}s")
+
+  retriever = CustomMultiQueryRetriever(queries=[], config=config, limit=args.limit, top_k=args.top_k)
+  queries = clean_texts([sample["user_input"] for sample in dataset])
+
+  # Warm up the models before measuring
+  run_stages(queries[0], config, retriever, args.limit)
+
+  timings = {stage: [] for stage in STAGES}
+  metrics = {"fused_recall": [], "fused_mrr": [], "reranked_recall": [], "reranked_mrr": []}
+  for query, sample in zip(queries, dataset):
+    query_timings, fused_docs, reranked_docs = run_stages(query, config, retriever, args.limit)
+    for stage in STAGES:
+      timings[stage].append(query_timings[stage])
+    references = sample.get("retrieved_contexts", [])
+    metrics["fused_recall"].append(recall_at_k(fused_docs, references, args.limit))
+    metrics["fused_mrr"].append(reciprocal_rank(fused_docs, references))
+    metrics["reranked_recall"].append(recall_at_k(reranked_docs, references, args.top_k))
+    metrics["reranked_mrr"].append(reciprocal_rank(reranked_docs, references))
+
+  report = {
+    "backend": args.backend,
+    "rerank_mode": args.rerank_mode,
+    "limit": args.limit,
+    "top_k": args.top_k,
+    "num_queries": len(queries),
+    "latency_ms": {stage: percentiles(values) for stage, values in timings.items()},
+    "quality": {name: float(np.mean(values)) for name, values in metrics.items()},
+    "qps": {}
+  }
+  for concurrency in [int(level) for level in args.concurrency.split(",")]:
+    report["qps"][concurrency] = measure_throughput(queries, config, args, concurrency)
+
+  # Print the report
+  print(f"\n{'stage':<15}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}  (ms)")
+  for stage, stats in report["latency_ms"].items():
+    print(f"{stage:<15}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}{stats['mean']:>10.2f}")
+  print(f"\nrecall@{args.limit} (fused): {report['quality']['fused_recall']:.3f}  MRR: {report['quality']['fused_mrr']:.3f}")
+  print(f"recall@{args.top_k} (reranked): {report['quality']['reranked_recall']:.3f}  MRR: {report['quality']['reranked_mrr']:.3f}")
+  for concurrency, qps in report["qps"].items():
+    print(f"concurrency {concurrency}: {qps:.2f} queries/sec")
+
+  if args.output:
+    with open(args.output, "w", encoding="utf-8") as file:
+      json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import pytest
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+import src.rag.retriever.retriever as retriever_module
+from src.rag.retriever import CustomMultiQueryRetriever
+
+QUERY = "how are the hallucinated samples generated"
+
+
+def make_hits(num_hits: int) -> list:
+  """
+    Search hits with close fused scores, so that none of them is decisive
+  """
+  return [
+    {"text": f"passage {i} " * (i + 1), "doc_id": "doc", "chunk_index": i, "page": 1, "score": 1.0 - 0.01 * i}
+    for i in range(num_hits)
+  ]
+
+
+@pytest.fixture
+def scored_pairs(monkeypatch):
+  """
+    Record the pairs scored by each reranker, which score longer passages higher
+  """
+  pairs_per_function = {"light": [], "cross_encoder": []}
+
+  def compute_rerank_scores(rerank_function, pairs):
+    pairs_per_function[rerank_function].extend(pairs)
+    return [float(len(passage)) for _, passage in pairs]
+
+  monkeypatch.setattr(retriever_module, "compute_rerank_scores", compute_rerank_scores)
+  return pairs_per_function
+
+
+def make_retriever(light: bool) -> CustomMultiQueryRetriever:
+  config = {
+    "configurable": {
+      "rerank_mode": "cascade",
+      "rerank_function": "cross_encoder",
+      "light_rerank_function": "light" if light else None
+    }
+  }
+  return CustomMultiQueryRetriever(queries=[QUERY], config=config, limit=10, top_k=5)
+
+
+def test_light_reranker_prunes_candidates(scored_pairs):
+  hits = make_retriever(light=True).rerank_hits_batch([QUERY], [make_hits(10)])[0]
+
+  # The light reranker scores every candidate, the cross-encoder only the best half
+  assert len(scored_pairs["light"]) == 10
+  assert len(scored_pairs["cross_encoder"]) == 5
+  assert {passage for _, passage in scored_pairs["cross_encoder"]} == {hit["text"] for hit in make_hits(10)[5:]}
+  assert [hit["chunk_index"] for hit in hits] == [9, 8, 7, 6, 5]
+
+
+def test_without_light_reranker(scored_pairs):
+  make_retriever(light=False).rerank_hits_batch([QUERY], [make_hits(10)])
+  assert scored_pairs["light"] == []
+  assert len(scored_pairs["cross_encoder"]) == 10
@@ -0,0 +1,151 @@
+import os
+import sys
+import threading
+import numpy as np
+import pytest
+from scipy import sparse as sp
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+import src.db.local as local_module
+from src.db.local import LocalVectorStore
+
+DIM = 16
+VOCAB_SIZE = 50
+
+
+def make_entities(doc_id: str, num_chunks: int, seed: int) -> dict:
+  """
+    Random chunks of a document, each one with 3 lexical weights
+  """
+  rng = np.random.default_rng(seed)
+  rows = np.repeat(np.arange(num_chunks), 3)
+  columns = rng.integers(0, VOCAB_SIZE, size=num_chunks * 3)
+  return {
+    "doc_id": [doc_id] * num_chunks,
+    "chunk_index": list(range(num_chunks)),
+    "page": [index // 2 + 1 for index in range(num_chunks)],
+    "text": [f"{doc_id} chunk {index}" for index in range(num_chunks)],
+    "sparse": sp.csr_matrix((rng.random(num_chunks * 3) + 0.1, (rows, columns)), shape=(num_chunks, VOCAB_SIZE)),
+    "dense": rng.standard_normal((num_chunks, DIM)).astype(np.float32)
+  }
+
+
+def make_store(path, dtype: str = "float32") -> tuple:
+  store = LocalVectorStore(str(path), dtype=dtype)
+  entities = [make_entities("doc-a", 8, 0), make_entities("doc-b", 6, 1)]
+  for document in entities:
+    store.insert(document)
+  store.flush()
+  return store, entities
+
+
+def test_insert_flush_search(tmp_path):
+  store, (doc_a, _) = make_store(tmp_path)
+
+  # A chunk is its own nearest neighbor
+  hits = store.dense_search(doc_a["dense"][[3]], limit=5)[0]
+  assert len(hits) == 5
+  assert (hits[0]["doc_id"], hits[0]["chunk_index"], hits[0]["page"]) == ("doc-a", 3, 2)
+  assert hits[0]["score"] == pytest.approx(1.0, abs=1e-5)
+  assert [hit["score"] for hit in hits] == sorted((hit["score"] for hit in hits), reverse=True)
+
+  hits = store.sparse_search(doc_a["sparse"][[3]], limit=5)[0]
+  assert (hits[0]["doc_id"], hits[0]["chunk_index"]) == ("doc-a", 3)
+  assert all(hit["score"] > 0 for hit in hits)
+
+  hits = store.hybrid_search(doc_a["dense"][[3]], doc_a["sparse"][[3]], limit=5)[0]
+  assert (hits[0]["doc_id"], hits[0]["chunk_index"]) == ("doc-a", 3)
+
+  # The flushed store is reloaded from disk
+  hits = LocalVectorStore(str(tmp_path)).dense_search(doc_a["dense"][[3]], limit=1)[0]
+  assert (hits[0]["doc_id"], hits[0]["chunk_index"]) == ("doc-a", 3)
+
+
+def test_pending_entities_are_indexed_but_not_searched(tmp_path):
+  store = LocalVectorStore(str(tmp_path))
+  entities = make_entities("doc-a", 4, 0)
+  store.insert(entities)
+  assert store.is_document_indexed("doc-a")
+  assert store.dense_search(entities["dense"][[0]], limit=5) == [[]]
+  store.flush()
+  assert len(store.dense_search(entities["dense"][[0]], limit=5)[0]) == 4
+
+
+def test_delete_document(tmp_path):
+  store, (doc_a, doc_b) = make_store(tmp_path)
+  store.delete_document("doc-a")
+  assert not store.is_document_indexed("doc-a")
+  assert store.is_document_indexed("doc-b")
+  hits = store.dense_search(doc_a["dense"][[0]], limit=20)[0]
+  assert len(hits) == 6
+  assert {hit["doc_id"] for hit in hits} == {"doc-b"}
+
+  # Pending entities of the document are dropped too
+  store.insert(make_entities("doc-c", 3, 2))
+  store.delete_document("doc-c")
+  assert not store.is_document_indexed("doc-c")
+
+
+def test_filter_by_doc_ids(tmp_path):
+  store, (doc_a, doc_b) = make_store(tmp_path)
+  hits = store.dense_search(doc_a["dense"][[0]], limit=20, doc_ids=["doc-b"])[0]
+  assert len(hits) == 6
+  assert {hit["doc_id"] for hit in hits} == {"doc-b"}
+  hits = store.sparse_search(doc_a["sparse"][[0]], limit=20, doc_ids=["doc-b"])[0]
+  assert {hit["doc_id"] for hit in hits} <= {"doc-b"}
+  assert store.dense_search(doc_a["dense"][[0]], limit=20, doc_ids=["doc-c"]) == [[]]
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float16", 1e-3), ("int8", 2e-2)])
+def test_quantized_scores_match_float32(tmp_path, dtype, tolerance):
+  reference, (doc_a, _) = make_store(tmp_path / "float32")
+  store, _ = make_store(tmp_path / dtype, dtype=dtype)
+  assert np.load(os.path.join(str(tmp_path / dtype), "dense.npy"), mmap_mode="r").dtype == np.dtype(dtype)
+
+  queries = doc_a["dense"][:4]
+  for query_hits, reference_hits in zip(store.dense_search(queries, limit=14), reference.dense_search(queries, limit=14)):
+    assert query_hits[0]["chunk_index"] == reference_hits[0]["chunk_index"]
+    expected = {(hit["doc_id"], hit["chunk_index"]): hit["score"] for hit in reference_hits}
+    for hit in query_hits:
+      assert hit["score"] == pytest.approx(expected[(hit["doc_id"], hit["chunk_index"])], abs=tolerance)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_blockwise_dense_search(tmp_path, monkeypatch, dtype):
+  store, (doc_a, _) = make_store(tmp_path, dtype=dtype)
+  queries = doc_a["dense"][:4]
+  expected = store.dense_search(queries, limit=14, doc_ids=["doc-a", "doc-b"])
+
+  # Blocks smaller than the store, the last one partial
+  monkeypatch.setattr(local_module, "DENSE_BLOCK_ROWS", 3)
+  for query_hits, expected_hits in zip(store.dense_search(queries, limit=14), expected):
+    assert [(hit["doc_id"], hit["chunk_index"]) for hit in query_hits] == [(hit["doc_id"], hit["chunk_index"]) for hit in expected_hits]
+    assert [hit["score"] for hit in query_hits] == pytest.approx([hit["score"] for hit in expected_hits], abs=1e-6)
+
+
+def test_searches_during_writes(tmp_path):
+  store, (doc_a, _) = make_store(tmp_path)
+  errors = []
+  done = threading.Event()
+
+  def search():
+    while not done.is_set():
+      try:
+        for hits in store.hybrid_search(doc_a["dense"][:2], doc_a["sparse"][:2], limit=5):
+          assert all(hit["text"] == f"{hit['doc_id']} chunk {hit['chunk_index']}" for hit in hits)
+      except Exception as e:
+        errors.append(e)
+        return
+
+  threads = [threading.Thread(target=search) for _ in range(4)]
+  for thread in threads:
+    thread.start()
+  for seed in range(10):
+    store.insert(make_entities(f"doc-{seed}", 5, seed + 10))
+    store.flush()
+    store.delete_document(f"doc-{seed}")
+  done.set()
+  for thread in threads:
+    thread.join()
+  assert errors == []
@@ -0,0 +1,41 @@
+import os
+import sys
+import pytest
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+pytest.importorskip("pymilvus")
+from src.db.milvus import DEFAULT_INDEX_CONFIG, get_index_config, is_same_index
+
+
+def test_defaults():
+  assert get_index_config() == DEFAULT_INDEX_CONFIG
+  assert get_index_config({}) == DEFAULT_INDEX_CONFIG
+
+
+def test_partial_sections_are_completed():
+  index_config = get_index_config({"dense_index": {"index_type": "HNSW"}, "sparse_search": {}})
+  # Params default to the ones of the new index type, not to the IVF ones
+  assert index_config["dense_index"] == {"index_type": "HNSW", "params": {"M": 16, "efConstruction": 200}}
+  assert index_config["dense_search"] == {"ef": 64}
+  assert index_config["sparse_index"] == DEFAULT_INDEX_CONFIG["sparse_index"]
+  assert index_config["sparse_search"] == DEFAULT_INDEX_CONFIG["sparse_search"]
+  assert is_same_index({"index_type": "HNSW", "params": {"M": "16", "efConstruction": "200"}}, index_config["dense_index"])
+
+  index_config = get_index_config({"dense_index": {"params": {"nlist": 256}}, "dense_search": {"nprobe": 8}})
+  assert index_config["dense_index"] == {"index_type": "IVF_FLAT", "params": {"nlist": 256}}
+  assert index_config["dense_search"] == {"nprobe": 8}
+
+
+@pytest.mark.parametrize("index_config", [
+  {"dense_index": {"index_type": "DISKANN"}},
+  {"sparse_index": {"index_type": "SPARSE_HNSW"}},
+  {"dense_index": {"index_type": "HNSW", "params": {"nlist": 128}}},
+  {"dense_index": {"index_type": "HNSW"}, "dense_search": {"nprobe": 16}},
+  {"dense_index": {"index_type": "IVF_FLAT", "params": {"nlist": 0}}},
+  {"dense_search": {"nprobe": "16"}},
+  {"sparse_search": {"drop_ratio_search": 1.0}}
+])
+def test_invalid_settings(index_config):
+  with pytest.raises(ValueError):
+    get_index_config(index_config)
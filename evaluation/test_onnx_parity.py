@@ -0,0 +1,78 @@
+import os
+import sys
+import numpy as np
+import pytest
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+from pymilvus.model.hybrid import BGEM3EmbeddingFunction
+from pymilvus.model.reranker import BGERerankFunction
+from src.rag.models.onnx_backend import OnnxBGEM3EmbeddingFunction, OnnxRerankFunction
+
+# Exported models are cached here, the first run exports them from the Hugging Face checkpoints
+MODEL_DIR = os.path.join(project_root, "data", "models", "onnx")
+
+TEXTS = [
+  "What is the main contribution in this paper?",
+  "HaluEval is a large-scale hallucination evaluation benchmark for large language models, "
+  "which contains generated and human-annotated hallucinated samples.",
+  "Các đóng góp chính là gì?",
+  "We propose a two-step framework, sampling-then-filtering, to automatically generate hallucinated samples. " * 8
+]
+QUERY = "how are the hallucinated samples generated in this paper"
+
+# Minimal agreement with the torch outputs: dense cosine similarity, sparse weight error & reranker score error
+TOLERANCES = {
+  False: {"cosine": 0.999, "sparse": 0.01, "rerank": 0.01},
+  True: {"cosine": 0.98, "sparse": 0.05, "rerank": 0.05}
+}
+
+
+@pytest.fixture(scope="module")
+def torch_embedding_function():
+  return BGEM3EmbeddingFunction(model_name="BAAI/bge-m3", device="cpu", use_fp16=False)
+
+
+@pytest.fixture(scope="module")
+def torch_rerank_function():
+  return BGERerankFunction(model_name="BAAI/bge-reranker-v2-m3", device="cpu")
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["fp32", "int8"])
+def onnx_embedding_function(request):
+  return OnnxBGEM3EmbeddingFunction.load("BAAI/bge-m3", MODEL_DIR, quantize=request.param)
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["fp32", "int8"])
+def onnx_rerank_function(request):
+  return OnnxRerankFunction.load("BAAI/bge-reranker-v2-m3", MODEL_DIR, quantize=request.param)
+
+
+def test_dense_parity(torch_embedding_function, onnx_embedding_function):
+  expected = np.asarray(torch_embedding_function(TEXTS)["dense"])
+  actual = np.asarray(onnx_embedding_function(TEXTS)["dense"])
+  cosine = (expected * actual).sum(axis=1) / (np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1))
+  assert cosine.min() >= TOLERANCES[onnx_embedding_function.quantize]["cosine"]
+
+
+def test_sparse_parity(torch_embedding_function, onnx_embedding_function):
+  expected = torch_embedding_function(TEXTS)["sparse"].toarray()
+  actual = onnx_embedding_function(TEXTS)["sparse"].toarray()
+  assert expected.shape == actual.shape
+  assert np.abs(expected - actual).max() <= TOLERANCES[onnx_embedding_function.quantize]["sparse"]
+
+
+def test_length_sorted_batching_keeps_order(onnx_embedding_function):
+  batched = onnx_embedding_function(TEXTS)
+  for i, text in enumerate(TEXTS):
+    single = onnx_embedding_function([text])
+    np.testing.assert_allclose(batched["dense"][i], single["dense"][0], atol=1e-4)
+    np.testing.assert_allclose(batched["sparse"][[i]].toarray(), single["sparse"].toarray(), atol=1e-4)
+
+
+def test_rerank_parity(torch_rerank_function, onnx_rerank_function):
+  pairs = [[QUERY, text] for text in TEXTS]
+  expected = np.asarray(torch_rerank_function.reranker.compute_score(pairs, normalize=True))
+  actual = np.asarray(onnx_rerank_function.compute_score(pairs))
+  assert np.abs(expected - actual).max() <= TOLERANCES[onnx_rerank_function.quantize]["rerank"]
+  assert np.argmax(expected) == np.argmax(actual)
@@ -0,0 +1,211 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import numpy as np
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+from pymilvus import utility
+from benchmark_retrieval import recall_at_k, percentiles
+from src.db.milvus import MilvusVectorStore, get_index_config
+from src.rag import embed_pdf, get_embedding_function
+from src.rag.embedding import embed_texts
+from src.utils import clean_texts
+
+# Exact search settings, the hits of which are the ground truth of the ANN recall
+EXACT_INDEX_CONFIG = {
+  "dense_index": {"index_type": "FLAT"},
+  "sparse_search": {"drop_ratio_search": 0.0}
+}
+
+
+def parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description="Sweep Milvus index & search settings on the eval queries & Pick the fastest one recalling enough")
+  parser.add_argument("--pdf", default=os.path.join(project_root, "data", "halueval.pdf"))
+  parser.add_argument("--pdf-dir", default=None, help="Directory of PDF files indexed along, searched recursively. Milvus does not index small segments, so a single paper is searched brute force")
+  parser.add_argument("--dataset", default=os.path.join(project_root, "data", "eval", "eval_dataset.json"))
+  parser.add_argument("--collection", default="index_tuning_collection", help="Collection indexed for the sweep, its indexes are rebuilt")
+  parser.add_argument("--limit", type=int, default=10, help="Number of hybrid search results per query")
+  parser.add_argument("--index-types", default="IVF_FLAT,IVF_SQ8,HNSW", help="Comma separated dense index types")
+  parser.add_argument("--nlist", default="64,128,256", help="Comma separated IVF numbers of clusters")
+  parser.add_argument("--nprobe", default="4,8,16,32", help="Comma separated IVF numbers of clusters searched")
+  parser.add_argument("--hnsw-m", default="8,16,32", help="Comma separated HNSW numbers of neighbors per node")
+  parser.add_argument("--ef-construction", type=int, default=200)
+  parser.add_argument("--ef", default="16,32,64,128", help="Comma separated HNSW search list sizes")
+  parser.add_argument("--drop-ratio-search", default="0,0.1,0.2,0.4", help="Comma separated ratios of sparse query weights ignored")
+  parser.add_argument("--min-recall", type=float, default=0.95, help="Minimal recall of the exact hybrid search hits")
+  parser.add_argument("--repeat", type=int, default=3, help="Number of timed passes over the queries")
+  parser.add_argument("--output", default=os.path.join(project_root, "data", "milvus_index.json"), help="Write the chosen settings, read through MILVUS_INDEX_CONFIG")
+  parser.add_argument("--report", default=None, help="Write the report to a JSON file")
+  return parser.parse_args()
+
+
+def parse_list(values: str, cast=int) -> list:
+  return [cast(value) for value in values.split(",") if value]
+
+
+def get_search_grid(args: argparse.Namespace) -> list:
+  """
+    Return the dense index settings to build, each one with the search settings to try on it
+  """
+  grid = []
+  for index_type in parse_list(args.index_types, str):
+    if index_type in ("IVF_FLAT", "IVF_SQ8"):
+      for nlist in parse_list(args.nlist):
+        grid.append(({"index_type": index_type, "params": {"nlist": nlist}}, [{"nprobe": nprobe} for nprobe in parse_list(args.nprobe) if nprobe <= nlist]))
+    elif index_type == "HNSW":
+      for m in parse_list(args.hnsw_m):
+        grid.append(({"index_type": index_type, "params": {"M": m, "efConstruction": args.ef_construction}}, [{"ef": ef} for ef in parse_list(args.ef)]))
+    elif index_type == "FLAT":
+      grid.append(({"index_type": index_type, "params": {}}, [{}]))
+    else:
+      raise ValueError(f"Unsupported dense index type: {index_type}")
+  return grid
+
+
+def run_queries(vector_store: MilvusVectorStore, embeddings: list, limit: int, doc_ids: list, repeat: int) -> tuple:
+  """
+    Search each query on its own like a chat turn does & Return the hits of each query with the search latencies
+  """
+  # Warm up the freshly loaded indexes before measuring
+  vector_store.hybrid_search(embeddings[0]["dense"], embeddings[0]["sparse"], limit, doc_ids)
+
+  hits, timings = [], []
+  for run in range(repeat):
+    for embedding in embeddings:
+      start = time.perf_counter()
+      query_hits = vector_store.hybrid_search(embedding["dense"], embedding["sparse"], limit, doc_ids)[0]
+      timings.append(time.perf_counter() - start)
+      if run == 0:
+        hits.append(query_hits)
+  return hits, timings
+
+
+def ann_recall(hits: list, exact_hits: list) -> float:
+  """
+    Return the mean share of the exact search hits found by the approximate search
+  """
+  recalls = []
+  for query_hits, query_exact_hits in zip(hits, exact_hits):
+    expected = {(hit["doc_id"], hit["chunk_index"]) for hit in query_exact_hits}
+    found = {(hit["doc_id"], hit["chunk_index"]) for hit in query_hits}
+    recalls.append(len(expected & found) / len(expected) if expected else 1.0)
+  return float(np.mean(recalls))
+
+
+def check_index_built(vector_store: MilvusVectorStore, timeout: float = 600) -> None:
+  """
+    Wait for the dense index to be built & Fail when rows were left out of it, since their search
+    would be brute force whatever the settings
+  """
+  collection = vector_store.collection
+  index = next(index for index in collection.indexes if index.field_name == "dense")
+  utility.wait_for_index_building_complete(collection.name, index_name=index.index_name, timeout=timeout)
+  progress = utility.index_building_progress(collection.name, index_name=index.index_name)
+  if progress["indexed_rows"] < progress["total_rows"]:
+    raise RuntimeError(
+      f"Milvus indexed {progress['indexed_rows']} of {progress['total_rows']} rows, the sweep would measure brute force search. "
+      "Index a larger corpus with --pdf-dir"
+    )
+
+
+def get_pareto_front(results: list) -> list:
+  """
+    Return the results no other result beats on both recall & latency, fastest first
+  """
+  front = []
+  for result in sorted(results, key=lambda result: (result["latency_ms"]["p50"], -result["recall"])):
+    if not front or result["recall"] > front[-1]["recall"]:
+      front.append(result)
+  return front
+
+
+def main():
+  args = parse_args()
+  with open(args.dataset, "r", encoding="utf-8") as file:
+    dataset = json.load(file)
+
+  vector_store = MilvusVectorStore(args.collection, EXACT_INDEX_CONFIG)
+  config = {
+    "configurable": {
+      "embedding_function": get_embedding_function(),
+      "vector_store": vector_store,
+      "doc_ids": []
+    }
+  }
+  # Index the corpus, searched as a whole by the eval queries
+  pdf_files = [args.pdf]
+  if args.pdf_dir:
+    pdf_files += sorted(glob.glob(os.path.join(args.pdf_dir, "**", "*.pdf"), recursive=True))
+  for pdf_file in dict.fromkeys(pdf_files):
+    config["configurable"]["doc_ids"].append(embed_pdf(pdf_file, config))
+  doc_ids = list(dict.fromkeys(config["configurable"]["doc_ids"]))
+
+  # Embed the queries once, so that only the search is measured
+  queries = clean_texts([sample["user_input"] for sample in dataset])
+  embeddings = [embed_texts([query], config) for query in queries]
+  references = [sample.get("retrieved_contexts", []) for sample in dataset]
+
+  exact_hits, _ = run_queries(vector_store, embeddings, args.limit, doc_ids, 1)
+
+  results = []
+  for dense_index, dense_searches in get_search_grid(args):
+    start = time.perf_counter()
+    vector_store.set_index_config({"dense_index": dense_index}) # Other settings are the default ones
+    if dense_index["index_type"] != "FLAT":
+      check_index_built(vector_store)
+    print(f"Built {dense_index['index_type']} {dense_index['params']} in {time.perf_counter() - start:.1f}s")
+
+    for dense_search in dense_searches:
+      for drop_ratio in parse_list(args.drop_ratio_search, float):
+        index_config = {
+          "dense_index": dense_index,
+          "dense_search": dense_search,
+          "sparse_search": {"drop_ratio_search": drop_ratio}
+        }
+        index_config = get_index_config(index_config)
+        vector_store.set_index_config(index_config) # Only search settings change, nothing is rebuilt
+        hits, timings = run_queries(vector_store, embeddings, args.limit, doc_ids, args.repeat)
+        results.append({
+          "index_config": index_config,
+          "recall": ann_recall(hits, exact_hits),
+          "context_recall": float(np.mean([
+            recall_at_k([hit["text"] for hit in query_hits], query_references, args.limit)
+            for query_hits, query_references in zip(hits, references)
+          ])),
+          "latency_ms": percentiles(timings)
+        })
+
+  # Pick the fastest settings recalling enough, else the ones recalling the most
+  front = get_pareto_front(results)
+  eligible = [result for result in front if result["recall"] >= args.min_recall]
+  chosen = eligible[0] if eligible else front[-1]
+
+  # Print the report
+  print(f"\nPareto front over {len(results)} settings, recall@{args.limit} of the exact hybrid search:")
+  print(f"{'dense index':<36}{'search':<16}{'drop':>6}{'recall':>8}{'context':>9}{'p50':>9}{'p95':>9}  (ms)")
+  for result in front:
+    index_config = result["index_config"]
+    dense_index = f"{index_config['dense_index']['index_type']} {json.dumps(index_config['dense_index']['params'])}"
+    print(
+      f"{dense_index:<36}{json.dumps(index_config['dense_search']):<16}{index_config['sparse_search']['drop_ratio_search']:>6}"
+      f"{result['recall']:>8.3f}{result['context_recall']:>9.3f}{result['latency_ms']['p50']:>9.2f}{result['latency_ms']['p95']:>9.2f}"
+      + ("  <- chosen" if result is chosen else "")
+    )
+  if not eligible:
+    print(f"\nNo settings reach a recall of {args.min_recall}, chose the ones recalling the most")
+
+  with open(args.output, "w", encoding="utf-8") as file:
+    json.dump(chosen["index_config"], file, indent=2)
+  print(f"\nWrote the chosen settings to {args.output}")
+
+  if args.report:
+    with open(args.report, "w", encoding="utf-8") as file:
+      json.dump({"limit": args.limit, "min_recall": args.min_recall, "chosen": chosen, "pareto_front": front, "results": results}, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+  main()
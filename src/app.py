@@ -6,18 +6,53 @@ sys.path.append(project_root)
 import torch
 from uuid import uuid4
 import streamlit as st
-from src.utils import dump_json
-from src.workflow import get_graph_builder
+from src.utils import (
+  dump_json,
+  iterate_async,
+  run_async,
+  Trace,
+  PrometheusExporter,
+  OpenTelemetryExporter,
+  configure_tracing,
+  get_callbacks,
+  trace_span,
+  FenceStripper
+)
+from src.workflow import get_graph_builder, get_semantic_cache, get_local_router, get_background_summarizer
 from src.rag import (
   embed_pdf, 
+  get_embedding_cache,
+  get_retrieval_cache,
   get_llm, 
   get_embedding_function, 
-  get_rerank_function
+  get_rerank_function,
+  get_light_rerank_function,
+  warm_up_models
 )
-from langchain.schema import HumanMessage
+from langchain.schema import HumanMessage, AIMessage
+from langchain_core.messages import AIMessageChunk
 
 torch.classes.__path__ = []
 
+@st.cache_resource
+def start_model_warm_up() -> None:
+  # Load the shared models once per process, in the background
+  warm_up_models(background=True)
+
+@st.cache_resource
+def start_tracing() -> None:
+  # Tracing is on unless TRACING=off, metrics & OpenTelemetry export are opt-in
+  if os.getenv("TRACING", "on") == "off":
+    return
+  exporters = []
+  if os.getenv("PROMETHEUS_PORT"):
+    prometheus_exporter = PrometheusExporter()
+    prometheus_exporter.serve(int(os.getenv("PROMETHEUS_PORT")))
+    exporters.append(prometheus_exporter)
+  if os.getenv("OTEL_TRACING") == "on":
+    exporters.append(OpenTelemetryExporter())
+  configure_tracing(enabled=True, exporters=exporters)
+
 def create_config() -> dict:
   llm = get_llm()
   embedding_function = get_embedding_function()
@@ -27,19 +62,35 @@ def create_config() -> dict:
       "thread_id": str(uuid4()),
       "llm": llm,
       "embedding_function": embedding_function,
-      "rerank_function": rerank_function
+      "rerank_function": rerank_function,
+      "embedding_cache": get_embedding_cache(),
+      "semantic_cache": get_semantic_cache(),
+      "retrieval_cache": get_retrieval_cache() if os.getenv("RETRIEVAL_CACHE", "on") == "on" else None,
+      "router": get_local_router(), # None until trained with src/train_router.py
+      "speculative_rewrite": os.getenv("SPECULATIVE_REWRITE") == "on", # Rewrite while the LLM routes, at the cost of an extra LLM call
+      "include_original_query": os.getenv("INCLUDE_ORIGINAL_QUERY") == "on", # Search the user query along with its rewrites
+      "rerank_mode": os.getenv("RERANK_MODE", "full"), # full or cascade
+      "light_rerank_function": get_light_rerank_function() if os.getenv("LIGHT_RERANKER") == "on" else None,
+      "context_max_tokens": int(os.getenv("CONTEXT_MAX_TOKENS", 4000)), # Token budget of the retrieved passages
+      "history_max_tokens": int(os.getenv("HISTORY_MAX_TOKENS", 2000)), # Token budget of the recent messages in prompts
+      "memory_max_tokens": int(os.getenv("MEMORY_MAX_TOKENS", 3000)), # Summarize the conversation past this size
+      "background_summarization": os.getenv("BACKGROUND_SUMMARIZATION", "on") == "on",
+      "doc_ids": [] # Documents attached to the session
     }
   }
   return config
 
 
 def main():
+  start_model_warm_up()
+  start_tracing()
+
   # Create new session
   if "config" not in st.session_state:
     config = create_config()
     st.session_state.config = config
 
-    graph_builder = get_graph_builder()
+    graph_builder = get_graph_builder(is_async=True, combined_routing=os.getenv("COMBINED_ROUTING") == "on")
     st.session_state.graph_builder = graph_builder
 
 
@@ -61,7 +112,8 @@ def main():
   # Show a processing indicator while embedding the PDF
   if uploaded_file and "is_embedded" not in st.session_state:
     with st.spinner("Processing..."):
-      embed_pdf(uploaded_file, st.session_state.config)
+      doc_id = embed_pdf(uploaded_file, st.session_state.config)
+      st.session_state.config["configurable"]["doc_ids"].append(doc_id)
       st.session_state.is_embedded = True 
 
     
@@ -78,18 +130,78 @@ def main():
     input_message = HumanMessage(content=prompt)
     response_placeholder = st.chat_message("assistant").empty()
 
+    config = st.session_state.config
+    graph_builder = st.session_state.graph_builder
+    semantic_cache = config["configurable"]["semantic_cache"]
+
+    # Record the latency breakdown of the turn
+    trace = Trace()
+    config["configurable"]["trace"] = trace
+    config["callbacks"] = get_callbacks(trace)
+
+    # Wait for the summarization of the previous turn, usually done while the user was typing
+    summarizer = get_background_summarizer()
+    summarizer.wait(config)
+
+    # Answers are only reused for the first question, since follow-ups depend on the conversation
+    is_first_turn = len(st.session_state.messages) == 1
+    cached = None
+    if is_first_turn:
+      with trace_span(config, "semantic_cache.lookup") as span:
+        cached = semantic_cache.lookup(prompt, config)
+        span.set("hit", cached is not None)
+
     response = ""
-    for msg, metadata in st.session_state.graph_builder.stream({"messages": [input_message]}, st.session_state.config, stream_mode="messages"):
-      if metadata["langgraph_node"] == "chatbot":
-        response = msg.content
+    if cached is not None:
+      response = cached["answer"]
+      response_placeholder.markdown(response)
+      # Record the turn in the conversation memory as if the graph had answered it
+      run_async(graph_builder.aupdate_state(
+        config,
+        {"messages": [input_message, AIMessage(content=response)], "retrieved_docs": cached["retrieved_docs"]},
+        as_node="chatbot"
+      ))
+    else:
+      # Nodes run on the shared event loop, so sessions do not hold a thread per Gemini round trip
+      # Render the answer token by token, stripping the markdown fences as they arrive
+      fence_stripper = FenceStripper()
+      stream = graph_builder.astream({"messages": [input_message]}, config, stream_mode="messages")
+      for msg, metadata in iterate_async(stream):
+        if metadata["langgraph_node"] != "chatbot":
+          continue
+        if isinstance(msg, AIMessageChunk):
+          text = fence_stripper.feed(msg.content)
+          if not text:
+            continue
+          response += text
+        else:
+          # A complete message replaces the streamed tokens
+          response = msg.content
+          fence_stripper = FenceStripper()
         response_placeholder.markdown(response)
+      response += fence_stripper.flush()
+      response_placeholder.markdown(response)
+
+      if is_first_turn:
+        state = run_async(graph_builder.aget_state(config))
+        semantic_cache.add(prompt, response, state.values.get("retrieved_docs", []), config)
     st.session_state.messages.append({"role": "assistant", "content": response})
+
+    # Summarize the conversation off the critical path, once the answer is rendered
+    if config["configurable"]["background_summarization"]:
+      summarizer.schedule(graph_builder, config)
     
     # Store results
+    latency = trace.breakdown()
     data = dict()
     data["query"] = prompt
     data["response"] = response  
+    data["latency"] = latency
     dump_json(data)
+
+    if latency:
+      with st.expander("Latency breakdown"):
+        st.table(latency)
     
 
 if __name__ == "__main__":
@@ -1,5 +1,7 @@
-from .milvus import collection
+from .vector_store import VectorStore, get_vector_store, reciprocal_rank_fusion
 
 __all__ = [
-  "collection"
+  "VectorStore",
+  "get_vector_store",
+  "reciprocal_rank_fusion"
 ]
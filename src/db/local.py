@@ -0,0 +1,216 @@
+import os
+import json
+import threading
+import numpy as np
+from scipy import sparse as sp
+from typing import Any, Dict, List, NamedTuple, Optional
+from .vector_store import VectorStore
+
+DENSE_BLOCK_ROWS = 8192 # Rows of stored vectors upcast to float32 at a time by the dense search
+
+
+class Snapshot(NamedTuple):
+  """
+    Contents of the store at one point in time, never modified once published
+  """
+  metadata: Dict[str, list]
+  dense: np.ndarray
+  scales: np.ndarray
+  sparse: sp.csr_matrix
+  doc_rows: Dict[str, np.ndarray] # Rows of each document, so that filters do not scan the metadata
+
+
+def get_doc_rows(doc_ids: List[str]) -> Dict[str, np.ndarray]:
+  """
+    Group row ids by document
+  """
+  rows: Dict[str, List[int]] = {}
+  for row, doc_id in enumerate(doc_ids):
+    rows.setdefault(doc_id, []).append(row)
+  return {doc_id: np.array(doc_rows, dtype=np.int64) for doc_id, doc_rows in rows.items()}
+
+
+def top_k_rows(scores: np.ndarray, limit: int) -> np.ndarray:
+  """
+    Return the ids of the `limit` highest finite scores, best first
+  """
+  valid = np.flatnonzero(np.isfinite(scores))
+  if len(valid) > limit:
+    valid = valid[np.argpartition(-scores[valid], limit - 1)[:limit]]
+  return valid[np.argsort(-scores[valid], kind="stable")]
+
+
+class LocalVectorStore(VectorStore):
+  """
+    Embedded vector store for small corpora: exact dense search with a NumPy matrix product over
+    (optionally float16 or int8 quantized) memory-mapped vectors, a CSR matrix of BGE-M3 lexical weights
+    & in-process RRF fusion
+  """
+  def __init__(self, path: str, dtype: str = "float32"):
+    if dtype not in ("float32", "float16", "int8"):
+      raise ValueError(f"Unsupported dtype: {dtype}")
+    self.path = path
+    self.dtype = dtype
+    self._lock = threading.Lock() # Serializes writes
+    self._snapshot_lock = threading.Lock() # Guards the published snapshot, so searches never wait for writes
+    self._pending: List[Dict[str, Any]] = [] # Inserted entities not flushed to disk yet
+    os.makedirs(path, exist_ok=True)
+    self._snapshot = self._load()
+
+  def _file(self, name: str) -> str:
+    return os.path.join(self.path, name)
+
+  def _load(self) -> Snapshot:
+    if os.path.exists(self._file("metadata.json")):
+      with open(self._file("metadata.json"), "r", encoding="utf-8") as file:
+        metadata = json.load(file)
+      dense = np.load(self._file("dense.npy"), mmap_mode="r")
+      self.dtype = str(dense.dtype) # An existing store keeps the dtype it was built with
+      return Snapshot(
+        metadata,
+        dense,
+        np.load(self._file("scales.npy"), mmap_mode="r"),
+        sp.load_npz(self._file("sparse.npz")).tocsr(),
+        get_doc_rows(metadata["doc_id"])
+      )
+    return Snapshot(
+      {"doc_id": [], "chunk_index": [], "page": [], "text": []},
+      np.zeros((0, 0), dtype=self.dtype),
+      np.zeros(0, dtype=np.float32),
+      sp.csr_matrix((0, 0), dtype=np.float32),
+      {}
+    )
+
+  def _get_snapshot(self) -> Snapshot:
+    with self._snapshot_lock:
+      return self._snapshot
+
+  def _quantize(self, dense: np.ndarray):
+    """
+      Normalize dense vectors & Return them in the storage dtype with their per-row dequantization scales
+    """
+    dense = dense / np.maximum(np.linalg.norm(dense, axis=1, keepdims=True), 1e-12)
+    if self.dtype == "int8":
+      scales = np.maximum(np.abs(dense).max(axis=1), 1e-12) / 127.0
+      return np.round(dense / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return dense.astype(self.dtype), np.ones(len(dense), dtype=np.float32)
+
+  def _save(self, metadata: dict, dense: np.ndarray, scales: np.ndarray, sparse) -> None:
+    """
+      Write the new contents & Publish them as the snapshot searched from now on. Called with the write lock held
+    """
+    # Write to temporary files first so a crash never leaves a half-written store
+    np.save(self._file("dense.tmp.npy"), dense)
+    np.save(self._file("scales.tmp.npy"), scales)
+    sp.save_npz(self._file("sparse.tmp.npz"), sparse)
+    with open(self._file("metadata.tmp.json"), "w", encoding="utf-8") as file:
+      json.dump(metadata, file, ensure_ascii=False)
+    # Searches still running on the previous snapshot keep the replaced files mapped
+    for name in ("dense.npy", "scales.npy", "sparse.npz", "metadata.json"):
+      stem, extension = os.path.splitext(name)
+      os.replace(self._file(f"{stem}.tmp{extension}"), self._file(name))
+    snapshot = self._load()
+    with self._snapshot_lock:
+      self._snapshot = snapshot
+
+  def insert(self, entities: Dict[str, Any]) -> None:
+    with self._lock:
+      self._pending.append(entities)
+
+  def flush(self) -> None:
+    with self._lock:
+      if not self._pending:
+        return
+      snapshot = self._snapshot # Only writers replace it, & the write lock is held
+      metadata = {key: list(values) for key, values in snapshot.metadata.items()}
+      if len(metadata["text"]) == 0:
+        dense_parts, scale_parts, sparse_parts = [], [], []
+      else:
+        dense_parts, scale_parts, sparse_parts = [np.asarray(snapshot.dense)], [np.asarray(snapshot.scales)], [snapshot.sparse]
+      for entities in self._pending:
+        for key in metadata:
+          metadata[key].extend(entities[key])
+        dense, scales = self._quantize(np.asarray(entities["dense"], dtype=np.float32))
+        dense_parts.append(dense)
+        scale_parts.append(scales)
+        sparse_parts.append(sp.csr_matrix(entities["sparse"], dtype=np.float32))
+      self._pending = []
+
+      vocab_size = max(part.shape[1] for part in sparse_parts)
+      sparse_parts = [sp.csr_matrix((part.data, part.indices, part.indptr), shape=(part.shape[0], vocab_size)) for part in sparse_parts]
+      dense, scales, sparse = np.concatenate(dense_parts), np.concatenate(scale_parts), sp.vstack(sparse_parts).tocsr()
+      self._save(metadata, dense, scales, sparse)
+
+  def is_document_indexed(self, doc_id: str) -> bool:
+    with self._lock:
+      return doc_id in self._snapshot.doc_rows or any(doc_id in entities["doc_id"] for entities in self._pending)
+
+  def delete_document(self, doc_id: str) -> None:
+    with self._lock:
+      self._pending = [entities for entities in self._pending if doc_id not in entities["doc_id"]]
+      snapshot = self._snapshot
+      if doc_id not in snapshot.doc_rows:
+        return
+      keep = np.ones(len(snapshot.metadata["doc_id"]), dtype=bool)
+      keep[snapshot.doc_rows[doc_id]] = False
+      metadata = {key: [value for value, is_kept in zip(values, keep) if is_kept] for key, values in snapshot.metadata.items()}
+      self._save(metadata, np.asarray(snapshot.dense)[keep], np.asarray(snapshot.scales)[keep], snapshot.sparse[keep])
+
+  def _get_hits(self, metadata: Dict[str, list], scores: np.ndarray, limit: int) -> List[List[Dict[str, Any]]]:
+    results = []
+    for query_scores in scores:
+      results.append([
+        {
+          "text": metadata["text"][row],
+          "doc_id": metadata["doc_id"][row],
+          "chunk_index": metadata["chunk_index"][row],
+          "page": metadata["page"][row],
+          "score": float(query_scores[row])
+        }
+        for row in top_k_rows(query_scores, limit)
+      ])
+    return results
+
+  def _exclude_documents(self, snapshot: Snapshot, scores: np.ndarray, doc_ids: Optional[List[str]]) -> None:
+    # Restrict the search to the given documents
+    if doc_ids:
+      allowed = np.zeros(scores.shape[1], dtype=bool)
+      for doc_id in set(doc_ids):
+        if doc_id in snapshot.doc_rows:
+          allowed[snapshot.doc_rows[doc_id]] = True
+      scores[:, ~allowed] = -np.inf
+
+  def dense_search(self, dense: list, limit: int = 10, doc_ids: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    snapshot = self._get_snapshot()
+    queries = np.asarray(dense, dtype=np.float32).reshape(len(dense), -1)
+    if len(snapshot.metadata["text"]) == 0:
+      return [[] for _ in range(len(queries))]
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    # Exact search, cosine similarity since stored vectors are normalized.
+    # Quantized vectors are upcast a block of rows at a time, so the whole memory map is never copied
+    num_rows = snapshot.dense.shape[0]
+    scores = np.empty((len(queries), num_rows), dtype=np.float32)
+    for start in range(0, num_rows, DENSE_BLOCK_ROWS):
+      end = min(start + DENSE_BLOCK_ROWS, num_rows)
+      block = np.asarray(snapshot.dense[start:end], dtype=np.float32)
+      np.matmul(queries, block.T, out=scores[:, start:end])
+      scores[:, start:end] *= snapshot.scales[start:end]
+    self._exclude_documents(snapshot, scores, doc_ids)
+    return self._get_hits(snapshot.metadata, scores, limit)
+
+  def sparse_search(self, sparse, limit: int = 10, doc_ids: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    snapshot = self._get_snapshot()
+    queries = sp.csr_matrix(sparse, dtype=np.float32)
+    if len(snapshot.metadata["text"]) == 0:
+      return [[] for _ in range(queries.shape[0])]
+
+    # Inner products of lexical weights, aligning vocabulary sizes
+    vocab_size = max(queries.shape[1], snapshot.sparse.shape[1])
+    queries = sp.csr_matrix((queries.data, queries.indices, queries.indptr), shape=(queries.shape[0], vocab_size))
+    docs = sp.csr_matrix((snapshot.sparse.data, snapshot.sparse.indices, snapshot.sparse.indptr), shape=(snapshot.sparse.shape[0], vocab_size))
+    scores = (queries @ docs.T).toarray()
+    # Chunks sharing no token with the query are not matches
+    scores[scores <= 0] = -np.inf
+    self._exclude_documents(snapshot, scores, doc_ids)
+    return self._get_hits(snapshot.metadata, scores, limit)
@@ -1,23 +1,162 @@
+import os
+import json
+from typing import Any, Dict, List, Optional
 from pymilvus import (
   FieldSchema,
   CollectionSchema,
   DataType,
   Collection,
+  AnnSearchRequest,
+  RRFRanker,
   connections,
   utility
 )
+from .vector_store import VectorStore
 
+# Build params required by each dense index type, with their defaults
+DENSE_INDEX_PARAMS = {
+  "FLAT": {},
+  "IVF_FLAT": {"nlist": 128},
+  "IVF_SQ8": {"nlist": 128},
+  "HNSW": {"M": 16, "efConstruction": 200}
+}
+# Search params supported by each dense index type, with their defaults
+DENSE_SEARCH_PARAMS = {
+  "FLAT": {},
+  "IVF_FLAT": {"nprobe": 16},
+  "IVF_SQ8": {"nprobe": 16},
+  "HNSW": {"ef": 64}
+}
+SPARSE_INDEX_TYPES = ["SPARSE_INVERTED_INDEX", "SPARSE_WAND"]
+DEFAULT_INDEX_CONFIG = {
+  "dense_index": {"index_type": "IVF_FLAT", "params": {"nlist": 128}},
+  "dense_search": {"nprobe": 16},
+  "sparse_index": {"index_type": "SPARSE_INVERTED_INDEX", "params": {"drop_ratio_build": 0.0}},
+  "sparse_search": {"drop_ratio_search": 0.2} # Ignore the smallest 20% of the query weights
+}
 
-def get_collection(collection_name: str) -> Collection:
+
+def check_params(section: str, params: Dict[str, Any], supported: Dict[str, Any]) -> None:
+  """
+    Raise when a section sets params its index type does not support, or sets one out of its range:
+    drop ratios are in [0, 1), the other params are positive integers
+  """
+  unsupported = sorted(set(params) - set(supported))
+  if unsupported:
+    raise ValueError(f"Unsupported {section} params: {', '.join(unsupported)}")
+  for key, value in params.items():
+    if key.startswith("drop_ratio"):
+      valid = isinstance(value, (int, float)) and 0 <= value < 1
+    else:
+      valid = isinstance(value, int) and value > 0
+    if not valid or isinstance(value, bool):
+      raise ValueError(f"Invalid {section} param {key}: {value}")
+
+
+def get_index_config(index_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+  """
+    Complete each section of the index & search settings with the default ones & Validate them.
+    Params missing for the dense index type default to the ones of that type
+  """
+  index_config = index_config or {}
+  dense_index = index_config.get("dense_index", {})
+  sparse_index = index_config.get("sparse_index", {})
+
+  dense_index_type = dense_index.get("index_type", DEFAULT_INDEX_CONFIG["dense_index"]["index_type"])
+  if dense_index_type not in DENSE_INDEX_PARAMS:
+    raise ValueError(f"Unsupported dense index type: {dense_index_type}")
+  sparse_index_type = sparse_index.get("index_type", DEFAULT_INDEX_CONFIG["sparse_index"]["index_type"])
+  if sparse_index_type not in SPARSE_INDEX_TYPES:
+    raise ValueError(f"Unsupported sparse index type: {sparse_index_type}")
+
+  index_config = {
+    "dense_index": {"index_type": dense_index_type, "params": {**DENSE_INDEX_PARAMS[dense_index_type], **dense_index.get("params", {})}},
+    "dense_search": {**DENSE_SEARCH_PARAMS[dense_index_type], **index_config.get("dense_search", {})},
+    "sparse_index": {"index_type": sparse_index_type, "params": {**DEFAULT_INDEX_CONFIG["sparse_index"]["params"], **sparse_index.get("params", {})}},
+    "sparse_search": {**DEFAULT_INDEX_CONFIG["sparse_search"], **index_config.get("sparse_search", {})}
+  }
+  check_params("dense_index", index_config["dense_index"]["params"], DENSE_INDEX_PARAMS[dense_index_type])
+  check_params("dense_search", index_config["dense_search"], DENSE_SEARCH_PARAMS[dense_index_type])
+  check_params("sparse_index", index_config["sparse_index"]["params"], DEFAULT_INDEX_CONFIG["sparse_index"]["params"])
+  check_params("sparse_search", index_config["sparse_search"], DEFAULT_INDEX_CONFIG["sparse_search"])
+  return index_config
+
+
+def load_index_config(path: Optional[str]) -> Dict[str, Any]:
+  """
+    Load index & search settings from a JSON file, e.g. the one written by the index tuner,
+    falling back on the default ones when there is no such file
+  """
+  if not path or not os.path.exists(path):
+    return get_index_config()
+  with open(path, "r", encoding="utf-8") as file:
+    return get_index_config(json.load(file))
+
+
+def get_index_params(index_config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+  """
+    Return the index params of each vector field
+  """
+  return {
+    "dense": {**index_config["dense_index"], "metric_type": "COSINE"},
+    "sparse": {**index_config["sparse_index"], "metric_type": "IP"}
+  }
+
+
+def is_same_index(index_params: Dict[str, Any], expected: Dict[str, Any]) -> bool:
+  # Milvus describes build params either nested or flattened, & may describe them as strings
+  params = {**index_params, **(index_params.get("params") or {})}
+  return index_params.get("index_type") == expected["index_type"] and all(
+    str(params.get(key)) == str(value) for key, value in expected["params"].items()
+  )
+
+
+def update_indexes(collection: Collection, index_config: Dict[str, Any]) -> None:
+  """
+    Rebuild the vector indexes whose type or build params differ from the settings
+  """
+  indexes = {index.field_name: index for index in collection.indexes}
+  changed = [
+    (field_name, index_params) for field_name, index_params in get_index_params(index_config).items()
+    if field_name not in indexes or not is_same_index(indexes[field_name].params, index_params)
+  ]
+  if not changed:
+    return
+
+  # Indexes of a loaded collection cannot be dropped
+  collection.release()
+  for field_name, index_params in changed:
+    if field_name in indexes:
+      indexes[field_name].drop()
+    collection.create_index(field_name, index_params)
+  collection.load()
+
+
+def get_collection(collection_name: str, index_config: Optional[Dict[str, Any]] = None) -> Collection:
+  """
+    Connect to an existing collection, creating it & its indexes only when it does not exist yet.
+    The indexes of an existing collection are rebuilt when the settings changed
+  """
+  index_config = get_index_config(index_config)
   # Connect to Milvus server
   connections.connect(host="localhost", port="19530")
 
   if utility.has_collection(collection_name):
+    collection = Collection(name=collection_name)
+    field_names = [field.name for field in collection.schema.fields]
+    if "doc_id" in field_names:
+      update_indexes(collection, index_config)
+      collection.load()
+      return collection
+    # Collections created before documents were tracked cannot be filtered, rebuild them once
     utility.drop_collection(collection_name)
 
   # Define collection schema
   fields = [
     FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
+    FieldSchema(name="doc_id", dtype=DataType.VARCHAR, max_length=64), # Hash of the PDF file
+    FieldSchema(name="chunk_index", dtype=DataType.INT64),
+    FieldSchema(name="page", dtype=DataType.INT64),
     FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=1000),
     FieldSchema(name="sparse", dtype=DataType.SPARSE_FLOAT_VECTOR),
     FieldSchema(name="dense", dtype=DataType.FLOAT_VECTOR, dim=1024)
@@ -28,20 +167,141 @@ def get_collection(collection_name: str) -> Collection:
   collection = Collection(name=collection_name, schema=schema)
 
   # Create indexes for vectors
-  dense_index = {
-    "index_type": "IVF_FLAT",
-    "metric_type": "COSINE"
-  }
-
-  sparse_index = {
-    "index_type": "SPARSE_INVERTED_INDEX",  
-    "metric_type": "IP"
-  }
-
-  collection.create_index("sparse", sparse_index)
-  collection.create_index("dense", dense_index)
+  index_params = get_index_params(index_config)
+  collection.create_index("sparse", index_params["sparse"])
+  collection.create_index("dense", index_params["dense"])
+  collection.create_index("doc_id", {"index_type": "INVERTED"})
   collection.load()
-  
+
   return collection
 
-collection = get_collection("research_paper_collection")
+
+def get_document_filter(doc_ids: list) -> str:
+  """
+    Build a boolean expression restricting a search to the given documents
+  """
+  return "doc_id in [" + ", ".join(f'"{doc_id}"' for doc_id in doc_ids) + "]"
+
+
+class MilvusVectorStore(VectorStore):
+  """
+    Vector store backed by a Milvus collection, with configurable index & search settings
+  """
+  def __init__(self, collection_name: str, index_config: Optional[Dict[str, Any]] = None):
+    self.index_config = get_index_config(index_config)
+    self.collection = get_collection(collection_name, self.index_config)
+
+  def set_index_config(self, index_config: Dict[str, Any]) -> None:
+    """
+      Apply new index & search settings, rebuilding the indexes whose settings changed
+    """
+    self.index_config = get_index_config(index_config)
+    update_indexes(self.collection, self.index_config)
+
+  def get_dense_param(self, limit: int) -> Dict[str, Any]:
+    index_type = self.index_config["dense_index"]["index_type"]
+    params = {key: value for key, value in self.index_config["dense_search"].items() if key in DENSE_SEARCH_PARAMS[index_type]}
+    if "ef" in params:
+      params["ef"] = max(params["ef"], limit) # HNSW cannot return more hits than ef
+    return {"metric_type": "COSINE", "params": params}
+
+  def get_sparse_param(self) -> Dict[str, Any]:
+    return {"metric_type": "IP", "params": dict(self.index_config["sparse_search"])}
+
+  def insert(self, entities: Dict[str, Any]) -> None:
+    self.collection.insert([
+      entities["doc_id"],
+      entities["chunk_index"],
+      entities["page"],
+      entities["text"],
+      entities["sparse"],
+      entities["dense"]
+    ])
+
+  def flush(self) -> None:
+    self.collection.flush()
+
+  def is_document_indexed(self, doc_id: str) -> bool:
+    results = self.collection.query(expr=f'doc_id == "{doc_id}"', output_fields=["id"], limit=1)
+    return len(results) > 0
+
+  def delete_document(self, doc_id: str) -> None:
+    self.collection.delete(expr=f'doc_id == "{doc_id}"')
+
+  def _get_hits(self, results) -> List[List[Dict[str, Any]]]:
+    return [
+      [
+        {
+          "text": hit["entity"]["text"],
+          "doc_id": hit["entity"]["doc_id"],
+          "chunk_index": hit["entity"]["chunk_index"],
+          "page": hit["entity"]["page"],
+          "score": hit["distance"]
+        }
+        for hit in hits
+      ]
+      for hits in results
+    ]
+
+  def dense_search(self, dense: list, limit: int = 10, doc_ids: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    results = self.collection.search(
+      data=dense,
+      anns_field="dense",
+      param=self.get_dense_param(limit),
+      limit=limit,
+      expr=get_document_filter(doc_ids) if doc_ids else None,
+      output_fields=["text", "doc_id", "chunk_index", "page"]
+    )
+    return self._get_hits(results)
+
+  def sparse_search(self, sparse, limit: int = 10, doc_ids: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    results = self.collection.search(
+      data=sparse,
+      anns_field="sparse",
+      param=self.get_sparse_param(),
+      limit=limit,
+      expr=get_document_filter(doc_ids) if doc_ids else None,
+      output_fields=["text", "doc_id", "chunk_index", "page"]
+    )
+    return self._get_hits(results)
+
+  def hybrid_search(
+    self,
+    dense: list,
+    sparse,
+    limit: int = 10,
+    doc_ids: Optional[List[str]] = None
+  ) -> List[List[Dict[str, Any]]]:
+    # Restrict the search to the given documents
+    expr = get_document_filter(doc_ids) if doc_ids else None
+
+    # Set up params for dense retrieval
+    dense_search_param = {
+      "data": dense,
+      "anns_field": "dense",
+      "param": self.get_dense_param(limit),
+      "limit": limit,
+      "expr": expr
+    }
+    request_1 = AnnSearchRequest(**dense_search_param)
+
+    # Set up params for sparse retrieval
+    sparse_search_param = {
+      "data": sparse,
+      "anns_field": "sparse",
+      "param": self.get_sparse_param(),
+      "limit": limit,
+      "expr": expr
+    }
+    request_2 = AnnSearchRequest(**sparse_search_param)
+    reqs = [request_1, request_2]
+
+    # Perform Hybrid search for all queries in one round trip, fused on the server
+    results = self.collection.hybrid_search(
+      reqs=reqs,
+      rerank=RRFRanker(60),
+      limit=limit,
+      output_fields=["text", "doc_id", "chunk_index", "page"]
+    )
+
+    return self._get_hits(results)
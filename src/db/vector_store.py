@@ -0,0 +1,98 @@
+import os
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+
+class VectorStore(ABC):
+  """
+    Storage & hybrid (dense + sparse) search of embedded chunks.
+    Entities are given as columns: doc_id, chunk_index, page, text, sparse (CSR rows) & dense vectors
+  """
+
+  @abstractmethod
+  def insert(self, entities: Dict[str, Any]) -> None:
+    ...
+
+  @abstractmethod
+  def flush(self) -> None:
+    ...
+
+  @abstractmethod
+  def is_document_indexed(self, doc_id: str) -> bool:
+    ...
+
+  @abstractmethod
+  def delete_document(self, doc_id: str) -> None:
+    ...
+
+  @abstractmethod
+  def dense_search(self, dense: list, limit: int = 10, doc_ids: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    """
+      Search the dense vectors of each query by cosine similarity
+    """
+    ...
+
+  @abstractmethod
+  def sparse_search(self, sparse, limit: int = 10, doc_ids: Optional[List[str]] = None) -> List[List[Dict[str, Any]]]:
+    """
+      Search the sparse vectors of each query by inner product
+    """
+    ...
+
+  def hybrid_search(
+    self,
+    dense: list,
+    sparse,
+    limit: int = 10,
+    doc_ids: Optional[List[str]] = None
+  ) -> List[List[Dict[str, Any]]]:
+    """
+      Search the dense & sparse vectors of each query, fuse both rankings with RRF
+      & Return the hits of each query as dicts with text, doc_id, chunk_index, page & score
+    """
+    dense_hits = self.dense_search(dense, limit, doc_ids)
+    sparse_hits = self.sparse_search(sparse, limit, doc_ids)
+    return [reciprocal_rank_fusion([dense_ranking, sparse_ranking], limit) for dense_ranking, sparse_ranking in zip(dense_hits, sparse_hits)]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Dict[str, Any]]], limit: int = 10, k: int = 60) -> List[Dict[str, Any]]:
+  """
+    Fuse several rankings of hits, each one best first, by their reciprocal ranks
+  """
+  scores: Dict[tuple, float] = {}
+  hits: Dict[tuple, Dict[str, Any]] = {}
+  for ranking in rankings:
+    for rank, hit in enumerate(ranking):
+      key = (hit["doc_id"], hit["chunk_index"])
+      scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+      hits.setdefault(key, hit)
+  keys = sorted(scores, key=scores.get, reverse=True)[:limit]
+  return [{**hits[key], "score": scores[key]} for key in keys]
+
+
+@lru_cache(maxsize=None)
+def get_default_vector_store(backend: str) -> VectorStore:
+  if backend == "milvus":
+    from .milvus import MilvusVectorStore, load_index_config
+    return MilvusVectorStore(
+      "research_paper_collection",
+      index_config=load_index_config(os.getenv("MILVUS_INDEX_CONFIG", "../data/milvus_index.json"))
+    )
+  if backend == "local":
+    from .local import LocalVectorStore
+    return LocalVectorStore(
+      path=os.getenv("LOCAL_VECTOR_STORE_PATH", "../data/vector_store"),
+      dtype=os.getenv("LOCAL_VECTOR_STORE_DTYPE", "float32")
+    )
+  raise ValueError(f"Unknown vector store backend: {backend}")
+
+
+def get_vector_store(config: Optional[dict] = None) -> VectorStore:
+  """
+    Return the vector store of the session if one is configured, else the process-wide store
+    selected by the VECTOR_STORE environment variable (milvus or local)
+  """
+  if config is not None and config["configurable"].get("vector_store") is not None:
+    return config["configurable"]["vector_store"]
+  return get_default_vector_store(os.getenv("VECTOR_STORE", "milvus"))
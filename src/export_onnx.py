@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+import argparse
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+from src.rag.models.onnx_backend import (
+  export_bge_m3,
+  export_reranker,
+  get_model_path,
+  OnnxBGEM3EmbeddingFunction,
+  OnnxRerankFunction
+)
+
+
+def parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description="Export BGE-M3 & the BGE rerankers to ONNX for the onnx inference backend")
+  parser.add_argument("--model-dir", default=os.path.join(project_root, "data", "models", "onnx"))
+  parser.add_argument("--no-quantize", action="store_true", help="Only export the fp32 models")
+  parser.add_argument("--rerankers", default="BAAI/bge-reranker-v2-m3,BAAI/bge-reranker-base", help="Comma separated reranker models")
+  parser.add_argument("--threads", type=int, default=None, help="Intra-op threads of the speed check")
+  return parser.parse_args()
+
+
+def main():
+  args = parse_args()
+  quantize = not args.no_quantize
+
+  start = time.perf_counter()
+  export_bge_m3(get_model_path(args.model_dir, "BAAI/bge-m3"), "BAAI/bge-m3", quantize)
+  print(f"Exported BAAI/bge-m3 in {time.perf_counter() - start:.1f}s")
+  for model_name in args.rerankers.split(","):
+    start = time.perf_counter()
+    export_reranker(get_model_path(args.model_dir, model_name), model_name, quantize)
+    print(f"Exported {model_name} in {time.perf_counter() - start:.1f}s")
+
+  # Check the exported models load & report their speed
+  texts = ["HaluEval is a large-scale hallucination evaluation benchmark for large language models."] * 32
+  embedding_function = OnnxBGEM3EmbeddingFunction.load("BAAI/bge-m3", args.model_dir, quantize, args.threads)
+  start = time.perf_counter()
+  embedding_function(texts)
+  print(f"Embedding: {len(texts) / (time.perf_counter() - start):.2f} texts/sec")
+
+  rerank_function = OnnxRerankFunction.load("BAAI/bge-reranker-v2-m3", args.model_dir, quantize, args.threads)
+  start = time.perf_counter()
+  rerank_function.compute_score([["what is halueval", text] for text in texts])
+  print(f"Reranking: {len(texts) / (time.perf_counter() - start):.2f} pairs/sec")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+from src.db import get_vector_store
+from src.rag import get_embedding_function
+from src.rag.embedding import (
+  EmbeddingCache,
+  embed_texts,
+  get_entities,
+  get_file_hash,
+  iter_pdf_chunks,
+  open_pdf
+)
+
+
+def parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description="Index a directory of PDF files into the vector database")
+  parser.add_argument("input_dir", help="Directory containing the PDF files, searched recursively")
+  parser.add_argument("--batch-size", type=int, default=256, help="Number of chunks embedded & inserted together, across documents")
+  parser.add_argument("--workers", type=int, default=None, help="Number of processes converting PDF pages")
+  parser.add_argument("--chunk-size", type=int, default=1000)
+  parser.add_argument("--chunk-overlap", type=int, default=100)
+  parser.add_argument("--min-chunk-size", type=int, default=100)
+  parser.add_argument("--cache-path", default=os.path.join(project_root, "data", "cache", "embeddings.sqlite"), help="Embedding cache file, empty to disable")
+  return parser.parse_args()
+
+
+def main():
+  args = parse_args()
+  pdf_files = sorted(glob.glob(os.path.join(args.input_dir, "**", "*.pdf"), recursive=True))
+
+  # Load the embedding model once for all documents
+  config = {
+    "configurable": {
+      "embedding_function": get_embedding_function(),
+      "embedding_cache": EmbeddingCache(args.cache_path) if args.cache_path else None
+    }
+  }
+
+  vector_store = get_vector_store(config)
+  stats = {"documents": 0, "skipped": 0, "failed": 0, "pages": 0, "chunks": 0, "embedded": 0, "embedding_time": 0.0}
+  batch = []
+
+  def insert_batch():
+    start = time.perf_counter()
+    embeddings = embed_texts([chunk.page_content for chunk in batch], config)
+    stats["embedding_time"] += time.perf_counter() - start
+    stats["embedded"] += len(batch)
+    vector_store.insert(get_entities(batch, embeddings))
+    batch.clear()
+
+  def discard_document(doc_id: str):
+    # Remove the chunks of a document still in the batch & the ones already inserted, so that it is indexed again next time
+    batch[:] = [chunk for chunk in batch if chunk.metadata["doc_id"] != doc_id]
+    vector_store.delete_document(doc_id)
+
+  num_chunks, num_pages = {}, {} # Of each indexed document
+  seen_doc_ids = set()
+  start_time = time.perf_counter()
+  with ProcessPoolExecutor(max_workers=args.workers) as executor:
+    for pdf_file in pdf_files:
+      doc_id = get_file_hash(pdf_file)
+      if doc_id in seen_doc_ids or vector_store.is_document_indexed(doc_id):
+        stats["skipped"] += 1
+        continue
+      seen_doc_ids.add(doc_id)
+
+      # A corrupt or encrypted file must not stop the whole run
+      try:
+        chunks = iter_pdf_chunks(
+          pdf_file,
+          args.chunk_size,
+          args.chunk_overlap,
+          args.min_chunk_size,
+          executor=executor
+        )
+        num_chunks[doc_id] = 0
+        for chunk_index, chunk in enumerate(chunks):
+          chunk.metadata.update(doc_id=doc_id, chunk_index=chunk_index)
+          batch.append(chunk)
+          num_chunks[doc_id] += 1
+          if len(batch) >= args.batch_size:
+            insert_batch()
+        with open_pdf(pdf_file) as doc:
+          num_pages[doc_id] = doc.page_count
+      except Exception as e:
+        discard_document(doc_id)
+        num_chunks.pop(doc_id, None)
+        stats["failed"] += 1
+        print(f"Failed to index {pdf_file}: {e}")
+        continue
+      except BaseException:
+        discard_document(doc_id)
+        raise
+
+      stats["documents"] += 1
+      stats["chunks"] += num_chunks[doc_id]
+      stats["pages"] += num_pages[doc_id]
+      print(f"Indexed {pdf_file}")
+
+  if batch:
+    try:
+      insert_batch()
+    except Exception as e:
+      # Documents with chunks in the last batch are incomplete
+      doc_ids = {chunk.metadata["doc_id"] for chunk in batch}
+      for doc_id in doc_ids:
+        discard_document(doc_id)
+        stats["chunks"] -= num_chunks[doc_id]
+        stats["pages"] -= num_pages[doc_id]
+      stats["documents"] -= len(doc_ids)
+      stats["failed"] += len(doc_ids)
+      print(f"Failed to index the last {len(doc_ids)} documents: {e}")
+  vector_store.flush()
+
+  # Report throughput
+  elapsed = time.perf_counter() - start_time
+  print(f"Documents: {stats['documents']} indexed, {stats['skipped']} skipped, {stats['failed']} failed")
+  print(f"Pages: {stats['pages']} ({stats['pages'] / elapsed:.2f} pages/sec)")
+  print(f"Chunks: {stats['chunks']} ({stats['chunks'] / elapsed:.2f} chunks/sec)")
+  if stats["embedding_time"] > 0:
+    print(f"Embedding: {stats['embedded'] / stats['embedding_time']:.2f} chunks/sec over {stats['embedding_time']:.1f}s")
+  print(f"Total time: {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+  main()
@@ -2,22 +2,29 @@ from .prompts import (
   query_routing_prompt,
   multi_query_rewrite_prompt, 
   multi_query_decompose_prompt,
+  query_analysis_prompt,
   generate_prompt
 )
 
-from .retriever import CustomMultiQueryRetriever
-from .embedding import chunk_pdf, embed_pdf
-from .models import get_llm, get_embedding_function, get_rerank_function
+from .retriever import CustomMultiQueryRetriever, pack_context, get_retrieval_cache
+from .embedding import chunk_pdf, embed_pdf, get_embedding_cache
+from .models import get_llm, get_embedding_function, get_rerank_function, get_light_rerank_function, warm_up_models
 
 __all__ = [
   "query_routing_prompt",
   "multi_query_rewrite_prompt",
   "multi_query_decompose_prompt",
+  "query_analysis_prompt",
   "generate_prompt",
   "CustomMultiQueryRetriever",
+  "pack_context",
+  "get_retrieval_cache",
   "chunk_pdf",
   "embed_pdf",
+  "get_embedding_cache",
   "get_llm",
   "get_embedding_function",
-  "get_rerank_function"
+  "get_rerank_function",
+  "get_light_rerank_function",
+  "warm_up_models"
 ]
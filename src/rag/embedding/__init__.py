@@ -1,6 +1,29 @@
-from .embedding import chunk_pdf, embed_pdf
+from .embedding import (
+  get_file_hash,
+  open_pdf,
+  iter_text_chunks,
+  iter_pdf_chunks,
+  split_pdf,
+  chunk_pdf,
+  get_entities,
+  embed_pdf
+)
+from .chunker import Separator, Chunker, get_chunker
+from .cache import EmbeddingCache, get_embedding_cache, embed_texts
 
 __all__ = [
+  "get_file_hash",
+  "open_pdf",
+  "iter_text_chunks",
+  "iter_pdf_chunks",
+  "split_pdf",
   "chunk_pdf",
-  "embed_pdf"
+  "get_entities",
+  "embed_pdf",
+  "Separator",
+  "Chunker",
+  "get_chunker",
+  "EmbeddingCache",
+  "get_embedding_cache",
+  "embed_texts"
 ]
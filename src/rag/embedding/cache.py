@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import threading
+import xxhash
+import numpy as np
+from scipy.sparse import csr_array
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from ..models import get_inference_backend
+
+
+class EmbeddingCache:
+  """
+    Content-addressed on-disk cache of BGE-M3 dense & sparse vectors, keyed by the hash of model name + text
+  """
+  def __init__(self, path: str = "../data/cache/embeddings.sqlite", model_name: str = "BAAI/bge-m3"):
+    self.path = path
+    self.model_name = model_name
+    self._lock = threading.Lock()
+
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute(
+      """
+        CREATE TABLE IF NOT EXISTS embeddings (
+          key TEXT PRIMARY KEY,
+          dense BLOB NOT NULL,
+          sparse_indices BLOB NOT NULL,
+          sparse_values BLOB NOT NULL,
+          sparse_dim INTEGER NOT NULL
+        )
+      """
+    )
+    self._conn.commit()
+
+  def key(self, text: str) -> str:
+    return xxhash.xxh3_128_hexdigest(f"{self.model_name}\x00{text}".encode("utf-8"))
+
+  def get_many(self, texts: List[str]) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, int]]:
+    """
+      Return the cached (dense, sparse indices, sparse values, sparse dim) of the given texts, keyed by text
+    """
+    keys = {self.key(text): text for text in texts}
+    found = {}
+    key_list = list(keys)
+    with self._lock:
+      # Stay below SQLite's limit on the number of bound parameters
+      for start in range(0, len(key_list), 500):
+        batch = key_list[start:start + 500]
+        rows = self._conn.execute(
+          f"SELECT key, dense, sparse_indices, sparse_values, sparse_dim FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+          batch
+        ).fetchall()
+        for key, dense, sparse_indices, sparse_values, sparse_dim in rows:
+          found[keys[key]] = (
+            np.frombuffer(dense, dtype=np.float32),
+            np.frombuffer(sparse_indices, dtype=np.int32),
+            np.frombuffer(sparse_values, dtype=np.float32),
+            sparse_dim
+          )
+    return found
+
+  def put_many(self, texts: List[str], embeddings: dict) -> None:
+    """
+      Store the BGE-M3 output of the given texts
+    """
+    sparse = embeddings["sparse"]
+    rows = []
+    for i, text in enumerate(texts):
+      start, end = sparse.indptr[i], sparse.indptr[i + 1]
+      rows.append((
+        self.key(text),
+        np.asarray(embeddings["dense"][i], dtype=np.float32).tobytes(),
+        np.asarray(sparse.indices[start:end], dtype=np.int32).tobytes(),
+        np.asarray(sparse.data[start:end], dtype=np.float32).tobytes(),
+        sparse.shape[1]
+      ))
+    with self._lock:
+      self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+      self._conn.commit()
+
+
+@lru_cache(maxsize=1)
+def get_embedding_cache() -> EmbeddingCache:
+  """
+    Return the process-wide embedding cache
+  """
+  # Embeddings of the ONNX backends differ slightly from the torch ones, so they are cached separately
+  backend = get_inference_backend()
+  return EmbeddingCache(model_name="BAAI/bge-m3" if backend == "torch" else f"BAAI/bge-m3:{backend}")
+
+
+def embed_texts(texts: List[str], config: dict) -> dict:
+  """
+    Embed texts with BGE-M3, computing only the texts missing from the embedding cache if one is configured
+  """
+  bge_m3_ef = config["configurable"]["embedding_function"]
+  cache: Optional[EmbeddingCache] = config["configurable"].get("embedding_cache")
+  if cache is None or not texts:
+    return bge_m3_ef(texts)
+
+  cached = cache.get_many(texts)
+  misses = list(dict.fromkeys(text for text in texts if text not in cached))
+  if misses:
+    embeddings = bge_m3_ef(misses)
+    cache.put_many(misses, embeddings)
+    cached.update(cache.get_many(misses))
+
+  # Assemble the output in the same layout as the embedding function
+  dense, indices, values, indptr = [], [], [], [0]
+  for text in texts:
+    text_dense, text_indices, text_values, sparse_dim = cached[text]
+    dense.append(text_dense)
+    indices.append(text_indices)
+    values.append(text_values)
+    indptr.append(indptr[-1] + len(text_indices))
+  sparse = csr_array(
+    (np.concatenate(values), np.concatenate(indices), np.array(indptr)),
+    shape=(len(texts), sparse_dim)
+  )
+  return {"dense": dense, "sparse": sparse}
@@ -0,0 +1,173 @@
+import re
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple
+
+Span = Tuple[int, int] # (start, end) offsets in the text
+
+
+class Separator:
+  """
+    A chunk boundary pattern. Patterns starting with optional whitespace defeat the literal prefix scan of `re`,
+    so when an `anchor` is given, the text is scanned for the anchor, i.e. the first character after that optional
+    prefix, & the pattern is only matched from the run of `prefix` characters before each anchor
+  """
+  def __init__(self, pattern: str, anchor: Optional[str] = None, prefix: Optional[str] = None):
+    self.pattern = re.compile(pattern)
+    self.anchor = re.compile(anchor) if anchor else None
+    self.prefix = re.compile(prefix) if prefix else None # A single character class
+
+  def find_starts(self, text: str) -> List[int]:
+    if self.anchor is None:
+      return [match.start() for match in self.pattern.finditer(text)]
+    return [start for start, _ in self.finditer(text)]
+
+  def finditer(self, text: str) -> Iterator[Span]:
+    """
+      Yield the spans of the non-overlapping matches, like `re.finditer` with the pattern
+    """
+    if self.anchor is None:
+      for match in self.pattern.finditer(text):
+        yield match.span()
+      return
+
+    position = last_end = 0
+    while True:
+      anchor = self.anchor.search(text, position)
+      if anchor is None:
+        return
+
+      # The leftmost match starts on the run of prefix characters before the anchor, or at the anchor
+      start = anchor.start()
+      while start > last_end and self.prefix is not None and self.prefix.match(text, start - 1):
+        start -= 1
+      match = None
+      for start in range(start, anchor.start() + 1):
+        match = self.pattern.match(text, start)
+        if match is not None:
+          break
+
+      if match is None:
+        position = anchor.start() + 1
+        continue
+      yield match.span()
+      position = last_end = match.end()
+
+
+# Separators by priority, a piece too long to be a chunk is split by the next ones
+SEPARATORS = [
+  Separator( # Headings (H2, H3, H4, etc.)
+    r"\n*#{2,6}\s+(?:\*{2})?(?:[A-Z]|\d+).+(?:\*{2})?",
+    anchor=r"###{0,4}\s", # #{2,6}\s, with a literal prefix
+    prefix=r"\n"
+  ),
+  Separator( # Number headings
+    r"\n*(?<![ \t\r\f\v\w#,*])\s*(?:\*{2})?\d+(?!\s*[kK])(?:\.\d+)*(?:\*{2})?\s+(?:\*{2})?[A-Z].+(?:\*{2})?",
+    anchor=r"\d+(?:\.\d+)*(?:\*{2})?\s+(?:\*{2})?[A-Z]",
+    prefix=r"[\s*]"
+  ),
+  Separator(r"\n*-----", anchor="-----", prefix=r"\n"), # Pages
+  Separator(r"\n*Table\s*\d+:\s*[A-Z].+", anchor=r"Table\s*\d+:\s*[A-Z]", prefix=r"\n"), # Tables
+  Separator(r"\n\n\n+"), # \n{3,}, with a literal prefix
+  Separator("\n\n"),
+  Separator("\n"),
+  Separator(" ")
+]
+SECTION_SEPARATORS = 2 # Headings & number headings start a section
+TITLE_STRIP_CHARS = "#* \t\r\n"
+
+
+class Chunker:
+  """
+    Split Markdown text into chunks of at most `chunk_size` characters, overlapping by up to `chunk_overlap`.
+    Produces the chunks of a RecursiveCharacterTextSplitter with the same regex separators kept at the start
+    of each piece, as (start, end) offsets so that no chunk has to be searched back in the text
+  """
+  def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 100, separators: List[Separator] = SEPARATORS):
+    if chunk_overlap > chunk_size:
+      raise ValueError(f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size}), should be smaller.")
+    self.chunk_size = chunk_size
+    self.chunk_overlap = chunk_overlap
+    self.separators = separators
+
+  def split_spans(self, text: str) -> List[Span]:
+    """
+      Return the offsets of the chunks of the text, without leading & trailing whitespace
+    """
+    return self._split(text, 0, len(text), 0)
+
+  def split_text(self, text: str) -> List[str]:
+    return [text[start:end] for start, end in self.split_spans(text)]
+
+  def get_sections(self, text: str) -> List[Tuple[int, str]]:
+    """
+      Return the start offset & title of each heading of the text, in order
+    """
+    sections = []
+    for separator in self.separators[:SECTION_SEPARATORS]:
+      for start, end in separator.finditer(text):
+        title = text[start:end].strip(TITLE_STRIP_CHARS)
+        if title:
+          sections.append((start, title))
+    sections.sort()
+    return sections
+
+  def _split(self, text: str, start: int, end: int, level: int) -> List[Span]:
+    # Like the recursive splitter, separators are searched within the piece only
+    piece = text[start:end]
+    boundaries = []
+    for level in range(level, len(self.separators)):
+      boundaries = self.separators[level].find_starts(piece)
+      if boundaries:
+        break
+
+    # Split before each separator, dropping empty pieces
+    offsets = [0] + boundaries + [len(piece)]
+    splits = [(start + offsets[i], start + offsets[i + 1]) for i in range(len(offsets) - 1) if offsets[i] < offsets[i + 1]]
+
+    chunks, good_splits = [], []
+    for split in splits:
+      if split[1] - split[0] < self.chunk_size:
+        good_splits.append(split)
+        continue
+      if good_splits:
+        chunks.extend(self._merge(text, good_splits))
+        good_splits = []
+      if level + 1 >= len(self.separators) or not boundaries:
+        chunks.append(split) # Kept as is, like the recursive splitter does
+      else:
+        chunks.extend(self._split(text, split[0], split[1], level + 1))
+    if good_splits:
+      chunks.extend(self._merge(text, good_splits))
+    return chunks
+
+  def _merge(self, text: str, splits: List[Span]) -> List[Span]:
+    """
+      Merge consecutive splits into chunks up to `chunk_size`, starting each chunk with
+      the last splits of the previous one up to `chunk_overlap`
+    """
+    chunks = []
+    first, total = 0, 0 # Splits of the current chunk are splits[first:i]
+    for i, (start, end) in enumerate(splits):
+      length = end - start
+      if total + length > self.chunk_size and i > first:
+        chunks.extend(self._strip(text, splits[first][0], splits[i - 1][1]))
+        while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+          total -= splits[first][1] - splits[first][0]
+          first += 1
+      total += length
+    if first < len(splits):
+      chunks.extend(self._strip(text, splits[first][0], splits[-1][1]))
+    return chunks
+
+  def _strip(self, text: str, start: int, end: int) -> List[Span]:
+    chunk = text[start:end]
+    stripped = chunk.lstrip()
+    if not stripped:
+      return []
+    start += len(chunk) - len(stripped)
+    return [(start, start + len(stripped.rstrip()))]
+
+
+@lru_cache(maxsize=None)
+def get_chunker(chunk_size: int = 1000, chunk_overlap: int = 100) -> Chunker:
+  return Chunker(chunk_size, chunk_overlap)
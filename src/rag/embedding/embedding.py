@@ -1,82 +1,289 @@
 import re
+import os
+import bisect
 import fitz
+import hashlib
+import tempfile
+import multiprocessing
 import pymupdf4llm
-from typing import Union, List
-from ...db import collection
-from ...utils import clean_text
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from functools import lru_cache
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional, Tuple, Union, List
+from langchain_core.documents import Document
+from ...db import get_vector_store
+from ...utils import clean_texts
+from .cache import embed_texts
+from .chunker import get_chunker
+
+PAGE_SEPARATOR = "\n-----\n" # Added by pymupdf4llm after each page
+REFERENCES_PATTERN = re.compile(r"#+\s+\*\*\s*(References|Acknowledgments)", flags=re.IGNORECASE)
+HEADING_PATTERN = re.compile(r"#+\s+\*\*")
+DIGITS_PATTERN = re.compile(r"(\d+)([\.\,])\s*\n+\s*(\d+)")
+
+
+def get_file_hash(pdf_file: Union[str, bytes]) -> str:
+  """
+    Hash the content of a PDF file to identify the document
+  """
+  if isinstance(pdf_file, str):
+    with open(pdf_file, "rb") as file:
+      content = file.read()
+  elif hasattr(pdf_file, "getvalue"): # Uploaded file
+    content = pdf_file.getvalue()
+  else:
+    content = pdf_file
+  return hashlib.sha256(content).hexdigest()
+
+
+def open_pdf(pdf_file: Union[str, bytes]) -> fitz.Document:
+  """
+    Open a PDF file from a path or from its content
+  """
+  if isinstance(pdf_file, str):
+    return fitz.open(filename=pdf_file, filetype="pdf")
+  if hasattr(pdf_file, "getvalue"): # Uploaded file
+    pdf_file = pdf_file.getvalue()
+  return fitz.open(stream=pdf_file, filetype="pdf")
+
+
+def convert_pages(pdf_file: Union[str, bytes], pages: List[int], hdr_info) -> List[str]:
+  """
+    Convert a range of pages to Markdown, one string per page. Runs in a worker process
+  """
+  with open_pdf(pdf_file) as doc:
+    return [pymupdf4llm.to_markdown(doc=doc, pages=[page], hdr_info=hdr_info) for page in pages]
+
+
+@lru_cache(maxsize=None)
+def get_pdf_executor(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+  """
+    Return the long-lived process pool converting PDF pages, started once per number of workers.
+    Workers are spawned rather than forked, so they do not inherit the threads & locks of the Streamlit server
+  """
+  return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"))
+
+
+def iter_pdf_pages(
+  pdf_file: Union[str, bytes],
+  max_workers: Optional[int] = None,
+  pages_per_task: int = 4,
+  executor: Optional[Executor] = None
+) -> Iterator[Tuple[int, str]]:
+  """
+    Convert the pages of a PDF file to Markdown across a process pool & Yield (page number, text) in order.
+    The shared pool of `get_pdf_executor` is used unless an `executor` is passed
+  """
+  # Workers open the file from its path, so the content is not pickled for every task
+  temp_path = None
+  if not isinstance(pdf_file, str):
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as file:
+      file.write(pdf_file.getvalue() if hasattr(pdf_file, "getvalue") else pdf_file) # Uploaded file or content
+    pdf_file = temp_path = file.name
+
+  results = None
+  try:
+    # Heading levels depend on font sizes of the whole document, so detect them once
+    with open_pdf(pdf_file) as doc:
+      hdr_info = pymupdf4llm.IdentifyHeaders(doc)
+      page_ranges = [list(range(start, min(start + pages_per_task, doc.page_count))) for start in range(0, doc.page_count, pages_per_task)]
+
+    executor = executor or get_pdf_executor(max_workers)
+    results = executor.map(convert_pages, [pdf_file] * len(page_ranges), page_ranges, [hdr_info] * len(page_ranges))
+    for pages, texts in zip(page_ranges, results):
+      for page, text in zip(pages, texts):
+        yield page + 1, text
+  finally:
+    # Cancel the tasks not started yet when the caller stops early, the pool outlives the document
+    if results is not None:
+      results.close()
+    if temp_path is not None:
+      os.remove(temp_path)
+
+
+def strip_references(text: str, in_references: bool) -> Tuple[str, bool]:
+  """
+    Remove References and Acknowledgments parts, which may continue over several pages
+  """
+  output = []
+  position = 0
+  while True:
+    if in_references:
+      # Skip until the next heading
+      heading = HEADING_PATTERN.search(text, position)
+      if heading is None:
+        return "".join(output), True
+      position = heading.start()
+
+    match = REFERENCES_PATTERN.search(text, position)
+    if match is None:
+      output.append(text[position:])
+      return "".join(output), False
+    output.append(text[position:match.start()])
+    position = match.end()
+    in_references = True
+
+
+def iter_text_chunks(
+  pages: Iterable[str],
+  chunk_size: int = 1000,
+  chunk_overlap: int = 100,
+  min_chunk_size: int = 100
+) -> Iterator[Document]:
+  """
+    Split the Markdown pages of a document & Yield chunks with their page numbers,
+    offsets & section titles as soon as they are complete
+  """
+  chunker = get_chunker(chunk_size, chunk_overlap)
+  buffer = "" # Text not yet emitted, starting with the last incomplete chunk
+  buffer_offset = 0 # Position of the buffer in the extracted text
+  buffer_page = 1 # Page where the buffer starts
+  buffer_section = "" # Section where the buffer starts
+  in_references = False
+
+  def to_documents(spans: List[Tuple[int, int]], sections: List[Tuple[int, str]]) -> List[Document]:
+    # Normalize the text of the chunks of a page in one batch
+    spans = [(start, end) for start, end in spans if end - start > min_chunk_size]
+    section_starts = [start for start, _ in sections]
+    documents = []
+    for (start, end), text in zip(spans, clean_texts([buffer[start:end] for start, end in spans])):
+      section_index = bisect.bisect_right(section_starts, start) - 1
+      documents.append(Document(
+        page_content=text,
+        metadata={
+          "start_index": buffer_offset + start,
+          "end_index": buffer_offset + end,
+          "page": buffer_page + buffer.count(PAGE_SEPARATOR, 0, start),
+          "section": sections[section_index][1] if section_index >= 0 else buffer_section
+        }
+      ))
+    return documents
+
+  for page_text in pages:
+    page_text, in_references = strip_references(page_text, in_references)
+    # Remove \n between digits
+    buffer += DIGITS_PATTERN.sub(r"\1\2\3", page_text)
+
+    # Emit every chunk but the last one, which may continue on the next page
+    spans = chunker.split_spans(buffer)
+    last_start = spans[-1][0] if spans else -1
+    if len(spans) < 2 or last_start <= 0:
+      continue
+    sections = chunker.get_sections(buffer)
+    yield from to_documents(spans[:-1], sections)
+    buffer_section = next((title for start, title in reversed(sections) if start < last_start), buffer_section)
+    buffer_page += buffer.count(PAGE_SEPARATOR, 0, last_start)
+    buffer_offset += last_start
+    buffer = buffer[last_start:]
+
+  yield from to_documents(chunker.split_spans(buffer), chunker.get_sections(buffer))
+
+
+def iter_pdf_chunks(
+  pdf_file: Union[str, bytes],
+  chunk_size: int = 1000,
+  chunk_overlap: int = 100,
+  min_chunk_size: int = 100,
+  max_workers: Optional[int] = None,
+  executor: Optional[Executor] = None
+) -> Iterator[Document]:
+  """
+    Extract text from a PDF file page by page & Yield smaller chunks with their page numbers as soon as they are complete
+  """
+  pages = (page_text for _, page_text in iter_pdf_pages(pdf_file, max_workers, executor=executor))
+  yield from iter_text_chunks(pages, chunk_size, chunk_overlap, min_chunk_size)
+
+
+def split_pdf(
+  pdf_file: Union[str, bytes],
+  chunk_size: int = 1000,
+  chunk_overlap: int = 100,
+  min_chunk_size: int = 100
+) -> List[Document]:
+  """
+    Extract text from a PDF file & split it into smaller chunks with their page numbers
+  """
+  return list(iter_pdf_chunks(pdf_file, chunk_size, chunk_overlap, min_chunk_size))
 
 
 def chunk_pdf(
   pdf_file: Union[str, bytes],
   chunk_size: int = 1000,
-  chunk_overlap: int = 100, 
+  chunk_overlap: int = 100,
   min_chunk_size: int = 100
 ) -> List[str]:
   """
     Extract text from a PDF file & split it into smaller chunks
   """
-  # Open the PDF file
-  doc=None
-  if (isinstance(pdf_file, str) and "data/" in pdf_file):
-    doc = fitz.open(filename=pdf_file, filetype="pdf")
-  else:
-    doc = fitz.open(stream=pdf_file, filetype="pdf")
-
-  # Extract text from the PDF file
-  extracted_text = pymupdf4llm.to_markdown(doc=doc)
-  # Remove References and Acknowledgments parts
-  extracted_text = re.sub(r"#+\s+\*\*\s*(References|Acknowledgments).*?(?=#+\s+\*\*|$)", "", extracted_text, flags=re.IGNORECASE | re.DOTALL)
-  # Remove \n between digits
-  extracted_text = re.sub(r"(\d+)([\.\,])\s*\n+\s*(\d+)", r"\1\2\3", extracted_text)
-
-  # Split the text into smaller chunks
-  splitter = RecursiveCharacterTextSplitter(
-    chunk_size=chunk_size, 
-    chunk_overlap=chunk_overlap,
-    is_separator_regex=True,
-    add_start_index=True,
-    separators=[
-      r"\n*#{2,6}\s+(?:\*{2})?(?:[A-Z]|\d+).+(?:\*{2})?", # Split by headings (H2, H3, H4, etc.)
-      r"\n*(?<![ \t\r\f\v\w#,*])\s*(?:\*{2})?\d+(?!\s*[kK])(?:\.\d+)*(?:\*{2})?\s+(?:\*{2})?[A-Z].+(?:\*{2})?", # Split by number headings 
-      r"\n*-----", # Split by pages
-      r"\n*Table\s*\d+:\s*[A-Z].+", # Split by tables
-      r"\n{3,}",
-      "\n\n",
-      "\n",
-      " "
-    ]
-  )
-  chunks = splitter.create_documents([extracted_text])
-  chunks = [clean_text(chunk.page_content) for chunk in chunks if len(chunk.page_content) > min_chunk_size]
-  return chunks
+  chunks = split_pdf(pdf_file, chunk_size, chunk_overlap, min_chunk_size)
+  return [chunk.page_content for chunk in chunks]
 
 
-def embed_pdf(
-  pdf_file: Union[str, bytes], 
-  config: dict, 
-  chunk_size: int = 1000,
-  chunk_overlap: int = 100, 
-  min_chunk_size: int = 100
-):
+def get_entities(chunks: List[Document], embeddings: dict) -> dict:
+  """
+    Arrange embedded chunks into the columns stored by the vector store
   """
-    Embed the PDF file for information retrieval
+  return {
+    "doc_id": [chunk.metadata["doc_id"] for chunk in chunks],
+    "chunk_index": [chunk.metadata["chunk_index"] for chunk in chunks],
+    "page": [chunk.metadata["page"] for chunk in chunks],
+    "text": [chunk.page_content for chunk in chunks],
+    "sparse": embeddings["sparse"],
+    "dense": embeddings["dense"]
+  }
+
+
+def insert_chunks(chunks: List[Document], config: dict) -> None:
   """
-  # Chunk the PDF file
-  chunks = chunk_pdf(pdf_file, chunk_size, chunk_overlap, min_chunk_size)
+    Embed a batch of chunks & Add them to the vector database
+  """
+  # Embed text chunks into vectors, reusing cached vectors of previously seen chunks
+  embeddings = embed_texts([chunk.page_content for chunk in chunks], config)
+  get_vector_store(config).insert(get_entities(chunks, embeddings))
 
-  # Embed text chunks into vectors
-  bge_m3_ef = config["configurable"]["embedding_function"]
-  embeddings = bge_m3_ef(chunks)
 
-  # Add to vector database
-  entities = [
-    chunks,
-    embeddings["sparse"],
-    embeddings["dense"]
-  ]
+def embed_pdf(
+  pdf_file: Union[str, bytes],
+  config: dict,
+  chunk_size: int = 1000,
+  chunk_overlap: int = 100,
+  min_chunk_size: int = 100,
+  force: bool = False,
+  batch_size: int = 32
+) -> str:
+  """
+    Embed the PDF file for information retrieval & Return its document id.
+    A document already in the vector store is only re-indexed when `force` is set
+  """
+  vector_store = get_vector_store(config)
+  doc_id = get_file_hash(pdf_file)
+  if vector_store.is_document_indexed(doc_id):
+    if not force:
+      return doc_id
+    vector_store.delete_document(doc_id)
+    # Answers cached for the previous version of the document are stale
+    semantic_cache = config["configurable"].get("semantic_cache")
+    if semantic_cache is not None:
+      semantic_cache.invalidate(doc_id)
 
-  collection.insert(entities)
-  collection.flush()
+  # Embed & insert chunks in fixed-size batches as they are extracted
+  try:
+    batch = []
+    for chunk_index, chunk in enumerate(iter_pdf_chunks(pdf_file, chunk_size, chunk_overlap, min_chunk_size)):
+      chunk.metadata.update(doc_id=doc_id, chunk_index=chunk_index)
+      batch.append(chunk)
+      if len(batch) == batch_size:
+        insert_chunks(batch, config)
+        batch = []
+    if batch:
+      insert_chunks(batch, config)
+    vector_store.flush()
+  except BaseException:
+    # Remove the chunks inserted so far, otherwise the half-indexed document would count as indexed
+    vector_store.delete_document(doc_id)
+    raise
 
-  
\ No newline at end of file
+  # Hits cached for the previous version of the document, or for searches over the whole collection, are stale
+  retrieval_cache = config["configurable"].get("retrieval_cache")
+  if retrieval_cache is not None:
+    retrieval_cache.invalidate(doc_id)
+  return doc_id
@@ -1,11 +1,35 @@
 from .models import (
   get_llm,
   get_embedding_function,
-  get_rerank_function
+  get_rerank_function,
+  get_light_rerank_function,
+  compute_rerank_scores,
+  get_inference_backend,
+  load_embedding_function,
+  load_rerank_function,
+  warm_up_models
+)
+from .registry import (
+  ModelRegistry,
+  MicroBatcher,
+  BatchingEmbeddingFunction,
+  BatchingRerankFunction,
+  registry
 )
 
 __all__ = [
   "get_llm", 
   "get_embedding_function",
-  "get_rerank_function"
+  "get_rerank_function",
+  "get_light_rerank_function",
+  "compute_rerank_scores",
+  "get_inference_backend",
+  "load_embedding_function",
+  "load_rerank_function",
+  "warm_up_models",
+  "ModelRegistry",
+  "MicroBatcher",
+  "BatchingEmbeddingFunction",
+  "BatchingRerankFunction",
+  "registry"
 ]
@@ -1,12 +1,21 @@
 import os
+import threading
+from typing import List
 from dotenv import load_dotenv
 from pymilvus.model.reranker import BGERerankFunction
 from pymilvus.model.hybrid import BGEM3EmbeddingFunction
 from langchain_google_genai import ChatGoogleGenerativeAI
+from .registry import registry, BatchingEmbeddingFunction, BatchingRerankFunction
 
 load_dotenv()
 GEMINI_API_KEY=os.getenv("GEMINI_API_KEY")
 
+# Backend of the embedding & rerank models: torch or onnx, exported on first use & quantized to int8 by default
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "../data/models/onnx")
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "on") == "on"
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0")) or None # Physical cores by default
+
 def get_llm():
   llm = ChatGoogleGenerativeAI(
     api_key=GEMINI_API_KEY,
@@ -15,8 +24,71 @@ def get_llm():
   )
   return llm
 
+def get_inference_backend() -> str:
+  """
+    Return the backend running the local models: torch, onnx (fp32) or onnx-int8
+  """
+  if INFERENCE_BACKEND == "onnx":
+    return "onnx-int8" if ONNX_QUANTIZE else "onnx"
+  return "torch"
+
+def load_embedding_function(model_name: str = "BAAI/bge-m3"):
+  if INFERENCE_BACKEND == "onnx":
+    from .onnx_backend import OnnxBGEM3EmbeddingFunction
+    return OnnxBGEM3EmbeddingFunction.load(model_name, ONNX_MODEL_DIR, ONNX_QUANTIZE, ONNX_INTRA_OP_THREADS)
+  return BGEM3EmbeddingFunction(model_name=model_name, device="cpu", use_fp16=False)
+
+def load_rerank_function(model_name: str = "BAAI/bge-reranker-v2-m3"):
+  if INFERENCE_BACKEND == "onnx":
+    from .onnx_backend import OnnxRerankFunction
+    return OnnxRerankFunction.load(model_name, ONNX_MODEL_DIR, ONNX_QUANTIZE, ONNX_INTRA_OP_THREADS)
+  return BGERerankFunction(model_name=model_name, device="cpu")
+
 def get_embedding_function():
-  return BGEM3EmbeddingFunction(model_name="BAAI/bge-m3", device="cpu", use_fp16=False)
+  """
+    Return the BGE-M3 embedding function shared by the whole process
+  """
+  return registry.get(
+    "embedding_function",
+    lambda: BatchingEmbeddingFunction(load_embedding_function("BAAI/bge-m3"))
+  )
 
 def get_rerank_function():
-  return BGERerankFunction(model_name="BAAI/bge-reranker-v2-m3", device="cpu")
+  """
+    Return the BGE reranker shared by the whole process
+  """
+  return registry.get(
+    "rerank_function",
+    lambda: BatchingRerankFunction(load_rerank_function("BAAI/bge-reranker-v2-m3"))
+  )
+
+def get_light_rerank_function():
+  """
+    Return the smaller BGE reranker used as the first stage of cascade reranking
+  """
+  return registry.get(
+    "light_rerank_function",
+    lambda: BatchingRerankFunction(load_rerank_function("BAAI/bge-reranker-base"))
+  )
+
+def compute_rerank_scores(rerank_function, pairs: List[List[str]]) -> List[float]:
+  """
+    Score query-document pairs with a shared or a plain BGE reranker
+  """
+  if hasattr(rerank_function, "compute_score"): # Shared or ONNX reranker
+    return rerank_function.compute_score(pairs)
+  scores = rerank_function.reranker.compute_score(pairs, normalize=rerank_function.normalize)
+  return scores if isinstance(scores, list) else [scores]
+
+def warm_up_models(background: bool = False) -> None:
+  """
+    Load the embedding & rerank models and run a first forward pass, so the first user does not pay for it
+  """
+  def warm_up():
+    get_embedding_function()(["warm up"])
+    compute_rerank_scores(get_rerank_function(), [["warm up", "warm up"]])
+
+  if background:
+    threading.Thread(target=warm_up, name="model-warm-up", daemon=True).start()
+  else:
+    warm_up()
@@ -0,0 +1,293 @@
+import os
+import numpy as np
+import onnxruntime as ort
+from typing import Dict, List, Optional
+from scipy.sparse import csr_array
+from transformers import AutoTokenizer
+
+
+def get_model_path(model_dir: str, model_name: str) -> str:
+  return os.path.join(model_dir, model_name.replace("/", "--"))
+
+
+def get_model_file(model_path: str, quantize: bool) -> str:
+  return os.path.join(model_path, "model_int8.onnx" if quantize else "model.onnx")
+
+
+def get_session(model_file: str, intra_op_threads: Optional[int] = None) -> ort.InferenceSession:
+  """
+    Create an ONNX Runtime CPU session, by default using as many intra-op threads as physical cores
+  """
+  options = ort.SessionOptions()
+  options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+  if intra_op_threads:
+    options.intra_op_num_threads = intra_op_threads
+  options.inter_op_num_threads = 1
+  return ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+
+
+def get_length_sorted_batches(lengths: List[int], max_batch_size: int = 32, max_batch_tokens: int = 16384) -> List[List[int]]:
+  """
+    Group the indices of sequences sorted by length, longest first, so that each batch is padded to
+    similar lengths only. A batch holds at most `max_batch_size` sequences & `max_batch_tokens` padded tokens
+  """
+  batches, batch = [], []
+  for i in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+    # A batch is padded to the length of its first sequence
+    if batch and (len(batch) >= max_batch_size or lengths[batch[0]] * (len(batch) + 1) > max_batch_tokens):
+      batches.append(batch)
+      batch = []
+    batch.append(i)
+  if batch:
+    batches.append(batch)
+  return batches
+
+
+def pad_batch(input_ids: List[List[int]], pad_token_id: int) -> Dict[str, np.ndarray]:
+  max_length = max(len(ids) for ids in input_ids)
+  padded_ids = np.full((len(input_ids), max_length), pad_token_id, dtype=np.int64)
+  attention_mask = np.zeros((len(input_ids), max_length), dtype=np.int64)
+  for i, ids in enumerate(input_ids):
+    padded_ids[i, :len(ids)] = ids
+    attention_mask[i, :len(ids)] = 1
+  return {"input_ids": padded_ids, "attention_mask": attention_mask}
+
+
+def quantize_model(model_path: str) -> None:
+  """
+    Quantize the weights of the exported model to int8, activations are quantized dynamically at runtime
+  """
+  from onnxruntime.quantization import QuantType, quantize_dynamic
+  quantize_dynamic(
+    get_model_file(model_path, quantize=False),
+    get_model_file(model_path, quantize=True),
+    weight_type=QuantType.QInt8
+  )
+
+
+def export_bge_m3(model_path: str, model_name: str = "BAAI/bge-m3", quantize: bool = True) -> None:
+  """
+    Export BGE-M3 with its dense (normalized CLS) & sparse (ReLU of a linear head over tokens) outputs to ONNX
+  """
+  import torch
+  from huggingface_hub import snapshot_download
+  from transformers import AutoModel
+
+  class BGEM3Heads(torch.nn.Module):
+    def __init__(self, model, sparse_linear):
+      super().__init__()
+      self.model = model
+      self.sparse_linear = sparse_linear
+
+    def forward(self, input_ids, attention_mask):
+      hidden_state = self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+      dense = torch.nn.functional.normalize(hidden_state[:, 0], dim=-1)
+      token_weights = torch.relu(self.sparse_linear(hidden_state)).squeeze(-1)
+      return dense, token_weights
+
+  snapshot_path = snapshot_download(model_name)
+  model = AutoModel.from_pretrained(snapshot_path).eval()
+  sparse_linear = torch.nn.Linear(model.config.hidden_size, 1)
+  sparse_linear.load_state_dict(torch.load(os.path.join(snapshot_path, "sparse_linear.pt"), map_location="cpu"))
+
+  os.makedirs(model_path, exist_ok=True)
+  tokenizer = AutoTokenizer.from_pretrained(snapshot_path)
+  tokenizer.save_pretrained(model_path)
+  inputs = tokenizer(["export"], return_tensors="pt")
+
+  # The fp32 weights exceed the 2GB protobuf limit, the exporter stores them as external data next to the model
+  with torch.no_grad():
+    torch.onnx.export(
+      BGEM3Heads(model, sparse_linear.eval()),
+      (inputs["input_ids"], inputs["attention_mask"]),
+      get_model_file(model_path, quantize=False),
+      input_names=["input_ids", "attention_mask"],
+      output_names=["dense", "token_weights"],
+      dynamic_axes={
+        "input_ids": {0: "batch", 1: "sequence"},
+        "attention_mask": {0: "batch", 1: "sequence"},
+        "dense": {0: "batch"},
+        "token_weights": {0: "batch", 1: "sequence"}
+      },
+      opset_version=17
+    )
+  if quantize:
+    quantize_model(model_path)
+
+
+def export_reranker(model_path: str, model_name: str = "BAAI/bge-reranker-v2-m3", quantize: bool = True) -> None:
+  """
+    Export a BGE cross-encoder reranker, returning one relevance logit per pair, to ONNX
+  """
+  import torch
+  from transformers import AutoModelForSequenceClassification
+
+  model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+  os.makedirs(model_path, exist_ok=True)
+  tokenizer = AutoTokenizer.from_pretrained(model_name)
+  tokenizer.save_pretrained(model_path)
+  inputs = tokenizer(["export"], ["export"], return_tensors="pt")
+
+  with torch.no_grad():
+    torch.onnx.export(
+      model,
+      (inputs["input_ids"], inputs["attention_mask"]),
+      get_model_file(model_path, quantize=False),
+      input_names=["input_ids", "attention_mask"],
+      output_names=["logits"],
+      dynamic_axes={
+        "input_ids": {0: "batch", 1: "sequence"},
+        "attention_mask": {0: "batch", 1: "sequence"},
+        "logits": {0: "batch"}
+      },
+      opset_version=17
+    )
+  if quantize:
+    quantize_model(model_path)
+
+
+class OnnxBGEM3EmbeddingFunction:
+  """
+    BGE-M3 on ONNX Runtime, with the same output as pymilvus' BGEM3EmbeddingFunction:
+    a list of normalized dense vectors & a CSR array of the sparse (lexical) weights
+  """
+  def __init__(
+    self,
+    model_path: str,
+    model_name: str = "BAAI/bge-m3",
+    quantize: bool = True,
+    intra_op_threads: Optional[int] = None,
+    max_length: int = 8192,
+    max_batch_size: int = 32,
+    max_batch_tokens: int = 16384
+  ):
+    self.model_name = model_name
+    self.quantize = quantize
+    self.max_length = max_length
+    self.max_batch_size = max_batch_size
+    self.max_batch_tokens = max_batch_tokens
+    self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+    self.session = get_session(get_model_file(model_path, quantize), intra_op_threads)
+    self.dim = {"dense": 1024, "sparse": len(self.tokenizer)}
+
+    # Special tokens carry no lexical weight
+    self._unused_token_ids = {
+      self.tokenizer.cls_token_id,
+      self.tokenizer.eos_token_id,
+      self.tokenizer.pad_token_id,
+      self.tokenizer.unk_token_id
+    }
+
+  @classmethod
+  def load(
+    cls,
+    model_name: str = "BAAI/bge-m3",
+    model_dir: str = "../data/models/onnx",
+    quantize: bool = True,
+    intra_op_threads: Optional[int] = None
+  ) -> "OnnxBGEM3EmbeddingFunction":
+    """
+      Load the exported model, exporting it on first use
+    """
+    model_path = get_model_path(model_dir, model_name)
+    if not os.path.exists(get_model_file(model_path, quantize)):
+      export_bge_m3(model_path, model_name, quantize)
+    return cls(model_path, model_name, quantize, intra_op_threads)
+
+  def __call__(self, texts: List[str]) -> dict:
+    input_ids = self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+    dense = [None] * len(texts)
+    rows = [None] * len(texts)
+    for batch in get_length_sorted_batches([len(ids) for ids in input_ids], self.max_batch_size, self.max_batch_tokens):
+      batch_dense, token_weights = self.session.run(None, pad_batch([input_ids[i] for i in batch], self.tokenizer.pad_token_id))
+      for j, i in enumerate(batch):
+        dense[i] = batch_dense[j]
+        rows[i] = self._get_lexical_weights(input_ids[i], token_weights[j])
+
+    # Assemble the sparse weights into a CSR array
+    indices, values, indptr = [], [], [0]
+    for row in rows:
+      indices.extend(row.keys())
+      values.extend(row.values())
+      indptr.append(len(indices))
+    sparse = csr_array(
+      (np.asarray(values, dtype=np.float32), np.asarray(indices, dtype=np.int64), np.asarray(indptr)),
+      shape=(len(texts), self.dim["sparse"])
+    )
+    return {"dense": dense, "sparse": sparse}
+
+  def encode_queries(self, queries: List[str]) -> dict:
+    return self(queries)
+
+  def encode_documents(self, documents: List[str]) -> dict:
+    return self(documents)
+
+  def _get_lexical_weights(self, input_ids: List[int], token_weights: np.ndarray) -> Dict[int, float]:
+    """
+      Keep the highest positive weight of each token of a sequence
+    """
+    weights = {}
+    for token_id, weight in zip(input_ids, token_weights[:len(input_ids)].tolist()):
+      if token_id in self._unused_token_ids or weight <= 0:
+        continue
+      if weight > weights.get(token_id, 0.0):
+        weights[token_id] = weight
+    return weights
+
+
+class OnnxRerankFunction:
+  """
+    BGE cross-encoder reranker on ONNX Runtime, scoring query-document pairs like FlagReranker.compute_score
+  """
+  def __init__(
+    self,
+    model_path: str,
+    model_name: str = "BAAI/bge-reranker-v2-m3",
+    quantize: bool = True,
+    intra_op_threads: Optional[int] = None,
+    normalize: bool = True,
+    max_length: int = 512,
+    max_batch_size: int = 32,
+    max_batch_tokens: int = 16384
+  ):
+    self.model_name = model_name
+    self.quantize = quantize
+    self.normalize = normalize
+    self.max_length = max_length
+    self.max_batch_size = max_batch_size
+    self.max_batch_tokens = max_batch_tokens
+    self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+    self.session = get_session(get_model_file(model_path, quantize), intra_op_threads)
+
+  @classmethod
+  def load(
+    cls,
+    model_name: str = "BAAI/bge-reranker-v2-m3",
+    model_dir: str = "../data/models/onnx",
+    quantize: bool = True,
+    intra_op_threads: Optional[int] = None
+  ) -> "OnnxRerankFunction":
+    """
+      Load the exported model, exporting it on first use
+    """
+    model_path = get_model_path(model_dir, model_name)
+    if not os.path.exists(get_model_file(model_path, quantize)):
+      export_reranker(model_path, model_name, quantize)
+    return cls(model_path, model_name, quantize, intra_op_threads)
+
+  def compute_score(self, pairs: List[List[str]]) -> List[float]:
+    if not pairs:
+      return []
+    input_ids = self.tokenizer(
+      [query for query, _ in pairs],
+      [document for _, document in pairs],
+      truncation=True,
+      max_length=self.max_length
+    )["input_ids"]
+    scores = np.zeros(len(pairs), dtype=np.float32)
+    for batch in get_length_sorted_batches([len(ids) for ids in input_ids], self.max_batch_size, self.max_batch_tokens):
+      logits = self.session.run(None, pad_batch([input_ids[i] for i in batch], self.tokenizer.pad_token_id))[0]
+      scores[batch] = logits.reshape(-1)
+    if self.normalize:
+      scores = 1 / (1 + np.exp(-scores))
+    return scores.tolist()
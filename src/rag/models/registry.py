@@ -0,0 +1,136 @@
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+
+class ModelRegistry:
+  """
+    Process-wide registry of lazily loaded models, shared by all sessions
+  """
+  def __init__(self):
+    self._models: Dict[str, Any] = {}
+    self._lock = threading.Lock()
+
+  def get(self, name: str, factory: Callable[[], Any]) -> Any:
+    """
+      Return the model registered under `name`, loading it with `factory` on first use
+    """
+    model = self._models.get(name)
+    if model is None:
+      with self._lock:
+        model = self._models.get(name)
+        if model is None:
+          model = factory()
+          self._models[name] = model
+    return model
+
+  def is_loaded(self, name: str) -> bool:
+    return name in self._models
+
+
+class MicroBatcher:
+  """
+    Merge calls from concurrent threads into shared forward passes.
+    `fn` runs on the concatenated items of queued requests & `split` cuts its output back per request
+  """
+  def __init__(
+    self,
+    fn: Callable[[List[Any]], Any],
+    split: Callable[[Any, int, int], Any],
+    max_batch_size: int = 64,
+    max_wait: float = 0.005
+  ):
+    self.fn = fn
+    self.split = split
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+    self._queue: "queue.Queue[tuple]" = queue.Queue()
+    threading.Thread(target=self._run, name="micro-batcher", daemon=True).start()
+
+  def submit(self, items: List[Any]) -> Any:
+    """
+      Queue items for the next batch & Block until their output is available
+    """
+    future = Future()
+    self._queue.put((list(items), future))
+    return future.result()
+
+  def _run(self) -> None:
+    while True:
+      requests = [self._queue.get()]
+      size = len(requests[0][0])
+
+      # Wait briefly for concurrent requests to fill the batch
+      while size < self.max_batch_size:
+        try:
+          request = self._queue.get(timeout=self.max_wait)
+        except queue.Empty:
+          break
+        requests.append(request)
+        size += len(request[0])
+
+      items = [item for request_items, _ in requests for item in request_items]
+      try:
+        output = self.fn(items)
+      except Exception as e:
+        for _, future in requests:
+          future.set_exception(e)
+        continue
+
+      start = 0
+      for request_items, future in requests:
+        future.set_result(self.split(output, start, start + len(request_items)))
+        start += len(request_items)
+
+
+class BatchingEmbeddingFunction:
+  """
+    BGE-M3 embedding function whose calls from concurrent sessions are micro-batched
+  """
+  def __init__(self, embedding_function, max_batch_size: int = 64, max_wait: float = 0.005):
+    self.embedding_function = embedding_function
+    self._batcher = MicroBatcher(
+      fn=embedding_function,
+      split=lambda output, start, end: {"dense": output["dense"][start:end], "sparse": output["sparse"][start:end]},
+      max_batch_size=max_batch_size,
+      max_wait=max_wait
+    )
+
+  def __call__(self, texts: List[str]) -> dict:
+    return self._batcher.submit(texts)
+
+  def __getattr__(self, name: str) -> Any:
+    # Expose attributes of the wrapped function, e.g. model_name or dim
+    return getattr(self.embedding_function, name)
+
+
+class BatchingRerankFunction:
+  """
+    BGE reranker (torch or ONNX) whose query-document pairs from concurrent sessions are scored in shared batches
+  """
+  def __init__(self, rerank_function, max_batch_size: int = 128, max_wait: float = 0.005):
+    self.rerank_function = rerank_function
+    self._batcher = MicroBatcher(
+      fn=self._score,
+      split=lambda output, start, end: output[start:end],
+      max_batch_size=max_batch_size,
+      max_wait=max_wait
+    )
+
+  def _score(self, pairs: List[List[str]]) -> List[float]:
+    if hasattr(self.rerank_function, "compute_score"): # ONNX reranker
+      return self.rerank_function.compute_score(pairs)
+    scores = self.rerank_function.reranker.compute_score(pairs, normalize=self.rerank_function.normalize)
+    return scores if isinstance(scores, list) else [scores]
+
+  def compute_score(self, pairs: List[List[str]]) -> List[float]:
+    if not pairs:
+      return []
+    return self._batcher.submit(pairs)
+
+  def __getattr__(self, name: str) -> Any:
+    return getattr(self.rerank_function, name)
+
+
+registry = ModelRegistry()
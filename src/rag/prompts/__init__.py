@@ -2,6 +2,7 @@ from .prompts import (
   query_routing_prompt,
   multi_query_rewrite_prompt, 
   multi_query_decompose_prompt,
+  query_analysis_prompt,
   generate_prompt
 )
 
@@ -9,5 +10,6 @@ __all__ = [
   "query_routing_prompt",
   "multi_query_rewrite_prompt", 
   "multi_query_decompose_prompt",
+  "query_analysis_prompt",
   "generate_prompt"
 ]
@@ -106,6 +106,53 @@ multi_query_decompose_prompt = PromptTemplate(
 )
 
 
+query_analysis_prompt = PromptTemplate(
+  template="""
+    You are a helpful assistant tasked with classifying user queries and reformulating them to improve retrieval in a RAG system.
+
+    The meaning of each class:
+      - no-retrieve: Classify the query as no-retrieve only if it can be answered using previously provided contexts. If no prior context is available, do not assign this class.
+      - simple: The query is straightforward and focuses on a single topic or intent. It does not require decomposition, but may be rewritten or rephrased slightly to enhance the retrieval of the most relevant documents.
+      - complex: The query includes multiple, nested, or interdependent questions or requirements. It should be broken down into simpler, independent sub-queries and rewritten to improve the retrieval of relevant documents for each part.
+
+    Given:
+      - The original user query.
+      - The summary of the previous conversation.
+      - The recent user messages.
+
+    Your task is to:
+      - Analyze the context of the conversation and properly classify the user query into an appropriate class mentioned above.
+      - If the class is simple, generate three distinct reformulated versions of the user query.
+      - If the class is complex, break down the user query into simpler sub-queries and rewrite each of them.
+      - If the class is no-retrieve, do not generate any query.
+      - Use the conversation summary and recent messages to determine if the user query refers to or builds upon prior discussion. If so, rewrite the queries with the necessary context to make them self-contained and unambiguous.
+
+    Each rewritten query MUST:
+      - Use formal, academic language and terminologies commonly found in research papers.
+      - Maintain the original meaning and intent of the user query without fabricating new information.
+      - Include the phrase "in this paper" if it does not exist in the original query.
+      - Focus on a single topic or intent.
+      - Be short and concise.
+      - Avoid using conversational or emotional phrasing such as "Could you", "Can you", or similar question forms; instead, use a clear and formal tone.
+
+    Output format:
+    Return a JSON object following the format: {{"class": "<class_name>", "queries": ["<rewritten query>", ...]}}.
+
+    Examples:
+    Input: Các đóng góp chính là gì?
+    Output: {{"class": "simple", "queries": ["What are the main contributions in this paper?", "What novel contributions are proposed in this paper?", "What are the key findings presented in this paper?"]}}
+
+    Input: Quy trình lấy mẫu như thế nào, cho ví dụ?
+    Output: {{"class": "complex", "queries": ["What is the sampling process in this paper?", "What examples of the sampling process are given in this paper?"]}}
+
+    Conversation summary: {summary}
+    Recent messages: {messages}
+    Original query: {query}
+  """,
+  input_variables=["summary", "messages", "query"]
+)
+
+
 generate_prompt = ChatPromptTemplate.from_messages([
   SystemMessagePromptTemplate.from_template(
     template="""
@@ -1,5 +1,15 @@
 from .retriever import CustomMultiQueryRetriever
+from .fusion import fuse_hits, get_simhash
+from .cache import RetrievalCache, get_retrieval_cache
+from .context import count_tokens, merge_adjacent_hits, pack_context
 
 __all__ = [
-  "CustomMultiQueryRetriever"
+  "CustomMultiQueryRetriever",
+  "fuse_hits",
+  "get_simhash",
+  "RetrievalCache",
+  "get_retrieval_cache",
+  "count_tokens",
+  "merge_adjacent_hits",
+  "pack_context"
 ]
@@ -0,0 +1,117 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+Scope = Tuple[str, str] # (documents searched, retrieval settings)
+Pair = Tuple[str, str, int] # (normalized query, doc_id, chunk_index)
+
+
+class RetrievalCache:
+  """
+    Cache of the search hits of past retrieval queries, looked up by normalized query text or by
+    cosine similarity of BGE-M3 query embeddings, & of the cross-encoder scores of query-chunk pairs.
+    Entries are scoped to the documents searched & the retrieval settings, expire after `ttl` seconds,
+    are evicted in LRU order & dropped when one of their documents changes
+  """
+  def __init__(self, threshold: float = 0.95, ttl: float = 3600, max_entries: int = 5000, max_scores: int = 100000):
+    self.threshold = threshold
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self.max_scores = max_scores
+    self._entries: "OrderedDict[Tuple[Scope, str], Dict[str, Any]]" = OrderedDict() # In LRU order
+    self._scores: "OrderedDict[Pair, Tuple[float, float]]" = OrderedDict() # (score, creation time) in LRU order
+    self._lock = threading.Lock()
+
+  def get_scope(self, doc_ids: Optional[List[str]], settings: str) -> Scope:
+    # Searching without a document filter depends on the whole collection
+    return ",".join(sorted(doc_ids)) if doc_ids else "*", settings
+
+  def get(self, query: str, scope: Scope) -> Optional[List[Dict[str, Any]]]:
+    """
+      Return the cached search hits of a normalized query
+    """
+    with self._lock:
+      entry = self._entries.get((scope, query))
+      if entry is None:
+        return None
+      if time.time() - entry["created_at"] > self.ttl:
+        del self._entries[(scope, query)]
+        return None
+      self._entries.move_to_end((scope, query))
+      return entry["hits"]
+
+  def get_similar(self, dense: np.ndarray, scope: Scope) -> Optional[List[Dict[str, Any]]]:
+    """
+      Return the cached hits of the most similar past query, if it is similar enough. `dense` is L2-normalized
+    """
+    with self._lock:
+      now = time.time()
+      keys = [key for key, entry in self._entries.items() if key[0] == scope and now - entry["created_at"] <= self.ttl]
+      if not keys:
+        return None
+      scores = np.stack([self._entries[key]["dense"] for key in keys]) @ dense
+      best = int(np.argmax(scores))
+      if scores[best] < self.threshold:
+        return None
+      self._entries.move_to_end(keys[best])
+      return self._entries[keys[best]]["hits"]
+
+  def put(self, query: str, dense: np.ndarray, hits: List[Dict[str, Any]], scope: Scope) -> None:
+    """
+      Store the search hits of a normalized query
+    """
+    with self._lock:
+      self._entries[(scope, query)] = {"dense": dense, "hits": hits, "created_at": time.time()}
+      self._entries.move_to_end((scope, query))
+
+      # Evict least recently used entries
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+
+  def get_scores(self, pairs: List[Pair]) -> List[Optional[float]]:
+    """
+      Return the cached cross-encoder score of each query-chunk pair, None when it is not cached
+    """
+    scores = []
+    with self._lock:
+      now = time.time()
+      for pair in pairs:
+        entry = self._scores.get(pair)
+        if entry is None or now - entry[1] > self.ttl:
+          scores.append(None)
+          continue
+        self._scores.move_to_end(pair)
+        scores.append(entry[0])
+    return scores
+
+  def put_scores(self, pairs: List[Pair], scores: List[float]) -> None:
+    with self._lock:
+      now = time.time()
+      for pair, score in zip(pairs, scores):
+        self._scores[pair] = (score, now)
+        self._scores.move_to_end(pair)
+
+      # Evict least recently used scores
+      while len(self._scores) > self.max_scores:
+        self._scores.popitem(last=False)
+
+  def invalidate(self, doc_id: str) -> None:
+    """
+      Drop every entry that depends on a document, e.g. when it is indexed or re-indexed
+    """
+    with self._lock:
+      for key in [key for key in self._entries if key[0][0] == "*" or doc_id in key[0][0].split(",")]:
+        del self._entries[key]
+      for pair in [pair for pair in self._scores if pair[1] == doc_id]:
+        del self._scores[pair]
+
+
+@lru_cache(maxsize=1)
+def get_retrieval_cache() -> RetrievalCache:
+  """
+    Return the process-wide retrieval cache shared by all sessions
+  """
+  return RetrievalCache()
@@ -0,0 +1,65 @@
+import tiktoken
+from functools import lru_cache
+from typing import Any, Dict, List
+
+# Gemini's tokenizer is not available locally, cl100k_base is a close & fast approximation
+TOKENIZER_NAME = "cl100k_base"
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer() -> tiktoken.Encoding:
+  return tiktoken.get_encoding(TOKENIZER_NAME)
+
+
+def count_tokens(text: str) -> int:
+  return len(get_tokenizer().encode(text, disallowed_special=()))
+
+
+def get_overlap(text: str, next_text: str, max_overlap: int = 200) -> int:
+  """
+    Return the length of the longest suffix of a chunk that starts the next chunk, i.e. the splitter's overlap
+  """
+  for length in range(min(max_overlap, len(text), len(next_text)), 0, -1):
+    if text.endswith(next_text[:length]):
+      return length
+  return 0
+
+
+def merge_adjacent_hits(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+  """
+    Merge the hits of consecutive chunks of the same document into passages without the overlapping text.
+    A passage is worth the best score of its chunks
+  """
+  passages = []
+  for hit in sorted(hits, key=lambda hit: (hit["doc_id"], hit["chunk_index"])):
+    last = passages[-1] if passages else None
+    if last is not None and last["doc_id"] == hit["doc_id"] and hit["chunk_index"] == last["last_chunk_index"] + 1:
+      overlap = get_overlap(last["text"], hit["text"])
+      last["text"] += hit["text"][overlap:] if overlap else "\n" + hit["text"]
+      last["last_chunk_index"] = hit["chunk_index"]
+      last["score"] = max(last["score"], hit["score"])
+    else:
+      passages.append({
+        "doc_id": hit["doc_id"],
+        "chunk_index": hit["chunk_index"],
+        "last_chunk_index": hit["chunk_index"],
+        "page": hit.get("page"),
+        "text": hit["text"],
+        "score": hit["score"]
+      })
+  return passages
+
+
+def pack_context(hits: List[Dict[str, Any]], max_tokens: int = 4000) -> List[str]:
+  """
+    Merge adjacent chunks & Return the passages that fit in the token budget, the most relevant first
+  """
+  packed = []
+  remaining = max_tokens
+  for passage in sorted(merge_adjacent_hits(hits), key=lambda passage: passage["score"], reverse=True):
+    num_tokens = count_tokens(passage["text"])
+    if num_tokens > remaining:
+      continue # A less relevant but shorter passage may still fit
+    packed.append(passage["text"])
+    remaining -= num_tokens
+  return packed
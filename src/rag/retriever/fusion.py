@@ -0,0 +1,77 @@
+import re
+import hashlib
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def get_text_hash(text: str) -> bytes:
+  """
+    Hash a text ignoring case & whitespace differences
+  """
+  return hashlib.blake2b(" ".join(text.lower().split()).encode("utf-8"), digest_size=16).digest()
+
+
+def get_simhash(text: str, shingle_size: int = 3) -> int:
+  """
+    Return the 64-bit SimHash of the word shingles of a text, near-duplicate texts differ in a few bits
+  """
+  tokens = TOKEN_PATTERN.findall(text.lower())
+  shingles = [" ".join(tokens[i:i + shingle_size]) for i in range(max(len(tokens) - shingle_size + 1, 1))]
+  digests = b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in shingles)
+
+  # Each bit is set when it is set in the majority of the shingle hashes
+  bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(len(shingles), 8), axis=1)
+  majority = bits.sum(axis=0) * 2 > len(shingles)
+  return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+def fuse_hits(
+  rankings: List[List[Dict[str, Any]]],
+  top_k: Optional[int] = 10,
+  method: str = "rrf",
+  k: int = 60,
+  max_distance: int = 3
+) -> List[Dict[str, Any]]:
+  """
+    Fuse the hits of several queries, each one best first, into a single ranking of at most `top_k` hits:
+      - rrf: sum of the reciprocal ranks of a chunk across queries, favoring chunks relevant to several sub-queries
+      - score: best score of a chunk across queries
+    Exact duplicates & near-duplicates (SimHash within `max_distance` bits) of a better ranked chunk are dropped.
+    Each hit gets the fused score as `score` & the index of the query ranking it best as `query_index`
+  """
+  if method not in ("rrf", "score"):
+    raise ValueError(f"Unknown fusion method: {method}")
+
+  scores: Dict[tuple, float] = {}
+  hits: Dict[tuple, Dict[str, Any]] = {}
+  best_ranks: Dict[tuple, tuple] = {} # (rank, query index) of the best ranking of each chunk
+  for query_index, ranking in enumerate(rankings):
+    for rank, hit in enumerate(ranking):
+      key = (hit["doc_id"], hit["chunk_index"])
+      if key not in hits:
+        hits[key] = hit
+      best_ranks[key] = min(best_ranks.get(key, (rank, query_index)), (rank, query_index))
+      if method == "rrf":
+        scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+      else:
+        scores[key] = max(scores.get(key, float("-inf")), hit["score"])
+
+  fused_hits = []
+  seen_hashes = set()
+  simhashes = []
+  for key in sorted(scores, key=scores.get, reverse=True):
+    text = hits[key]["text"]
+    text_hash = get_text_hash(text)
+    if text_hash in seen_hashes:
+      continue
+    seen_hashes.add(text_hash)
+    simhash = get_simhash(text)
+    if any(bin(simhash ^ other).count("1") <= max_distance for other in simhashes):
+      continue
+    simhashes.append(simhash)
+    fused_hits.append({**hits[key], "score": scores[key], "query_index": best_ranks[key][1]})
+    if top_k is not None and len(fused_hits) >= top_k:
+      break
+  return fused_hits
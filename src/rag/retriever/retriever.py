@@ -1,83 +1,314 @@
-from typing import List
-from ...db import collection
-from pymilvus import AnnSearchRequest, RRFRanker
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from ...db import get_vector_store
+from ..embedding import embed_texts
+from ..models import compute_rerank_scores
+from .fusion import fuse_hits
+from .cache import RetrievalCache
+from ...utils import clean_text, trace_span
 
 
 class CustomMultiQueryRetriever:
-  def __init__(self, queries: List[str], config: dict):
+  def __init__(self, queries: List[str], config: dict, limit: int = 10, top_k: int = 5):
     self.queries = queries
     self.config = config
+    self.limit = limit # Number of hybrid search results per query
+    self.top_k = top_k # Number of reranked documents kept per query
 
-  def rerank_documents(self, query: str, docs: List[str], top_k: int=5) -> List[str]:
+  def rerank_documents(self, query: str, docs: List[str], top_k: Optional[int]=None) -> List[str]:
     """
-      Calculate a relevance score between each query-document pair & Return top-k relevant documents 
+      Calculate a relevance score between each query-document pair & Return top-k relevant documents
+    """
+    return self.rerank_documents_batch([query], [docs], top_k)[0]
+
+
+  def rerank_documents_batch(self, queries: List[str], docs_per_query: List[List[str]], top_k: Optional[int]=None) -> List[List[str]]:
+    """
+      Score the query-document pairs of all queries in one cross-encoder call & Return top-k relevant documents of each query
+    """
+    hits_per_query = [[{"text": doc} for doc in docs] for docs in docs_per_query]
+    return [[hit["text"] for hit in hits] for hits in self.rerank_hits_batch(queries, hits_per_query, top_k)]
+
+
+  def rerank_hits_batch(self, queries: List[str], hits_per_query: List[List[Dict[str, Any]]], top_k: Optional[int]=None) -> List[List[Dict[str, Any]]]:
+    """
+      Score the query-hit pairs of all queries in one cross-encoder call
+      & Return top-k relevant hits of each query, with the reranker score as their score
+    """
+    top_k = top_k or self.top_k
+    if self.config["configurable"].get("rerank_mode", "full") == "cascade":
+      return self.cascade_rerank_hits_batch(queries, hits_per_query, top_k)
+
+    scores = self.score_hits_cached(queries, hits_per_query)
+
+    # Keep top-k hits of each query
+    top_k_hits = []
+    for hits, query_scores in zip(hits_per_query, scores):
+      ranked_order = sorted(range(len(hits)), key=lambda i: query_scores[i], reverse=True)
+      top_k_hits.append([{**hits[i], "score": float(query_scores[i])} for i in ranked_order[:top_k]])
+    return top_k_hits
+
+
+  def score_hits_batch(
+    self,
+    rerank_function,
+    queries: List[str],
+    hits_per_query: List[List[Dict[str, Any]]],
+    span_name: str,
+    max_chars: Optional[int] = None
+  ) -> List[List[float]]:
+    """
+      Score the query-hit pairs of all queries in one reranker call, passages truncated to `max_chars`
+    """
+    # Flatten all query-document pairs into a single batch
+    pairs = [[query, hit["text"][:max_chars] if max_chars else hit["text"]] for query, hits in zip(queries, hits_per_query) for hit in hits]
+    if not pairs:
+      return [[] for _ in queries]
+    with trace_span(self.config, span_name, pairs=len(pairs)):
+      scores = compute_rerank_scores(rerank_function, pairs)
+
+    # Split the scores back per query
+    scores_per_query = []
+    start = 0
+    for hits in hits_per_query:
+      scores_per_query.append([float(score) for score in scores[start:start + len(hits)]])
+      start += len(hits)
+    return scores_per_query
+
+
+  def score_hits_cached(self, queries: List[str], hits_per_query: List[List[Dict[str, Any]]]) -> List[List[float]]:
+    """
+      Score the query-hit pairs of all queries with the cross-encoder, reusing the scores of pairs
+      scored in previous turns
     """
     bge_rf = self.config["configurable"]["rerank_function"]
+    cache: Optional[RetrievalCache] = self.config["configurable"].get("retrieval_cache")
+    if cache is None:
+      return self.score_hits_batch(bge_rf, queries, hits_per_query, "retrieval.rerank")
 
-    results = bge_rf(
-      query=query,
-      documents=docs,
-      top_k=top_k
+    # Hits without a chunk id, e.g. raw documents, are always scored
+    pairs_per_query = [
+      [(clean_text(query), hit["doc_id"], hit["chunk_index"]) if "doc_id" in hit else None for hit in hits]
+      for query, hits in zip(queries, hits_per_query)
+    ]
+    scores_per_query = []
+    for pairs in pairs_per_query:
+      cached = iter(cache.get_scores([pair for pair in pairs if pair is not None]))
+      scores_per_query.append([next(cached) if pair is not None else None for pair in pairs])
+
+    missing_per_query = [[i for i, score in enumerate(scores) if score is None] for scores in scores_per_query]
+    new_scores = self.score_hits_batch(
+      bge_rf,
+      queries,
+      [[hits[i] for i in missing] for hits, missing in zip(hits_per_query, missing_per_query)],
+      "retrieval.rerank"
     )
+    for pairs, scores, missing, query_scores in zip(pairs_per_query, scores_per_query, missing_per_query, new_scores):
+      for i, score in zip(missing, query_scores):
+        scores[i] = score
+      cache.put_scores([pairs[i] for i in missing if pairs[i] is not None], [scores[i] for i in missing if pairs[i] is not None])
+    return scores_per_query
+
+
+  def get_decisive_hits(self, hits: List[Dict[str, Any]], top_k: int, margin: float) -> Tuple[List[int], List[int]]:
+    """
+      Return the indices of the hits decisively inside & outside the top-k, i.e. whose fused score,
+      relative to the best one, is at least `margin` away from the top-k boundary
+    """
+    if len(hits) <= top_k or any("score" not in hit for hit in hits):
+      return [], []
+    order = sorted(range(len(hits)), key=lambda i: hits[i]["score"], reverse=True)
+    best_score = hits[order[0]]["score"]
+    if best_score <= 0:
+      return [], []
+    normalized = [hits[i]["score"] / best_score for i in order]
+    kept = [order[i] for i in range(top_k) if normalized[i] - normalized[top_k] >= margin]
+    dropped = [order[i] for i in range(top_k, len(order)) if normalized[top_k - 1] - normalized[i] >= margin]
+    return kept, dropped
+
+
+  def cascade_rerank_hits_batch(self, queries: List[str], hits_per_query: List[List[Dict[str, Any]]], top_k: Optional[int]=None) -> List[List[Dict[str, Any]]]:
+    """
+      Rerank in stages so that the cross-encoder scores fewer & shorter pairs:
+        - hits decisively inside or outside the top-k by their fused score skip reranking
+        - an optional light reranker keeps the best `light_rerank_top_n` remaining hits of each query
+        - the cross-encoder scores at most `rerank_max_pairs` pairs, passages truncated to `rerank_max_chars`
+      Hits which are kept without a cross-encoder score are ranked first, hits beyond the budget last
+    """
+    top_k = top_k or self.top_k
+    configurable = self.config["configurable"]
+    margin = configurable.get("rerank_margin", 0.3)
+    max_pairs = configurable.get("rerank_max_pairs", 32)
+    max_chars = configurable.get("rerank_max_chars", 512)
+    light_rf = configurable.get("light_rerank_function")
+    # Half of the search hits by default, so that the light reranker prunes candidates
+    light_top_n = configurable.get("light_rerank_top_n", max(top_k, self.limit // 2))
+
+    # Skip the hits whose fused score margin is decisive, candidates stay ordered best first
+    kept_per_query, candidates_per_query = [], []
+    for hits in hits_per_query:
+      kept, dropped = self.get_decisive_hits(hits, top_k, margin)
+      skipped = set(kept) | set(dropped)
+      kept_per_query.append([hits[i] for i in kept])
+      candidates = [hit for i, hit in enumerate(hits) if i not in skipped] if len(kept) < top_k else []
+      candidates_per_query.append(candidates)
+
+    # Narrow the candidates down with the light reranker
+    if light_rf is not None:
+      light_scores = self.score_hits_batch(light_rf, queries, candidates_per_query, "retrieval.light_rerank", max_chars)
+      for i, (kept, candidates, scores) in enumerate(zip(kept_per_query, candidates_per_query, light_scores)):
+        ranked_order = sorted(range(len(candidates)), key=lambda j: scores[j], reverse=True)
+        candidates_per_query[i] = [candidates[j] for j in ranked_order[:max(light_top_n, top_k - len(kept))]]
+
+    # Share the pair budget of the cross-encoder between the queries
+    budget = max(max_pairs // max(len(queries), 1), 1)
+    scored_per_query = [candidates[:budget] for candidates in candidates_per_query]
+    bge_rf = configurable["rerank_function"]
+    scores = self.score_hits_batch(bge_rf, queries, scored_per_query, "retrieval.rerank", max_chars)
+
+    top_k_hits = []
+    for kept, candidates, scored, query_scores in zip(kept_per_query, candidates_per_query, scored_per_query, scores):
+      ranked = sorted(zip(scored, query_scores), key=lambda pair: pair[1], reverse=True)
+      best_score = ranked[0][1] if ranked else 1.0
+      lowest_score = ranked[-1][1] if ranked else 0.0
+      hits = [{**hit, "score": best_score} for hit in kept]
+      hits += [{**hit, "score": score} for hit, score in ranked]
+      hits += [{**hit, "score": lowest_score} for hit in candidates[len(scored):]]
+      top_k_hits.append(hits[:top_k])
+    return top_k_hits
 
-    top_k_docs = [result.text for result in results]
-    return top_k_docs
-   
 
   def retrieve_documents(self, query: str) -> List[str]:
-    documents = []
-
-    # Embed queries into vectors
-    bge_m3_ef = self.config["configurable"]["embedding_function"]
-    query_embeddings = bge_m3_ef([query])
-
-    # Set up params for dense retrieval
-    dense_search_param = {
-      "data": query_embeddings["dense"],
-      "anns_field": "dense",
-      "param": {
-        "metric_type": "COSINE"
-      },
-      "limit": 10
-    }
-    request_1 = AnnSearchRequest(**dense_search_param)
-
-    # Set up params for sparse retrieval
-    sparse_search_param = {
-      "data": query_embeddings["sparse"],
-      "anns_field": "sparse",
-      "param": {
-        "metric_type": "IP",
-        "params": {"drop_ratio_build": 0.2}
-      },
-      "limit": 10
-    }
-    request_2 = AnnSearchRequest(**sparse_search_param)
-    reqs = [request_1, request_2]
-
-    # Perform Hybrid search
-    results = collection.hybrid_search(
-      reqs=reqs,
-      rerank=RRFRanker(60),
-      limit=10,
-      output_fields=["text"]
-    )
-    
-    for result in results[0]:
-      documents.append(result["entity"]["text"])
-
-    # Rerank using BGE reranker 
-    top_k_docs = self.rerank_documents(query, documents)
-    return top_k_docs
-  
-  
-  def get_unique_documents(self, docs: List[str]) -> List[str]:
-    return [doc for i, doc in enumerate(docs) if doc not in docs[:i]]
-  
+    return self.retrieve_documents_batch([query])[0]
+
+
+  def retrieve_documents_batch(self, queries: List[str]) -> List[List[str]]:
+    """
+      Embed, search & rerank all queries together & Return top-k relevant documents of each query
+    """
+    return [[hit["text"] for hit in hits] for hits in self.retrieve_hits_batch(queries)]
+
+
+  def collapse_queries(self, dense: np.ndarray, threshold: float) -> List[int]:
+    """
+      Map each query to the first query whose L2-normalized dense embedding is at least `threshold` similar,
+      so that near-identical reformulations are searched once
+    """
+    representatives = []
+    similarities = dense @ dense.T
+    for i in range(len(dense)):
+      representatives.append(next((j for j in dict.fromkeys(representatives) if similarities[i, j] >= threshold), i))
+    return representatives
+
+
+  def retrieve_hits_batch(self, queries: List[str]) -> List[List[Dict[str, Any]]]:
+    """
+      Embed, search & rerank all queries together & Return top-k relevant hits of each query
+    """
+    return self.rerank_hits_batch(queries, self.retrieve_candidates_batch(queries))
+
+
+  def retrieve_candidates_batch(self, queries: List[str]) -> List[List[Dict[str, Any]]]:
+    """
+      Embed & search all queries together & Return the hybrid search hits of each query, best first.
+      Queries are searched once per normalized text & once per group of near-identical embeddings,
+      & hits of queries searched in previous turns are reused from the retrieval cache
+    """
+    configurable = self.config["configurable"]
+    cache: Optional[RetrievalCache] = configurable.get("retrieval_cache")
+    keys = [clean_text(query) for query in queries]
+    unique_queries = {key: query for key, query in reversed(list(zip(keys, queries)))} # First query of each key
+    hits_per_key: Dict[str, List[Dict[str, Any]]] = {}
+
+    scope = None
+    if cache is not None:
+      scope = cache.get_scope(configurable.get("doc_ids"), str(self.limit))
+      with trace_span(self.config, "retrieval.cache", queries=len(unique_queries)) as span:
+        for key in unique_queries:
+          hits = cache.get(key, scope)
+          if hits is not None:
+            hits_per_key[key] = hits
+        span.set("hits", len(hits_per_key))
+
+    misses = [key for key in dict.fromkeys(keys) if key not in hits_per_key]
+    if misses:
+      # Embed all queries into vectors in one forward pass
+      with trace_span(self.config, "retrieval.embed", queries=len(misses)):
+        query_embeddings = embed_texts([unique_queries[key] for key in misses], self.config)
+      dense = np.asarray(query_embeddings["dense"], dtype=np.float32)
+      dense /= np.maximum(np.linalg.norm(dense, axis=1, keepdims=True), 1e-12)
+
+      # Reuse the hits of a similar query of a previous turn
+      if cache is not None:
+        with trace_span(self.config, "retrieval.cache_similar", queries=len(misses)) as span:
+          for i, key in enumerate(misses):
+            hits = cache.get_similar(dense[i], scope)
+            if hits is not None:
+              hits_per_key[key] = hits
+          span.set("hits", sum(key in hits_per_key for key in misses))
+
+      # Search a single query of each group of near-identical queries
+      remaining = [i for i, key in enumerate(misses) if key not in hits_per_key]
+      representatives = [remaining[j] for j in self.collapse_queries(dense[remaining], configurable.get("query_dedupe_threshold", 0.95))]
+      searched = list(dict.fromkeys(representatives))
+      if searched:
+        results = self.search_hits_batch(
+          [query_embeddings["dense"][i] for i in searched],
+          query_embeddings["sparse"][searched]
+        )
+        searched_hits = dict(zip(searched, results))
+        for i, representative in zip(remaining, representatives):
+          hits_per_key[misses[i]] = searched_hits[representative]
+          if cache is not None:
+            cache.put(misses[i], dense[i], searched_hits[representative], scope)
+
+    return [hits_per_key[key] for key in keys]
+
+
+  def search_hits_batch(self, dense: list, sparse) -> List[List[Dict[str, Any]]]:
+    """
+      Search embedded queries together & Return the hybrid search hits of each query
+    """
+    # Search all queries in one round trip, restricted to the documents attached to the session
+    vector_store = get_vector_store(self.config)
+    with trace_span(self.config, "retrieval.hybrid_search", queries=len(dense)) as span:
+      results = vector_store.hybrid_search(
+        dense=dense,
+        sparse=sparse,
+        limit=self.limit,
+        doc_ids=self.config["configurable"].get("doc_ids")
+      )
+      span.set("candidates", sum(len(hits) for hits in results))
+    return results
+
 
   def get_relevant_documents(self) -> List[str]:
-    documents = [] # List of top-k documents of each query
-    for query in self.queries:
-      documents.extend(self.retrieve_documents(query))
-    return self.get_unique_documents(documents)
-  
\ No newline at end of file
+    return [hit["text"] for hit in self.get_relevant_hits()]
+
+
+  def get_relevant_hits(self) -> List[Dict[str, Any]]:
+    """
+      Fuse the search hits of all queries into a single set of candidates without duplicates or near-duplicates,
+      so that the cross-encoder scores each of them once, against the query ranking it best,
+      & Return the top-k candidates by reranker score
+    """
+    if not self.queries:
+      return []
+    configurable = self.config["configurable"]
+    top_k = configurable.get("fusion_top_k", 10)
+
+    candidates_per_query = self.retrieve_candidates_batch(self.queries)
+    with trace_span(self.config, "retrieval.fusion", hits=sum(len(hits) for hits in candidates_per_query)) as span:
+      candidates = fuse_hits(
+        candidates_per_query,
+        top_k=configurable.get("fusion_max_candidates"),
+        method=configurable.get("fusion_method", "rrf")
+      )
+      span.set("candidates", len(candidates))
+
+    # Rerank the candidates of each query, best fused first, & Keep its top-k
+    hits_per_query = [[] for _ in self.queries]
+    for hit in candidates:
+      hits_per_query[hit["query_index"]].append(hit)
+    reranked = self.rerank_hits_batch(self.queries, hits_per_query)
+    return sorted((hit for hits in reranked for hit in hits), key=lambda hit: hit["score"], reverse=True)[:top_k]
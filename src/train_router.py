@@ -0,0 +1,78 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(project_root)
+
+from langchain_core.messages import HumanMessage
+from langchain_core.output_parsers import JsonOutputParser
+from src.rag import get_llm, get_embedding_function, query_routing_prompt
+from src.workflow import LocalRouter, log_routing_decision, load_routing_decisions
+
+
+def parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description="Train the local query router from logged LLM routing decisions & the QA dataset")
+  parser.add_argument("--decisions", default=os.path.join(project_root, "data", "router", "decisions.jsonl"))
+  parser.add_argument("--qa-dataset", default=os.path.join(project_root, "data", "qa", "qa_dataset.json"))
+  parser.add_argument("--output", default=os.path.join(project_root, "data", "router", "router.joblib"))
+  parser.add_argument("--threshold", type=float, default=0.8, help="Minimum probability to skip the LLM router")
+  parser.add_argument("--test-size", type=float, default=0.2)
+  return parser.parse_args()
+
+
+def main():
+  args = parse_args()
+  config = {"configurable": {"embedding_function": get_embedding_function()}}
+  decisions = load_routing_decisions(args.decisions)
+
+  # Label the QA questions not seen yet with the LLM router, as standalone first questions
+  with open(args.qa_dataset, "r", encoding="utf-8") as file:
+    qa_dataset = json.load(file)
+  labeled = {(decision["query"], decision["num_messages"]) for decision in decisions}
+  llm_router = query_routing_prompt | get_llm() | JsonOutputParser()
+  for sample in qa_dataset:
+    if (sample["question"], 1) in labeled:
+      continue
+    query_class = llm_router.invoke({"summary": "", "messages": [HumanMessage(content=sample["question"])], "query": sample["question"]})["class"]
+    log_routing_decision(sample["question"], query_class, 1, args.decisions)
+    decisions.append({"query": sample["question"], "class": query_class, "num_messages": 1})
+
+  # Hold out a test split to estimate how often & how well the LLM call can be skipped
+  rng = np.random.default_rng(0)
+  order = rng.permutation(len(decisions))
+  num_test = int(len(decisions) * args.test_size)
+  test, train = [decisions[i] for i in order[:num_test]], [decisions[i] for i in order[num_test:]]
+
+  def fit(samples: list) -> LocalRouter:
+    return LocalRouter(threshold=args.threshold).fit(
+      [sample["query"] for sample in samples],
+      [sample["num_messages"] for sample in samples],
+      [sample["class"] for sample in samples],
+      config
+    )
+
+  if test:
+    router = fit(train)
+    covered, correct, latencies = 0, 0, []
+    for sample in test:
+      start = time.perf_counter()
+      query_class = router.route(sample["query"], sample["num_messages"], config)
+      latencies.append(time.perf_counter() - start)
+      if query_class is not None:
+        covered += 1
+        correct += query_class == sample["class"]
+    print(f"Held-out queries routed locally: {covered}/{len(test)}")
+    if covered:
+      print(f"Agreement with the LLM router on those: {correct / covered:.3f}")
+    print(f"Median local routing time: {np.median(latencies) * 1000:.1f} ms (including query embedding)")
+
+  # Train the final router on all decisions
+  fit(decisions).save(args.output)
+  print(f"Saved router trained on {len(decisions)} decisions to {args.output}")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,7 +1,41 @@
-from .clean_text import clean_text
+from .clean_text import clean_text, clean_texts
 from .dump_json import dump_json
+from .jsonl_log import JsonlWriter, get_jsonl_writer, read_jsonl
+from .strip_fences import strip_fences, FenceStripper
+from .async_runner import get_event_loop, run_async, iterate_async
+from .tracing import (
+  Trace,
+  Tracer,
+  NoOpTracer,
+  PrometheusExporter,
+  OpenTelemetryExporter,
+  configure_tracing,
+  get_tracer,
+  get_callbacks,
+  trace_span,
+  trace_node
+)
 
 __all__ = [
   "clean_text",
-  "dump_json"
+  "clean_texts",
+  "dump_json",
+  "JsonlWriter",
+  "get_jsonl_writer",
+  "read_jsonl",
+  "strip_fences",
+  "FenceStripper",
+  "get_event_loop",
+  "run_async",
+  "iterate_async",
+  "Trace",
+  "Tracer",
+  "NoOpTracer",
+  "PrometheusExporter",
+  "OpenTelemetryExporter",
+  "configure_tracing",
+  "get_tracer",
+  "get_callbacks",
+  "trace_span",
+  "trace_node"
 ]
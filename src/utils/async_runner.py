@@ -0,0 +1,37 @@
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+  """
+    Return the process-wide event loop shared by all sessions, starting it in a daemon thread on first use
+  """
+  global _loop
+  with _lock:
+    if _loop is None:
+      _loop = asyncio.new_event_loop()
+      threading.Thread(target=_loop.run_forever, name="async-runner", daemon=True).start()
+  return _loop
+
+
+def run_async(coro: Awaitable) -> Any:
+  """
+    Run a coroutine on the shared event loop & Block until its result is available
+  """
+  return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+def iterate_async(async_iterator: AsyncIterator) -> Iterator:
+  """
+    Consume an async iterator on the shared event loop from synchronous code
+  """
+  loop = get_event_loop()
+  while True:
+    try:
+      yield asyncio.run_coroutine_threadsafe(async_iterator.__anext__(), loop).result()
+    except StopAsyncIteration:
+      break
@@ -1,8 +1,84 @@
+import re
+import string
+import ahocorasick
 import contractions
+from functools import lru_cache
+from typing import List
 
+WORD_CHARS = frozenset(string.ascii_letters + string.digits + "_") # A contraction is not expanded inside a word
+NON_ASCII_LETTER_PATTERN = re.compile(r"[^\W\d_a-z]")
 
+
+@lru_cache(maxsize=1)
+def get_contraction_automaton() -> ahocorasick.Automaton:
+  """
+    Build an Aho-Corasick automaton of the contractions, leftovers & slang expanded by `contractions.fix`,
+    mapping each lowercased key to its length & lowercased expansion
+  """
+  automaton = ahocorasick.Automaton()
+  for replacements in (contractions.contractions_dict, contractions.leftovers_dict, contractions.slang_dict):
+    for key, value in replacements.items():
+      automaton.add_word(key.lower(), (len(key.lower()), value.lower()))
+  automaton.make_automaton()
+  return automaton
+
+
+def is_english(text: str) -> bool:
+  """
+    Tell whether lowercased text is English, i.e. at most 5% of its characters are non-ASCII letters.
+    Vietnamese has diacritics on most words
+  """
+  return len(NON_ASCII_LETTER_PATTERN.findall(text)) * 20 <= len(text)
+
+
+def expand_contractions(text: str) -> str:
+  """
+    Expand the contractions of lowercased text in a single pass,
+    resolving overlapping matches like `contractions.fix` does
+  """
+  matches = [] # (start, stop, expansion) in order
+  current_stop = -1
+  for end_index, (length, expansion) in get_contraction_automaton().iter(text):
+    start, stop = end_index - length + 1, end_index + 1
+    if (stop < len(text) and text[stop] in WORD_CHARS) or (start > 0 and text[start - 1] in WORD_CHARS):
+      continue
+    if start >= current_stop:
+      current_stop = stop
+      matches.append((start, stop, expansion))
+    elif matches and stop - start > matches[-1][1] - matches[-1][0]:
+      # A longer match overlapping the previous one replaces it
+      current_stop = max(current_stop, stop)
+      matches[-1] = (start, current_stop, expansion)
+  if not matches:
+    return text
+
+  output = []
+  position = 0
+  for start, stop, expansion in matches:
+    output.append(text[position:start])
+    output.append(expansion)
+    position = stop
+  output.append(text[position:])
+  return "".join(output)
+
+
+def normalize_text(text: str) -> str:
+  text = text.lower()
+  # Contractions are English, expanding them elsewhere only corrupts words such as "im" in Vietnamese
+  return expand_contractions(text) if is_english(text) else text
+
+
+@lru_cache(maxsize=4096)
 def clean_text(text: str) -> str:
   """
-    Lowercase & Normalize text 
+    Lowercase & Normalize text. Memoized, since the same queries are normalized on each turn
+  """
+  return normalize_text(text)
+
+
+def clean_texts(texts: List[str]) -> List[str]:
+  """
+    Lowercase & Normalize a batch of texts, e.g. the chunks of a document, normalizing each distinct text once
   """
-  return contractions.fix(text).lower()
+  normalized = {text: normalize_text(text) for text in dict.fromkeys(texts)}
+  return [normalized[text] for text in texts]
@@ -1,18 +1,9 @@
-import os
-import json
+from .jsonl_log import get_jsonl_writer
 
 
-def dump_json(data: dict, output_path: str="../data/reviews.json") -> None:
+def dump_json(data: dict, output_path: str="../data/reviews.jsonl") -> None:
   """
-    Store RAG results in a JSON file for reviewing
+    Store RAG results in a JSON Lines file for reviewing, appended by a background writer.
+    Read them back with `read_jsonl`
   """
-  if os.path.exists(output_path):
-    with open(output_path, 'r+', encoding='utf-8') as file:
-      existing_data = json.load(file)
-      existing_data.append(data)
-      file.seek(0)
-      json.dump(existing_data, file, ensure_ascii=False, indent=2)
-  else:
-    with open(output_path, 'w', encoding='utf-8') as file:
-      json.dump([data], file, ensure_ascii=False, indent=2)
-      
\ No newline at end of file
+  get_jsonl_writer(output_path).write(data)
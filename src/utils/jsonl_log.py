@@ -0,0 +1,133 @@
+import os
+import glob
+import queue
+import atexit
+import time
+import orjson
+import threading
+from functools import lru_cache
+from typing import Any, Iterator, List, Optional
+
+
+class JsonlWriter:
+  """
+    Append-only JSON Lines log written by a background thread, so logging costs a queue put on the request path.
+    Records are written & fsynced in batches, and the file is rotated to `<path>.1`, `<path>.2`, ... past `max_bytes`.
+    A batch that fails to be written is retried up to `max_retries` times, then counted in `dropped_records`
+  """
+  def __init__(
+    self,
+    path: str,
+    max_bytes: int = 64 * 1024 * 1024,
+    backup_count: int = 10,
+    max_batch_size: int = 256,
+    flush_interval: float = 1.0,
+    max_retries: int = 3
+  ):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.backup_count = backup_count
+    self.max_batch_size = max_batch_size
+    self.flush_interval = flush_interval
+    self.max_retries = max_retries
+    self.dropped_records = 0 # Records given up on after `max_retries` failed writes
+    self.last_error: Optional[Exception] = None # Error of the last failed write
+    self._queue: "queue.Queue[Any]" = queue.Queue()
+    self._file = None
+    threading.Thread(target=self._run, name=f"jsonl-writer-{os.path.basename(path)}", daemon=True).start()
+    atexit.register(self.flush)
+
+  def write(self, record: dict) -> None:
+    self._queue.put(record)
+
+  def flush(self) -> None:
+    """
+      Block until all queued records are written & synced to disk, or dropped after failing to be
+    """
+    self._queue.join()
+
+  def _run(self) -> None:
+    while True:
+      batch = [self._queue.get()]
+
+      # Gather the records queued meanwhile, waiting up to `flush_interval` to fill the batch
+      while len(batch) < self.max_batch_size:
+        try:
+          batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+          break
+
+      for attempt in range(self.max_retries + 1):
+        if attempt > 0:
+          time.sleep(self.flush_interval)
+        try:
+          self._write_batch(b"".join(orjson.dumps(record, default=str) + b"\n" for record in batch))
+          break
+        except Exception as e:
+          self.last_error = e
+          self._close() # Reopened on the next attempt, in case the file was rotated away or its handle broke
+      else:
+        self.dropped_records += len(batch)
+      for _ in batch:
+        self._queue.task_done()
+
+  def _write_batch(self, data: bytes) -> None:
+    if self._file is None:
+      if os.path.dirname(self.path):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+      self._file = open(self.path, "ab")
+    if self._file.tell() > 0 and self._file.tell() + len(data) > self.max_bytes:
+      self._rotate()
+    self._file.write(data)
+    self._file.flush()
+    os.fsync(self._file.fileno())
+
+  def _close(self) -> None:
+    if self._file is not None:
+      try:
+        self._file.close()
+      except OSError:
+        pass
+      self._file = None
+
+  def _rotate(self) -> None:
+    self._file.close()
+    for i in range(self.backup_count - 1, 0, -1):
+      if os.path.exists(f"{self.path}.{i}"):
+        os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+    if self.backup_count > 0:
+      os.replace(self.path, f"{self.path}.1")
+    else:
+      os.remove(self.path)
+    self._file = open(self.path, "ab")
+
+
+@lru_cache(maxsize=None)
+def get_jsonl_writer(path: str) -> JsonlWriter:
+  """
+    Return the process-wide writer of a log file, so that concurrent sessions append through one thread
+  """
+  return JsonlWriter(path)
+
+
+def get_log_files(path: str) -> List[str]:
+  """
+    Return the rotated files of a log followed by the current one, oldest first
+  """
+  rotated = [file for file in glob.glob(f"{glob.escape(path)}.*") if file.rsplit(".", 1)[-1].isdigit()]
+  rotated.sort(key=lambda file: int(file.rsplit(".", 1)[-1]), reverse=True)
+  return rotated + ([path] if os.path.exists(path) else [])
+
+
+def read_jsonl(path: str, include_rotated: bool = True) -> Iterator[dict]:
+  """
+    Iterate over the records of a log, oldest first. A line cut by a crash is skipped
+  """
+  file_paths = get_log_files(path) if include_rotated else [path] if os.path.exists(path) else []
+  for file_path in file_paths:
+    with open(file_path, "rb") as file:
+      for line in file:
+        try:
+          yield orjson.loads(line)
+        except orjson.JSONDecodeError:
+          continue
@@ -0,0 +1,46 @@
+import re
+
+FENCE_PATTERN = re.compile(r"```markdown|```")
+FENCE_PREFIX_PATTERN = re.compile(r"`+(?:m(?:a(?:r(?:k(?:d(?:o(?:w)?)?)?)?)?)?)?\Z")
+
+
+def strip_fences(text: str) -> str:
+  """
+    Remove the markdown code fences the LLM wraps its answers in
+  """
+  return FENCE_PATTERN.sub("", text).strip()
+
+
+class FenceStripper:
+  """
+    Apply `strip_fences` incrementally to a stream of tokens: the concatenation of the outputs of `feed` & `flush`
+    equals `strip_fences` of the concatenated tokens
+  """
+  def __init__(self):
+    self._buffer = "" # Tail which may be the beginning of a fence
+    self._whitespace = "" # Trailing whitespace, only emitted when followed by text
+    self._started = False
+
+  def feed(self, text: str) -> str:
+    self._buffer += text
+    # Hold back a trailing run of backticks, which may be part of a fence depending on the next tokens
+    match = FENCE_PREFIX_PATTERN.search(self._buffer)
+    held = len(match.group()) if match else 0
+    ready = self._buffer[:len(self._buffer) - held]
+    self._buffer = self._buffer[len(self._buffer) - held:]
+    return self._emit(FENCE_PATTERN.sub("", ready))
+
+  def flush(self) -> str:
+    text = self._emit(FENCE_PATTERN.sub("", self._buffer))
+    self._buffer = ""
+    self._whitespace = ""
+    return text
+
+  def _emit(self, text: str) -> str:
+    if not self._started:
+      text = text.lstrip()
+      self._started = bool(text)
+    text = self._whitespace + text
+    stripped = text.rstrip()
+    self._whitespace = text[len(stripped):]
+    return stripped
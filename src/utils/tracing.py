@@ -0,0 +1,267 @@
+import time
+import inspect
+import threading
+import functools
+from typing import Any, Dict, List, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class Span:
+  """
+    A timed stage of a turn with its attributes, e.g. token or candidate counts
+  """
+  __slots__ = ("name", "start_time_ns", "duration", "attributes")
+
+  def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+    self.name = name
+    self.start_time_ns = time.time_ns()
+    self.duration = 0.0 # Seconds
+    self.attributes = attributes or {}
+
+  def set(self, key: str, value: Any) -> None:
+    self.attributes[key] = value
+
+
+class Trace:
+  """
+    Spans recorded during one conversation turn
+  """
+  def __init__(self):
+    self.spans: List[Span] = []
+    self._lock = threading.Lock()
+
+  def add(self, span: Span) -> None:
+    with self._lock:
+      self.spans.append(span)
+
+  def breakdown(self) -> List[Dict[str, Any]]:
+    """
+      Return the spans of the turn in start order, with durations in milliseconds
+    """
+    with self._lock:
+      spans = sorted(self.spans, key=lambda span: span.start_time_ns)
+    return [{"name": span.name, "duration_ms": round(span.duration * 1000, 2), **span.attributes} for span in spans]
+
+
+class _SpanContext:
+  def __init__(self, tracer: "Tracer", trace: Optional[Trace], name: str, attributes: Dict[str, Any]):
+    self.tracer = tracer
+    self.trace = trace
+    self.span = Span(name, attributes)
+
+  def __enter__(self) -> Span:
+    self._start = time.perf_counter()
+    return self.span
+
+  def __exit__(self, *exc_info) -> None:
+    self.span.duration = time.perf_counter() - self._start
+    self.tracer.record(self.trace, self.span)
+
+
+class _NoOpSpan:
+  def set(self, key: str, value: Any) -> None:
+    pass
+
+  def __enter__(self) -> "_NoOpSpan":
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    pass
+
+
+_NOOP_SPAN = _NoOpSpan()
+
+
+class Tracer:
+  """
+    Record spans into the trace of the current turn & forward them to the exporters
+  """
+  enabled = True
+
+  def __init__(self, exporters: Optional[list] = None):
+    self.exporters = exporters or []
+
+  def span(self, trace: Optional[Trace], name: str, **attributes):
+    return _SpanContext(self, trace, name, attributes)
+
+  def record(self, trace: Optional[Trace], span: Span) -> None:
+    if trace is not None:
+      trace.add(span)
+    for exporter in self.exporters:
+      exporter.export(span)
+
+
+class NoOpTracer(Tracer):
+  """
+    Tracer used when tracing is disabled, every span is the same inert object
+  """
+  enabled = False
+
+  def span(self, trace: Optional[Trace], name: str, **attributes):
+    return _NOOP_SPAN
+
+  def record(self, trace: Optional[Trace], span: Span) -> None:
+    pass
+
+
+class PrometheusExporter:
+  """
+    Aggregate spans into Prometheus histograms of durations & counters of token counts
+  """
+  buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+  def __init__(self, namespace: str = "rag"):
+    self.namespace = namespace
+    self._histograms: Dict[str, Dict[str, Any]] = {}
+    self._counters: Dict[tuple, float] = {}
+    self._lock = threading.Lock()
+
+  def export(self, span: Span) -> None:
+    with self._lock:
+      histogram = self._histograms.setdefault(span.name, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+      for i, bound in enumerate(self.buckets):
+        if span.duration <= bound:
+          histogram["buckets"][i] += 1
+      histogram["sum"] += span.duration
+      histogram["count"] += 1
+      for key, value in span.attributes.items():
+        if key.endswith("_tokens") and isinstance(value, (int, float)):
+          self._counters[(span.name, key)] = self._counters.get((span.name, key), 0) + value
+
+  def render(self) -> str:
+    """
+      Return the metrics in the Prometheus text exposition format
+    """
+    name = f"{self.namespace}_span_duration_seconds"
+    lines = [f"# TYPE {name} histogram"]
+    with self._lock:
+      for span_name, histogram in sorted(self._histograms.items()):
+        for bound, count in zip(self.buckets, histogram["buckets"]):
+          lines.append(f'{name}_bucket{{span="{span_name}",le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{span="{span_name}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{name}_sum{{span="{span_name}"}} {histogram["sum"]}')
+        lines.append(f'{name}_count{{span="{span_name}"}} {histogram["count"]}')
+      lines.append(f"# TYPE {self.namespace}_tokens_total counter")
+      for (span_name, key), value in sorted(self._counters.items()):
+        lines.append(f'{self.namespace}_tokens_total{{span="{span_name}",type="{key[:-len("_tokens")]}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+  def serve(self, port: int = 9100) -> None:
+    """
+      Expose the metrics on http://0.0.0.0:<port>/metrics from a daemon thread
+    """
+    exporter = self
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        body = exporter.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+
+
+class OpenTelemetryExporter:
+  """
+    Forward spans to the globally configured OpenTelemetry tracer provider
+  """
+  def __init__(self, service_name: str = "research-rag-chatbot"):
+    from opentelemetry import trace
+    self._tracer = trace.get_tracer(service_name)
+
+  def export(self, span: Span) -> None:
+    attributes = {key: value for key, value in span.attributes.items() if isinstance(value, (str, bool, int, float))}
+    otel_span = self._tracer.start_span(span.name, start_time=span.start_time_ns, attributes=attributes)
+    otel_span.end(end_time=span.start_time_ns + int(span.duration * 1e9))
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+  """
+    Record a span with token counts for every LLM call of a turn
+  """
+  run_inline = True
+
+  def __init__(self, trace: Trace):
+    self.trace = trace
+    self._spans: Dict[Any, tuple] = {}
+
+  def on_chat_model_start(self, serialized: dict, messages: list, *, run_id, **kwargs) -> None:
+    model = (kwargs.get("invocation_params") or {}).get("model", "llm")
+    self._spans[run_id] = (Span("llm", {"model": model}), time.perf_counter())
+
+  def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+    if run_id not in self._spans:
+      return
+    span, start = self._spans.pop(run_id)
+    span.duration = time.perf_counter() - start
+    generation = response.generations[0][0] if response.generations and response.generations[0] else None
+    usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+    span.set("input_tokens", usage.get("input_tokens", 0))
+    span.set("output_tokens", usage.get("output_tokens", 0))
+    get_tracer().record(self.trace, span)
+
+  def on_llm_error(self, error: BaseException, *, run_id, **kwargs) -> None:
+    self._spans.pop(run_id, None)
+
+
+_tracer: Tracer = NoOpTracer()
+
+
+def get_tracer() -> Tracer:
+  return _tracer
+
+
+def configure_tracing(enabled: bool = True, exporters: Optional[list] = None) -> Tracer:
+  """
+    Set the process-wide tracer. Disabled tracing turns every span into a no-op
+  """
+  global _tracer
+  _tracer = Tracer(exporters) if enabled else NoOpTracer()
+  return _tracer
+
+
+def trace_span(config: dict, name: str, **attributes):
+  """
+    Open a span in the trace of the turn carried by the config
+  """
+  return _tracer.span(config["configurable"].get("trace"), name, **attributes)
+
+
+def get_callbacks(trace: Trace) -> list:
+  """
+    Return the LangChain callbacks recording the LLM calls of a turn
+  """
+  return [TracingCallbackHandler(trace)] if _tracer.enabled else []
+
+
+def trace_node(fn):
+  """
+    Wrap a graph node, sync or async, in a span named after the node
+  """
+  def get_name(config: dict) -> str:
+    return "node." + ((config or {}).get("metadata") or {}).get("langgraph_node", fn.__name__)
+
+  if inspect.iscoroutinefunction(fn):
+    @functools.wraps(fn)
+    async def async_wrapper(state, config):
+      if not _tracer.enabled:
+        return await fn(state, config)
+      with trace_span(config, get_name(config)):
+        return await fn(state, config)
+    return async_wrapper
+
+  @functools.wraps(fn)
+  def wrapper(state, config):
+    if not _tracer.enabled:
+      return fn(state, config)
+    with trace_span(config, get_name(config)):
+      return fn(state, config)
+  return wrapper
@@ -4,9 +4,22 @@ from .nodes import (
   document_retrieval,
   chatbot,
   summarize_conversation,
-  should_continue
+  should_continue,
+  aquery_routing,
+  route_query,
+  aquery_decompose,
+  adocument_retrieval,
+  achatbot,
+  asummarize_conversation,
+  query_analysis,
+  aquery_analysis,
+  route_analyzed_query
 )
-from .graph import get_graph_builder
+from .memory import get_history_window, should_summarize, BackgroundSummarizer, get_background_summarizer
+from .cache import SemanticCache, get_semantic_cache
+from .checkpoint import SQLCheckpointSaver, SqliteDatabase, PostgresDatabase, get_checkpointer
+from .router import LocalRouter, get_local_router, log_routing_decision, load_routing_decisions
+from .graph import get_graph_builder, get_async_graph_builder, get_combined_graph_builder
 
 __all__ = [
   "State",
@@ -15,5 +28,30 @@ __all__ = [
   "chatbot",
   "summarize_conversation",
   "should_continue",
-  "get_graph_builder"
+  "aquery_routing",
+  "route_query",
+  "aquery_decompose",
+  "adocument_retrieval",
+  "achatbot",
+  "asummarize_conversation",
+  "query_analysis",
+  "aquery_analysis",
+  "route_analyzed_query",
+  "get_history_window",
+  "should_summarize",
+  "BackgroundSummarizer",
+  "get_background_summarizer",
+  "SemanticCache",
+  "get_semantic_cache",
+  "SQLCheckpointSaver",
+  "SqliteDatabase",
+  "PostgresDatabase",
+  "get_checkpointer",
+  "LocalRouter",
+  "get_local_router",
+  "log_routing_decision",
+  "load_routing_decisions",
+  "get_graph_builder",
+  "get_async_graph_builder",
+  "get_combined_graph_builder"
 ]
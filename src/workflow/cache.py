@@ -0,0 +1,104 @@
+import time
+import faiss
+import threading
+import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+from ..rag.embedding import embed_texts
+from ..utils import clean_text
+
+
+class SemanticCache:
+  """
+    Cache of answers to past queries, looked up by cosine similarity of BGE-M3 query embeddings.
+    Entries are scoped to the documents of the session, expire after `ttl` seconds & are evicted in LRU order
+  """
+  def __init__(self, threshold: float = 0.92, ttl: float = 24 * 3600, max_entries: int = 10000, dim: int = 1024):
+    self.threshold = threshold
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self.dim = dim
+    self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict() # In LRU order
+    self._indexes: Dict[str, faiss.IndexIDMap] = {} # One index per set of documents
+    self._next_id = 0
+    self._lock = threading.Lock()
+
+  def get_doc_key(self, config: dict) -> str:
+    return ",".join(sorted(config["configurable"].get("doc_ids", [])))
+
+  def embed_query(self, query: str, config: dict) -> np.ndarray:
+    embedding = embed_texts([clean_text(query)], config)["dense"][0]
+    embedding = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+    faiss.normalize_L2(embedding)
+    return embedding
+
+  def lookup(self, query: str, config: dict) -> Optional[Dict[str, Any]]:
+    """
+      Return the cached answer & retrieved documents of the most similar past query, if it is similar enough
+    """
+    doc_key = self.get_doc_key(config)
+    embedding = self.embed_query(query, config)
+    with self._lock:
+      index = self._indexes.get(doc_key)
+      if index is None or index.ntotal == 0:
+        return None
+      scores, ids = index.search(embedding, 1)
+      score, entry_id = float(scores[0][0]), int(ids[0][0])
+      if entry_id < 0 or score < self.threshold:
+        return None
+
+      entry = self._entries[entry_id]
+      if time.time() - entry["created_at"] > self.ttl:
+        self._remove(entry_id)
+        return None
+      self._entries.move_to_end(entry_id)
+      return {"query": entry["query"], "answer": entry["answer"], "retrieved_docs": entry["retrieved_docs"], "score": score}
+
+  def add(self, query: str, answer: str, retrieved_docs: List[str], config: dict) -> None:
+    """
+      Store the answer & retrieved documents of a query
+    """
+    doc_key = self.get_doc_key(config)
+    embedding = self.embed_query(query, config)
+    with self._lock:
+      entry_id = self._next_id
+      self._next_id += 1
+      if doc_key not in self._indexes:
+        self._indexes[doc_key] = faiss.IndexIDMap(faiss.IndexFlatIP(self.dim))
+      self._indexes[doc_key].add_with_ids(embedding, np.array([entry_id], dtype=np.int64))
+      self._entries[entry_id] = {
+        "doc_key": doc_key,
+        "query": query,
+        "answer": answer,
+        "retrieved_docs": retrieved_docs,
+        "created_at": time.time()
+      }
+
+      # Evict least recently used entries
+      while len(self._entries) > self.max_entries:
+        self._remove(next(iter(self._entries)))
+
+  def invalidate(self, doc_id: str) -> None:
+    """
+      Drop every entry that depends on a document, e.g. when it is re-indexed
+    """
+    with self._lock:
+      for doc_key in [doc_key for doc_key in self._indexes if doc_id in doc_key.split(",")]:
+        del self._indexes[doc_key]
+      for entry_id in [entry_id for entry_id, entry in self._entries.items() if entry["doc_key"] not in self._indexes]:
+        del self._entries[entry_id]
+
+  def _remove(self, entry_id: int) -> None:
+    entry = self._entries.pop(entry_id)
+    index = self._indexes.get(entry["doc_key"])
+    if index is not None:
+      index.remove_ids(np.array([entry_id], dtype=np.int64))
+
+
+@lru_cache(maxsize=1)
+def get_semantic_cache() -> SemanticCache:
+  """
+    Return the process-wide semantic cache shared by all sessions
+  """
+  return SemanticCache()
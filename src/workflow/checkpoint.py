@@ -0,0 +1,372 @@
+import os
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+  WRITES_IDX_MAP,
+  BaseCheckpointSaver,
+  ChannelVersions,
+  Checkpoint,
+  CheckpointMetadata,
+  CheckpointTuple,
+  get_checkpoint_id,
+  get_checkpoint_metadata
+)
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.types import TASKS
+
+
+class SqliteDatabase:
+  """
+    SQLite connection shared by the threads of a process, other processes on the host can open the same file
+  """
+  blob_type = "BLOB"
+  float_type = "REAL"
+
+  def __init__(self, path: str = "../data/checkpoints.sqlite"):
+    self._lock = threading.Lock()
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("PRAGMA synchronous=NORMAL")
+
+  def execute(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+    with self._lock:
+      rows = self._conn.execute(sql, params).fetchall()
+      self._conn.commit()
+    return rows
+
+  def executemany(self, sql: str, rows: List[Sequence[Any]]) -> None:
+    with self._lock:
+      self._conn.executemany(sql, rows)
+      self._conn.commit()
+
+
+class PostgresDatabase:
+  """
+    Postgres connection, for checkpoints shared by app workers on several hosts
+  """
+  blob_type = "BYTEA"
+  float_type = "DOUBLE PRECISION"
+
+  def __init__(self, url: str):
+    import psycopg
+    self._lock = threading.Lock()
+    self._conn = psycopg.connect(url, autocommit=True)
+
+  def execute(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+    with self._lock:
+      cursor = self._conn.execute(sql.replace("?", "%s"), params)
+      return cursor.fetchall() if cursor.description else []
+
+  def executemany(self, sql: str, rows: List[Sequence[Any]]) -> None:
+    with self._lock, self._conn.cursor() as cursor:
+      cursor.executemany(sql.replace("?", "%s"), rows)
+
+
+class SQLCheckpointSaver(BaseCheckpointSaver[str]):
+  """
+    Durable LangGraph checkpointer on SQLite or Postgres. Checkpoints are serialized with the msgpack serializer
+    of LangGraph, only the `keep_last` latest checkpoints of a thread are kept & threads idle for `ttl` seconds are evicted
+  """
+  def __init__(
+    self,
+    database,
+    keep_last: Optional[int] = 2,
+    ttl: Optional[float] = 7 * 24 * 3600,
+    eviction_interval: float = 600
+  ):
+    super().__init__()
+    self.database = database
+    self.keep_last = keep_last # The parent checkpoint is needed to resume pending sends
+    self.ttl = ttl
+    self.eviction_interval = eviction_interval
+    self._last_eviction = 0.0
+    self.setup()
+
+  def setup(self) -> None:
+    blob_type, float_type = self.database.blob_type, self.database.float_type
+    self.database.execute(
+      f"""
+        CREATE TABLE IF NOT EXISTS checkpoints (
+          thread_id TEXT NOT NULL,
+          checkpoint_ns TEXT NOT NULL,
+          checkpoint_id TEXT NOT NULL,
+          parent_checkpoint_id TEXT,
+          type TEXT NOT NULL,
+          checkpoint {blob_type} NOT NULL,
+          metadata_type TEXT NOT NULL,
+          metadata {blob_type} NOT NULL,
+          PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+        )
+      """
+    )
+    self.database.execute(
+      f"""
+        CREATE TABLE IF NOT EXISTS checkpoint_writes (
+          thread_id TEXT NOT NULL,
+          checkpoint_ns TEXT NOT NULL,
+          checkpoint_id TEXT NOT NULL,
+          task_id TEXT NOT NULL,
+          idx INTEGER NOT NULL,
+          channel TEXT NOT NULL,
+          type TEXT NOT NULL,
+          value {blob_type} NOT NULL,
+          task_path TEXT NOT NULL,
+          PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+        )
+      """
+    )
+    self.database.execute(
+      f"""
+        CREATE TABLE IF NOT EXISTS checkpoint_threads (
+          thread_id TEXT PRIMARY KEY,
+          updated_at {float_type} NOT NULL
+        )
+      """
+    )
+    self.database.execute("CREATE INDEX IF NOT EXISTS checkpoint_threads_updated_at ON checkpoint_threads (updated_at)")
+
+  def _get_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[tuple]:
+    return self.database.execute(
+      """
+        SELECT task_id, channel, type, value, task_path, idx FROM checkpoint_writes
+        WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+        ORDER BY task_id, idx
+      """,
+      (thread_id, checkpoint_ns, checkpoint_id)
+    )
+
+  def _make_tuple(self, row: tuple, metadata: Optional[CheckpointMetadata] = None) -> CheckpointTuple:
+    thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata_value = row
+    writes = self._get_writes(thread_id, checkpoint_ns, checkpoint_id)
+
+    # Sends of the parent checkpoint are carried over to its child
+    sends = []
+    if parent_checkpoint_id:
+      parent_writes = self._get_writes(thread_id, checkpoint_ns, parent_checkpoint_id)
+      sends = sorted(
+        (write for write in parent_writes if write[1] == TASKS),
+        key=lambda write: (write[4], write[0], write[5])
+      )
+
+    return CheckpointTuple(
+      config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+      checkpoint={
+        **self.serde.loads_typed((type_, bytes(checkpoint))),
+        "pending_sends": [self.serde.loads_typed((write[2], bytes(write[3]))) for write in sends]
+      },
+      metadata=metadata if metadata is not None else self.serde.loads_typed((metadata_type, bytes(metadata_value))),
+      parent_config=(
+        {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_checkpoint_id}}
+        if parent_checkpoint_id
+        else None
+      ),
+      pending_writes=[(write[0], write[1], self.serde.loads_typed((write[2], bytes(write[3])))) for write in writes]
+    )
+
+  def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+    thread_id = config["configurable"]["thread_id"]
+    checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+    columns = "thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+    if checkpoint_id := get_checkpoint_id(config):
+      rows = self.database.execute(
+        f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+        (thread_id, checkpoint_ns, checkpoint_id)
+      )
+    else:
+      rows = self.database.execute(
+        f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1",
+        (thread_id, checkpoint_ns)
+      )
+    return self._make_tuple(rows[0]) if rows else None
+
+  def list(
+    self,
+    config: Optional[RunnableConfig],
+    *,
+    filter: Optional[Dict[str, Any]] = None,
+    before: Optional[RunnableConfig] = None,
+    limit: Optional[int] = None
+  ) -> Iterator[CheckpointTuple]:
+    conditions, params = [], []
+    if config:
+      conditions.append("thread_id = ?")
+      params.append(config["configurable"]["thread_id"])
+      if config["configurable"].get("checkpoint_ns") is not None:
+        conditions.append("checkpoint_ns = ?")
+        params.append(config["configurable"]["checkpoint_ns"])
+      if checkpoint_id := get_checkpoint_id(config):
+        conditions.append("checkpoint_id = ?")
+        params.append(checkpoint_id)
+    if before and (before_checkpoint_id := get_checkpoint_id(before)):
+      conditions.append("checkpoint_id < ?")
+      params.append(before_checkpoint_id)
+
+    sql = "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata FROM checkpoints"
+    if conditions:
+      sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY checkpoint_id DESC"
+    if limit is not None and not filter:
+      sql += f" LIMIT {int(limit)}"
+
+    count = 0
+    for row in self.database.execute(sql, params):
+      # Metadata is serialized, so it is filtered here
+      metadata = self.serde.loads_typed((row[6], bytes(row[7])))
+      if filter and not all(metadata.get(key) == value for key, value in filter.items()):
+        continue
+      if limit is not None and count >= limit:
+        break
+      count += 1
+      yield self._make_tuple(row, metadata)
+
+  def put(
+    self,
+    config: RunnableConfig,
+    checkpoint: Checkpoint,
+    metadata: CheckpointMetadata,
+    new_versions: ChannelVersions
+  ) -> RunnableConfig:
+    thread_id = config["configurable"]["thread_id"]
+    checkpoint_ns = config["configurable"]["checkpoint_ns"]
+    saved_checkpoint = checkpoint.copy()
+    saved_checkpoint.pop("pending_sends", None)
+    type_, value = self.serde.dumps_typed(saved_checkpoint)
+    metadata_type, metadata_value = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+    self.database.execute(
+      """
+        INSERT INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (thread_id, checkpoint_ns, checkpoint_id)
+        DO UPDATE SET type = excluded.type, checkpoint = excluded.checkpoint, metadata_type = excluded.metadata_type, metadata = excluded.metadata
+      """,
+      (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"), type_, value, metadata_type, metadata_value)
+    )
+    self.database.execute(
+      "INSERT INTO checkpoint_threads VALUES (?, ?) ON CONFLICT (thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+      (thread_id, time.time())
+    )
+    if self.keep_last:
+      self.prune(thread_id, checkpoint_ns)
+    if self.ttl and time.time() - self._last_eviction > self.eviction_interval:
+      self.evict_idle_threads()
+
+    return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+  def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+    thread_id = config["configurable"]["thread_id"]
+    checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+    checkpoint_id = config["configurable"]["checkpoint_id"]
+    rows, special_rows = [], []
+    for idx, (channel, value) in enumerate(writes):
+      idx = WRITES_IDX_MAP.get(channel, idx)
+      type_, value = self.serde.dumps_typed(value)
+      row = (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type_, value, task_path)
+      (rows if idx >= 0 else special_rows).append(row)
+
+    # Regular writes of a task are kept from its first attempt, special writes (errors, interrupts...) are replaced
+    sql = "INSERT INTO checkpoint_writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)"
+    if rows:
+      self.database.executemany(sql + " DO NOTHING", rows)
+    if special_rows:
+      self.database.executemany(sql + " DO UPDATE SET channel = excluded.channel, type = excluded.type, value = excluded.value", special_rows)
+
+  def prune(self, thread_id: str, checkpoint_ns: str = "") -> None:
+    """
+      Delete all but the `keep_last` latest checkpoints of a thread & their writes
+    """
+    self.database.execute(
+      """
+        DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+          SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT ?
+        )
+      """,
+      (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep_last)
+    )
+    self.database.execute(
+      """
+        DELETE FROM checkpoint_writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+          SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+        )
+      """,
+      (thread_id, checkpoint_ns, thread_id, checkpoint_ns)
+    )
+
+  def evict_idle_threads(self, ttl: Optional[float] = None) -> int:
+    """
+      Delete the threads without a checkpoint for `ttl` seconds & Return their number
+    """
+    self._last_eviction = time.time()
+    rows = self.database.execute("SELECT thread_id FROM checkpoint_threads WHERE updated_at < ?", (time.time() - (ttl or self.ttl),))
+    for (thread_id,) in rows:
+      self.delete_thread(thread_id)
+    return len(rows)
+
+  def delete_thread(self, thread_id: str) -> None:
+    for table in ("checkpoints", "checkpoint_writes", "checkpoint_threads"):
+      self.database.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+  # Database calls block, run them off the event loop
+  async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+    return await asyncio.to_thread(self.get_tuple, config)
+
+  async def alist(
+    self,
+    config: Optional[RunnableConfig],
+    *,
+    filter: Optional[Dict[str, Any]] = None,
+    before: Optional[RunnableConfig] = None,
+    limit: Optional[int] = None
+  ) -> AsyncIterator[CheckpointTuple]:
+    checkpoints = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+    for checkpoint in checkpoints:
+      yield checkpoint
+
+  async def aput(
+    self,
+    config: RunnableConfig,
+    checkpoint: Checkpoint,
+    metadata: CheckpointMetadata,
+    new_versions: ChannelVersions
+  ) -> RunnableConfig:
+    return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+  async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+    await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+  async def adelete_thread(self, thread_id: str) -> None:
+    await asyncio.to_thread(self.delete_thread, thread_id)
+
+  def get_next_version(self, current: Optional[str], channel) -> str:
+    # Same versions as the in-memory saver: an increasing counter with a random suffix
+    if current is None:
+      current_version = 0
+    elif isinstance(current, int):
+      current_version = current
+    else:
+      current_version = int(current.split(".")[0])
+    return f"{current_version + 1:032}.{random.random():016}"
+
+
+@lru_cache(maxsize=1)
+def get_checkpointer() -> BaseCheckpointSaver:
+  """
+    Return the process-wide checkpointer selected by the CHECKPOINTER environment variable:
+    sqlite (CHECKPOINT_DB_PATH), postgres (CHECKPOINT_DB_URL) or memory
+  """
+  backend = os.getenv("CHECKPOINTER", "sqlite")
+  if backend == "memory":
+    return MemorySaver()
+  ttl = float(os.getenv("CHECKPOINT_TTL", 7 * 24 * 3600)) # Seconds
+  if backend == "sqlite":
+    return SQLCheckpointSaver(SqliteDatabase(os.getenv("CHECKPOINT_DB_PATH", "../data/checkpoints.sqlite")), ttl=ttl)
+  if backend == "postgres":
+    return SQLCheckpointSaver(PostgresDatabase(os.environ["CHECKPOINT_DB_URL"]), ttl=ttl)
+  raise ValueError(f"Unknown checkpointer backend: {backend}")
@@ -1,4 +1,3 @@
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, START, END
 
 from .nodes import (
@@ -8,17 +7,33 @@ from .nodes import (
   document_retrieval,
   chatbot,
   summarize_conversation,
-  should_continue
+  should_continue,
+  aquery_routing,
+  route_query,
+  aquery_decompose,
+  adocument_retrieval,
+  achatbot,
+  asummarize_conversation,
+  query_analysis,
+  aquery_analysis,
+  route_analyzed_query
 )
 from .state import State
+from .checkpoint import get_checkpointer
 
 
-def get_graph_builder():
+def get_graph_builder(is_async: bool = False, combined_routing: bool = False):
   """
-    Build and return a compiled state graph for a conversational pipeline
+    Build and return a compiled state graph for a conversational pipeline.
+    With `combined_routing`, the query is classified & rewritten or decomposed by a single LLM call
   """
-  # Initialize short-term memory 
-  memory = MemorySaver()
+  if combined_routing:
+    return get_combined_graph_builder(is_async)
+  if is_async:
+    return get_async_graph_builder()
+
+  # Initialize short-term memory, persisted & shared by the sessions
+  memory = get_checkpointer()
 
   # Create graph
   graph = StateGraph(State)
@@ -34,8 +49,9 @@ def get_graph_builder():
     START,
     query_routing,
     {
-      "query_rewrite", "query_rewrite",
-      "query_decompose", "query_decompose"
+      "query_rewrite": "query_rewrite",
+      "query_decompose": "query_decompose",
+      "chatbot": "chatbot"
     }
   )
 
@@ -56,3 +72,88 @@ def get_graph_builder():
   graph_builder = graph.compile(checkpointer=memory)
 
   return graph_builder
+
+
+def get_async_graph_builder():
+  """
+    Build and return a compiled state graph whose nodes are coroutines, to be driven by `ainvoke`/`astream`
+  """
+  # Initialize short-term memory, persisted & shared by the sessions
+  memory = get_checkpointer()
+
+  # Create graph
+  graph = StateGraph(State)
+  graph.add_node("query_routing", aquery_routing)
+  graph.add_node("query_decompose", aquery_decompose)
+  graph.add_node("document_retrieval", adocument_retrieval)
+  graph.add_node("chatbot", achatbot)
+  graph.add_node("summarize_conversation", asummarize_conversation)
+
+  graph.add_edge(START, "query_routing")
+  graph.add_conditional_edges(
+    "query_routing",
+    route_query,
+    {
+      "document_retrieval": "document_retrieval",
+      "query_decompose": "query_decompose",
+      "chatbot": "chatbot"
+    }
+  )
+
+  graph.add_edge("query_decompose", "document_retrieval")
+  graph.add_edge("document_retrieval", "chatbot")
+
+  graph.add_conditional_edges(
+    "chatbot",
+    should_continue,
+    {
+      "summarize_conversation": "summarize_conversation",
+      END: END
+    }
+  )
+
+  graph.add_edge("summarize_conversation", END)
+  graph_builder = graph.compile(checkpointer=memory)
+
+  return graph_builder
+
+
+def get_combined_graph_builder(is_async: bool = False):
+  """
+    Build and return a compiled state graph whose query analysis node goes straight to the document retrieval
+  """
+  # Initialize short-term memory, persisted & shared by the sessions
+  memory = get_checkpointer()
+
+  # Create graph
+  graph = StateGraph(State)
+  graph.add_node("query_analysis", aquery_analysis if is_async else query_analysis)
+  graph.add_node("document_retrieval", adocument_retrieval if is_async else document_retrieval)
+  graph.add_node("chatbot", achatbot if is_async else chatbot)
+  graph.add_node("summarize_conversation", asummarize_conversation if is_async else summarize_conversation)
+
+  graph.add_edge(START, "query_analysis")
+  graph.add_conditional_edges(
+    "query_analysis",
+    route_analyzed_query,
+    {
+      "document_retrieval": "document_retrieval",
+      "chatbot": "chatbot"
+    }
+  )
+
+  graph.add_edge("document_retrieval", "chatbot")
+
+  graph.add_conditional_edges(
+    "chatbot",
+    should_continue,
+    {
+      "summarize_conversation": "summarize_conversation",
+      END: END
+    }
+  )
+
+  graph.add_edge("summarize_conversation", END)
+  graph_builder = graph.compile(checkpointer=memory)
+
+  return graph_builder
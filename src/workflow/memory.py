@@ -0,0 +1,145 @@
+import asyncio
+from functools import lru_cache
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.messages import BaseMessage, HumanMessage, RemoveMessage
+from .state import State
+from ..rag.retriever import count_tokens
+from ..utils import get_event_loop, trace_span
+
+
+def get_message_tokens(message: BaseMessage, message_tokens: Dict[str, int]) -> int:
+  """
+    Return the token count of a message, counted once & then stored in the state
+  """
+  if message.id in message_tokens:
+    return message_tokens[message.id]
+  return count_tokens(message.content if isinstance(message.content, str) else str(message.content))
+
+
+def count_new_messages(messages: List[BaseMessage], message_tokens: Dict[str, int]) -> Dict[str, int]:
+  """
+    Return the token counts of the messages not counted yet, to be stored in the state
+  """
+  return {message.id: get_message_tokens(message, message_tokens) for message in messages if message.id and message.id not in message_tokens}
+
+
+def get_history_tokens(state: State) -> int:
+  message_tokens = state.get("message_tokens") or {}
+  return sum(get_message_tokens(message, message_tokens) for message in state["messages"])
+
+
+def get_history_window(state: State, max_tokens: int = 2000) -> List[BaseMessage]:
+  """
+    Return the most recent messages fitting in the token budget, always including the last message.
+    Older messages are covered by the conversation summary
+  """
+  message_tokens = state.get("message_tokens") or {}
+  window = []
+  total = 0
+  for message in reversed(state["messages"]):
+    num_tokens = get_message_tokens(message, message_tokens)
+    if window and total + num_tokens > max_tokens:
+      break
+    window.append(message)
+    total += num_tokens
+  window.reverse()
+
+  # Start the window with a user message
+  while len(window) > 1 and not isinstance(window[0], HumanMessage):
+    window.pop(0)
+  return window
+
+
+def should_summarize(state: State, max_tokens: int = 3000) -> bool:
+  return len(state["messages"]) > 2 and get_history_tokens(state) > max_tokens
+
+
+def get_summarization_input(state: State, keep_tokens: int = 1000) -> Tuple[List[BaseMessage], List[BaseMessage]]:
+  """
+    Return the messages to fold into the summary, i.e. the ones older than the recent window,
+    & the messages to send to the LLM to extend the previous summary with them
+  """
+  # Retain at least the 2 recent messages, so that the next query still has its prior context
+  num_recent = max(len(get_history_window(state, keep_tokens)), 2)
+  old_messages = state["messages"][:max(len(state["messages"]) - num_recent, 0)]
+  summary = state["summary"] if "summary" in state else ""
+  if summary:
+    summary_message = (
+      f"This is the summary of the conversation to date: {summary}\n"
+      "Extend the summary by taking into account the new messages above:"
+    )
+  else:
+    summary_message = "Create a summary of the conversation above:"
+  return old_messages, old_messages + [HumanMessage(content=summary_message)]
+
+
+def get_summary_update(summary: str, old_messages: List[BaseMessage]) -> Dict[str, Any]:
+  """
+    Replace the summarized messages by the new summary
+  """
+  return {
+    "summary": summary,
+    "messages": [RemoveMessage(id=message.id) for message in old_messages],
+    "message_tokens": {message.id: None for message in old_messages}
+  }
+
+
+def summarize_history(state: State, config: dict) -> Dict[str, Any]:
+  llm = config["configurable"]["llm"]
+  old_messages, messages = get_summarization_input(state, config["configurable"].get("memory_keep_tokens", 1000))
+  if not old_messages:
+    return {}
+  response = llm.invoke(messages)
+  return get_summary_update(response.content, old_messages)
+
+
+async def asummarize_history(state: State, config: dict) -> Dict[str, Any]:
+  llm = config["configurable"]["llm"]
+  old_messages, messages = get_summarization_input(state, config["configurable"].get("memory_keep_tokens", 1000))
+  if not old_messages:
+    return {}
+  response = await llm.ainvoke(messages)
+  return get_summary_update(response.content, old_messages)
+
+
+class BackgroundSummarizer:
+  """
+    Summarize conversations on the shared event loop after the answer is returned, instead of before.
+    The next turn of a conversation waits for its pending summarization, which is usually done by then
+  """
+  def __init__(self):
+    self._futures: Dict[str, Future] = {}
+
+  def schedule(self, graph_builder, config: dict) -> None:
+    thread_id = config["configurable"]["thread_id"]
+    # The turn is over, so the summarization is not recorded in its trace
+    summary_config = {"configurable": {**config["configurable"], "trace": None}}
+    self._futures[thread_id] = asyncio.run_coroutine_threadsafe(self._summarize(graph_builder, summary_config), get_event_loop())
+
+  def wait(self, config: dict, timeout: Optional[float] = None) -> None:
+    """
+      Wait for the pending summarization of the conversation & Record its failure in the trace of the current turn.
+      A failed summarization leaves the history as it was, so the turn goes on with the full history
+    """
+    future = self._futures.pop(config["configurable"]["thread_id"], None)
+    if future is None:
+      return
+    with trace_span(config, "memory.summarize_wait") as span:
+      try:
+        future.result(timeout)
+      except Exception as e:
+        span.set("error", repr(e))
+
+  async def _summarize(self, graph_builder, config: dict) -> None:
+    state = (await graph_builder.aget_state(config)).values
+    if not should_summarize(state, config["configurable"].get("memory_max_tokens", 3000)):
+      return
+    update = await asummarize_history(state, config)
+    if update:
+      await graph_builder.aupdate_state(config, update, as_node="summarize_conversation")
+
+
+@lru_cache(maxsize=1)
+def get_background_summarizer() -> BackgroundSummarizer:
+  return BackgroundSummarizer()
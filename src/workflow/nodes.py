@@ -1,19 +1,25 @@
 from langchain_core.output_parsers import BaseOutputParser
 from langchain_core.output_parsers import JsonOutputParser
-from langchain_core.messages import HumanMessage, AIMessage, RemoveMessage
+from langchain_core.messages import AIMessage
 from langgraph.graph import END
 
-import re
+import time
+import asyncio
 from typing import Any, Dict, List
 from .state import State
 from ..rag import (
   query_routing_prompt,
   multi_query_decompose_prompt,
   multi_query_rewrite_prompt,
+  query_analysis_prompt,
   generate_prompt,
-  CustomMultiQueryRetriever
+  CustomMultiQueryRetriever,
+  pack_context
 )
-from ..utils import clean_text
+from ..rag.embedding import embed_texts
+from ..utils import clean_text, trace_node, trace_span, FenceStripper
+from .router import log_routing_decision
+from .memory import get_history_window, count_new_messages, should_summarize, summarize_history, asummarize_history
 
 
 class LineListOutputParser(BaseOutputParser[List[str]]):
@@ -25,65 +31,112 @@ class LineListOutputParser(BaseOutputParser[List[str]]):
   
 
 # Define the query routing node
+@trace_node
 def query_routing(state: State, config: dict):
   llm = config["configurable"]["llm"]
   query = state["messages"][-1].content
   summary = state["summary"] if "summary" in state else ""
+  history = get_history_window(state, config["configurable"].get("history_max_tokens", 2000))
 
-  query_routing_chain = query_routing_prompt | llm | JsonOutputParser()
-  query_class = query_routing_chain.invoke({"summary": summary, "messages": state["messages"], "query": query})
+  # Use the local router when it is confident, else ask the LLM
+  router = config["configurable"].get("router")
+  query_class = router.route(query, len(state["messages"]), config) if router is not None else None
+  if query_class is None:
+    query_routing_chain = query_routing_prompt | llm | JsonOutputParser()
+    query_class = query_routing_chain.invoke({"summary": summary, "messages": history, "query": query})["class"]
+    log_routing_decision(query, query_class, len(state["messages"]))
 
-  if query_class["class"] == "no-retrieve" and len(state["messages"]) >= 3:
+  if query_class == "no-retrieve" and len(state["messages"]) >= 3:
     return "chatbot"
-  if query_class["class"] == "simple" or (query_class["class"] == "no-retrieve" and len(state["messages"]) < 3):
+  if query_class == "simple" or (query_class == "no-retrieve" and len(state["messages"]) < 3):
     return "query_rewrite" 
-  if query_class["class"] == "complex":
+  if query_class == "complex":
     return "query_decompose"
 
 
 # Define the query rewrite node
+@trace_node
 def query_rewrite(state: State, config: dict) -> Dict[str, Any]:
   llm = config["configurable"]["llm"]
   query = state["messages"][-1].content
   summary = state["summary"] if "summary" in state else ""
+  history = get_history_window(state, config["configurable"].get("history_max_tokens", 2000))
 
   output_parser = LineListOutputParser()
   multi_query_rewrite_chain = multi_query_rewrite_prompt | llm | output_parser
 
-  rewritten_queries = multi_query_rewrite_chain.invoke({"summary": summary, "messages": state["messages"], "query": query})
+  rewritten_queries = multi_query_rewrite_chain.invoke({"summary": summary, "messages": history, "query": query})
   rewritten_queries = [clean_text(rewritten_query) for rewritten_query in rewritten_queries]
   return {"rewritten_queries": rewritten_queries}
 
 
 # Define the query decompose node
+@trace_node
 def query_decompose(state: State, config: dict) -> Dict[str, Any]:
   llm = config["configurable"]["llm"]
   query = state["messages"][-1].content
   summary = state["summary"] if "summary" in state else ""
+  history = get_history_window(state, config["configurable"].get("history_max_tokens", 2000))
 
   output_parser = LineListOutputParser()
   multi_query_decompose_chain = multi_query_decompose_prompt | llm | output_parser
 
-  rewritten_queries = multi_query_decompose_chain.invoke({"summary": summary, "messages": state["messages"], "query": query})
+  rewritten_queries = multi_query_decompose_chain.invoke({"summary": summary, "messages": history, "query": query})
   rewritten_queries = [clean_text(rewritten_query) for rewritten_query in rewritten_queries]
   return {"rewritten_queries": rewritten_queries}
 
 
+def get_retrieval_queries(state: State, config: dict) -> List[str]:
+  """
+    Return the queries to search: the rewritten or decomposed queries, & the user query itself if enabled
+  """
+  queries = list(state["rewritten_queries"])
+  if config["configurable"].get("include_original_query", False):
+    queries.append(clean_text(state["messages"][-1].content))
+  return list(dict.fromkeys(queries))
+
+
+async def aspeculative_retrieval(query: str, config: dict) -> None:
+  """
+    Embed & search the user query while the LLM routes or rewrites it, so that the retrieval node finds it
+    in the retrieval cache, or only embed it into the embedding cache when there is no retrieval cache.
+    Local & cheap, so it is worth doing even when no retrieval follows
+  """
+  configurable = config["configurable"]
+  if not configurable.get("include_original_query", False):
+    return
+  with trace_span(config, "retrieval.speculative") as span:
+    try:
+      if configurable.get("retrieval_cache") is not None:
+        retriever = CustomMultiQueryRetriever(queries=[query], config=config)
+        await asyncio.to_thread(retriever.retrieve_candidates_batch, [clean_text(query)])
+      elif configurable.get("embedding_cache") is not None:
+        await asyncio.to_thread(embed_texts, [clean_text(query)], config)
+    except Exception as e:
+      # Only time is lost, the retrieval node searches the query again & reports its own failures
+      span.set("error", repr(e))
+
+
 # Define the document retrieval node
+@trace_node
 def document_retrieval(state: State, config: dict) -> Dict[str, Any]:
-  rewritten_queries = state["rewritten_queries"]
- 
   # Retrieve relevant documents
-  retriever = CustomMultiQueryRetriever(queries=rewritten_queries, config=config)
-  retrieved_docs = retriever.get_relevant_documents()
+  retriever = CustomMultiQueryRetriever(queries=get_retrieval_queries(state, config), config=config)
+  retrieved_hits = retriever.get_relevant_hits()
+
+  # Pack the most relevant passages into the token budget of the generation prompt
+  with trace_span(config, "retrieval.pack_context", hits=len(retrieved_hits)):
+    retrieved_docs = pack_context(retrieved_hits, config["configurable"].get("context_max_tokens", 4000))
 
   return {"retrieved_docs": retrieved_docs}
 
 
 # Define the chatbot node
+@trace_node
 def chatbot(state: State, config: dict) -> Dict[str, Any]:
   llm = config["configurable"]["llm"]
   summary = state["summary"] if "summary" in state else ""
+  history = get_history_window(state, config["configurable"].get("history_max_tokens", 2000))
   retrieved_docs = state["retrieved_docs"] if "retrieved_docs" in state else ""
   retrieved_docs_text = "Document:\n\n".join([doc for doc in retrieved_docs])
 
@@ -91,35 +144,231 @@ def chatbot(state: State, config: dict) -> Dict[str, Any]:
     summary=summary,
     retrieved_docs_text=retrieved_docs_text
   )
-  messages += state["messages"]
-  res = llm.invoke(messages)
-  res_text = res.content
-  res_text = re.sub(r"```markdown|```", "", res_text).strip()
-  return {"messages": [AIMessage(content=res_text)]}
+  messages += history
+
+  # Stream the tokens, so that `stream_mode="messages"` delivers them as they are generated
+  fence_stripper = FenceStripper()
+  res_text, message_id, first_token_time = "", None, None
+  with trace_span(config, "chatbot.generate") as span:
+    start = time.perf_counter()
+    for chunk in llm.stream(messages):
+      if first_token_time is None:
+        first_token_time = time.perf_counter() - start
+        span.set("time_to_first_token_ms", round(first_token_time * 1000, 2))
+      message_id = chunk.id
+      res_text += fence_stripper.feed(chunk.content)
+    res_text += fence_stripper.flush()
+
+  # Reuse the id of the streamed chunks, so the final message is not streamed a second time
+  answer = AIMessage(content=res_text, id=message_id)
+  message_tokens = count_new_messages(state["messages"] + [answer], state.get("message_tokens") or {})
+  return {"messages": [answer], "message_tokens": message_tokens}
 
 
 # Define the node to summarize the conversation
+# Messages older than the recent window are folded into the summary, so the summarized input stays bounded
+@trace_node
 def summarize_conversation(state: State, config: dict) -> Dict[str, Any]:
-  llm = config["configurable"]["llm"]
-  summary = state["summary"] if "summary" in state else ""
-  if summary:
-    summary_message = (
-      f"This is the summary of the conversation to date: {summary}\n"
-      "Extend the summary by taking into account the new messages above:"
-    )
-  else:
-    summary_message = "Create a summary of the conversation above:"
-
-  messages = state["messages"][:-2] + [HumanMessage(content=summary_message)]
-  response = llm.invoke(messages)
-  messages = [RemoveMessage(id=message.id) for message in state["messages"][:-2]] # Retain 2 recent messages
-  return {"summary": response.content, "messages": messages}
+  return summarize_history(state, config)
 
 
 # Define the node to continue or stop the summarization
-def should_continue(state) -> Any:
-  maximum_messages = 6 # Summarize the conversation when the number of messages is 6
-  messages = state["messages"]
-  if len(messages) > maximum_messages:
+def should_continue(state: State, config: dict) -> Any:
+  # With background summarization, the conversation is summarized after the answer is returned
+  if config["configurable"].get("background_summarization"):
+    return END
+  if should_summarize(state, config["configurable"].get("memory_max_tokens", 3000)):
     return "summarize_conversation"
   return END
+
+
+# Define the async query routing node
+# With `include_original_query`, the user query is embedded & searched while the LLM routes or rewrites it
+@trace_node
+async def aquery_routing(state: State, config: dict) -> Dict[str, Any]:
+  llm = config["configurable"]["llm"]
+  query = state["messages"][-1].content
+  summary = state["summary"] if "summary" in state else ""
+  history = get_history_window(state, config["configurable"].get("history_max_tokens", 2000))
+  inputs = {"summary": summary, "messages": history, "query": query}
+
+  query_routing_chain = query_routing_prompt | llm | JsonOutputParser()
+  multi_query_rewrite_chain = multi_query_rewrite_prompt | llm | LineListOutputParser()
+
+  # Use the local router when it is confident, else ask the LLM
+  router = config["configurable"].get("router")
+  query_class = None
+  if router is not None:
+    query_class = await asyncio.to_thread(router.route, query, len(state["messages"]), config)
+  if query_class == "complex" or (query_class == "no-retrieve" and len(state["messages"]) >= 3):
+    return {"query_class": query_class} # No rewriting needed, decomposed queries are searched together
+
+  speculation = asyncio.ensure_future(aspeculative_retrieval(query, config))
+  try:
+    rewritten_queries = None
+    if query_class is None:
+      if config["configurable"].get("speculative_rewrite"):
+        # Rewrite while the LLM routes the query, since "simple" is the most common class.
+        # Saves a round trip for simple queries, but costs a wasted LLM call for the others
+        routing, rewritten_queries = await asyncio.gather(
+          query_routing_chain.ainvoke(inputs),
+          multi_query_rewrite_chain.ainvoke(inputs)
+        )
+      else:
+        routing = await query_routing_chain.ainvoke(inputs)
+      query_class = routing["class"]
+      log_routing_decision(query, query_class, len(state["messages"]))
+      if query_class == "complex" or (query_class == "no-retrieve" and len(state["messages"]) >= 3):
+        return {"query_class": query_class}
+
+    if rewritten_queries is None:
+      rewritten_queries = await multi_query_rewrite_chain.ainvoke(inputs)
+  finally:
+    await speculation
+
+  rewritten_queries = [clean_text(rewritten_query) for rewritten_query in rewritten_queries]
+  return {"query_class": query_class, "rewritten_queries": rewritten_queries}
+
+
+# Define the edge to route the query after the async query routing node
+def route_query(state: State) -> str:
+  query_class = state["query_class"]
+  if query_class == "no-retrieve" and len(state["messages"]) >= 3:
+    return "chatbot"
+  if query_class == "complex":
+    return "query_decompose"
+  return "document_retrieval" # Rewritten queries are already available
+
+
+# Define the async query decompose node
+@trace_node
+async def aquery_decompose(state: State, config: dict) -> Dict[str, Any]:
+  llm = config["configurable"]["llm"]
+  query = state["messages"][-1].content
+  summary = state["summary"] if "summary" in state else ""
+  history = get_history_window(state, config["configurable"].get("history_max_tokens", 2000))
+
+  output_parser = LineListOutputParser()
+  multi_query_decompose_chain = multi_query_decompose_prompt | llm | output_parser
+
+  rewritten_queries = await multi_query_decompose_chain.ainvoke({"summary": summary, "messages": history, "query": query})
+  rewritten_queries = [clean_text(rewritten_query) for rewritten_query in rewritten_queries]
+  return {"rewritten_queries": rewritten_queries}
+
+
+# Define the async document retrieval node
+@trace_node
+async def adocument_retrieval(state: State, config: dict) -> Dict[str, Any]:
+  # Embedding, search & reranking are blocking calls, run them off the event loop
+  retriever = CustomMultiQueryRetriever(queries=get_retrieval_queries(state, config), config=config)
+  retrieved_hits = await asyncio.to_thread(retriever.get_relevant_hits)
+
+  # Pack the most relevant passages into the token budget of the generation prompt
+  with trace_span(config, "retrieval.pack_context", hits=len(retrieved_hits)):
+    retrieved_docs = pack_context(retrieved_hits, config["configurable"].get("context_max_tokens", 4000))
+
+  return {"retrieved_docs": retrieved_docs}
+
+
+# Define the async chatbot node
+@trace_node
+async def achatbot(state: State, config: dict) -> Dict[str, Any]:
+  llm = config["configurable"]["llm"]
+  summary = state["summary"] if "summary" in state else ""
+  history = get_history_window(state, config["configurable"].get("history_max_tokens", 2000))
+  retrieved_docs = state["retrieved_docs"] if "retrieved_docs" in state else ""
+  retrieved_docs_text = "Document:\n\n".join([doc for doc in retrieved_docs])
+
+  messages = generate_prompt.format_messages(
+    summary=summary,
+    retrieved_docs_text=retrieved_docs_text
+  )
+  messages += history
+
+  # Stream the tokens, so that `stream_mode="messages"` delivers them as they are generated
+  fence_stripper = FenceStripper()
+  res_text, message_id, first_token_time = "", None, None
+  with trace_span(config, "chatbot.generate") as span:
+    start = time.perf_counter()
+    async for chunk in llm.astream(messages):
+      if first_token_time is None:
+        first_token_time = time.perf_counter() - start
+        span.set("time_to_first_token_ms", round(first_token_time * 1000, 2))
+      message_id = chunk.id
+      res_text += fence_stripper.feed(chunk.content)
+    res_text += fence_stripper.flush()
+
+  # Reuse the id of the streamed chunks, so the final message is not streamed a second time
+  answer = AIMessage(content=res_text, id=message_id)
+  message_tokens = count_new_messages(state["messages"] + [answer], state.get("message_tokens") or {})
+  return {"messages": [answer], "message_tokens": message_tokens}
+
+
+# Define the async node to summarize the conversation
+@trace_node
+async def asummarize_conversation(state: State, config: dict) -> Dict[str, Any]:
+  return await asummarize_history(state, config)
+
+
+def get_query_analysis(analysis: Dict[str, Any], state: State) -> Dict[str, Any]:
+  """
+    Turn the output of the combined query analysis prompt into the query class & rewritten queries of the state
+  """
+  query_class = analysis.get("class", "simple")
+  if query_class == "no-retrieve" and len(state["messages"]) >= 3:
+    return {"query_class": query_class, "rewritten_queries": []}
+
+  # Without a prior context, "no-retrieve" is handled as "simple". Fall back to the user query if no query was generated
+  rewritten_queries = [clean_text(rewritten_query) for rewritten_query in analysis.get("queries") or [] if rewritten_query.strip()]
+  if not rewritten_queries:
+    rewritten_queries = [clean_text(state["messages"][-1].content)]
+  return {"query_class": query_class, "rewritten_queries": rewritten_queries}
+
+
+# Define the query analysis node, which classifies & rewrites or decomposes the query in a single LLM call
+@trace_node
+def query_analysis(state: State, config: dict) -> Dict[str, Any]:
+  llm = config["configurable"]["llm"]
+  query = state["messages"][-1].content
+  summary = state["summary"] if "summary" in state else ""
+  history = get_history_window(state, config["configurable"].get("history_max_tokens", 2000))
+
+  # A confident local router can only save the LLM call when the query needs no retrieval
+  router = config["configurable"].get("router")
+  if router is not None and len(state["messages"]) >= 3 and router.route(query, len(state["messages"]), config) == "no-retrieve":
+    return {"query_class": "no-retrieve", "rewritten_queries": []}
+
+  query_analysis_chain = query_analysis_prompt | llm | JsonOutputParser()
+  analysis = query_analysis_chain.invoke({"summary": summary, "messages": history, "query": query})
+  log_routing_decision(query, analysis.get("class", "simple"), len(state["messages"]))
+  return get_query_analysis(analysis, state)
+
+
+# Define the async query analysis node
+@trace_node
+async def aquery_analysis(state: State, config: dict) -> Dict[str, Any]:
+  llm = config["configurable"]["llm"]
+  query = state["messages"][-1].content
+  summary = state["summary"] if "summary" in state else ""
+  history = get_history_window(state, config["configurable"].get("history_max_tokens", 2000))
+
+  router = config["configurable"].get("router")
+  if router is not None and len(state["messages"]) >= 3:
+    if await asyncio.to_thread(router.route, query, len(state["messages"]), config) == "no-retrieve":
+      return {"query_class": "no-retrieve", "rewritten_queries": []}
+
+  # Embed & search the user query while the LLM analyzes it, if it is searched too
+  query_analysis_chain = query_analysis_prompt | llm | JsonOutputParser()
+  analysis, _ = await asyncio.gather(
+    query_analysis_chain.ainvoke({"summary": summary, "messages": history, "query": query}),
+    aspeculative_retrieval(query, config)
+  )
+  log_routing_decision(query, analysis.get("class", "simple"), len(state["messages"]))
+  return get_query_analysis(analysis, state)
+
+
+# Define the edge to route the query after the query analysis node
+def route_analyzed_query(state: State) -> str:
+  if state["query_class"] == "no-retrieve" and len(state["messages"]) >= 3:
+    return "chatbot"
+  return "document_retrieval" # Rewritten or decomposed queries are already available
@@ -0,0 +1,86 @@
+import os
+import joblib
+import numpy as np
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from sklearn.linear_model import LogisticRegression
+from ..rag.embedding import embed_texts
+from ..utils import clean_text, clean_texts, get_jsonl_writer, read_jsonl
+
+
+def get_features(embeddings: List[np.ndarray], has_history: List[bool]) -> np.ndarray:
+  """
+    Concatenate query embeddings with whether there is a previous conversation, which "no-retrieve" depends on
+  """
+  return np.hstack([np.asarray(embeddings, dtype=np.float32), np.asarray(has_history, dtype=np.float32)[:, None]])
+
+
+def log_routing_decision(query: str, query_class: str, num_messages: int, path: str = "../data/router/decisions.jsonl") -> None:
+  """
+    Append a routing decision of the LLM to the training data of the local router
+  """
+  get_jsonl_writer(path).write({"query": query, "class": query_class, "num_messages": num_messages})
+
+
+def load_routing_decisions(path: str = "../data/router/decisions.jsonl") -> List[dict]:
+  return list(read_jsonl(path))
+
+
+class LocalRouter:
+  """
+    Logistic regression over BGE-M3 dense query embeddings, predicting the class the LLM router would choose.
+    Predictions below `threshold` probability are left to the LLM
+  """
+  def __init__(self, model: Optional[LogisticRegression] = None, threshold: float = 0.8):
+    self.model = model
+    self.threshold = threshold
+
+  def fit(self, queries: List[str], num_messages: List[int], classes: List[str], config: dict) -> "LocalRouter":
+    embeddings = embed_texts(clean_texts(queries), config)["dense"]
+    features = get_features(embeddings, [count >= 3 for count in num_messages])
+    self.model = LogisticRegression(max_iter=1000, class_weight="balanced")
+    self.model.fit(features, classes)
+    return self
+
+  def predict(self, query: str, num_messages: int, config: dict) -> Tuple[str, float]:
+    """
+      Return the predicted class of a query & its probability
+    """
+    embedding = embed_texts([clean_text(query)], config)["dense"]
+    probabilities = self.model.predict_proba(get_features(embedding, [num_messages >= 3]))[0]
+    best = int(np.argmax(probabilities))
+    return self.model.classes_[best], float(probabilities[best])
+
+  def route(self, query: str, num_messages: int, config: dict) -> Optional[str]:
+    """
+      Return the predicted class when the router is confident enough, else None
+    """
+    if self.model is None:
+      return None
+    query_class, probability = self.predict(query, num_messages, config)
+    if probability < self.threshold:
+      return None
+    return query_class
+
+  def save(self, path: str = "../data/router/router.joblib") -> None:
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump({"model": self.model, "threshold": self.threshold}, path)
+
+  @classmethod
+  def load(cls, path: str = "../data/router/router.joblib") -> Optional["LocalRouter"]:
+    """
+      Load a trained router, or return None when none has been trained yet
+    """
+    if not os.path.exists(path):
+      return None
+    data = joblib.load(path)
+    return cls(model=data["model"], threshold=data["threshold"])
+
+
+@lru_cache(maxsize=1)
+def get_local_router() -> Optional[LocalRouter]:
+  """
+    Return the process-wide local router, None until one has been trained
+  """
+  return LocalRouter.load()
@@ -1,8 +1,24 @@
-from typing import List
+from typing import Annotated, Dict, List, Optional
 from langgraph.graph import MessagesState
 
+
+def merge_token_counts(left: Dict[str, int], right: Dict[str, Optional[int]]) -> Dict[str, int]:
+  """
+    Merge the token counts of new messages, a count of None drops the count of a removed message
+  """
+  merged = dict(left or {})
+  for message_id, num_tokens in (right or {}).items():
+    if num_tokens is None:
+      merged.pop(message_id, None)
+    else:
+      merged[message_id] = num_tokens
+  return merged
+
+
 # Define the state of the graph
 class State(MessagesState):
   rewritten_queries: str = [] # The rewritten query of the original query
   retrieved_docs: List[str] = [] # The most relevant documents to the query
   summary: str = "" # A summary of the conversation
+  query_class: str = "" # The class of the query decided by the router
+  message_tokens: Annotated[Dict[str, int], merge_token_counts] # The token count of each message by id